@@ -1,9 +1,16 @@
 # Import Flask
-from flask import Flask,request,jsonify
+from flask import Flask,request,jsonify,Response,stream_with_context,g,send_file
+from flask.json.provider import DefaultJSONProvider
 
 # Import pandas
 import pandas as pd
 
+# Import threading
+import threading
+
+# Import time
+import time
+
 # Import psycopg2
 import psycopg2
 
@@ -11,66 +18,352 @@ import psycopg2
 from utils.refinery_db_io import REFINERY_DB_CONFIG_TEST
 
 # Import get_db_engine
-from utils.refinery_db_io import get_db_engine
+from utils.refinery_db_io import get_db_engine, get_engine_config
+
+# Import the pool metrics
+from utils.refinery_db_pool import get_pool_stats
 
 # Import the class
 from utils.refinery_db_io import Refinery
 
+# Import the read path
+from utils.refinery_db_io import select_refineries, fetch_refineries
+
+# Import the table version
+from utils.refinery_db_io import get_table_version, bump_table_version
+
+# Import the summary
+from utils.refinery_db_io import select_refinery_summary, update_refinery_summary
+
+# Import the bulk insert
+from utils.refinery_db_io import insert_refineries
+
+# Import the single statement updates and deletes
+from utils.refinery_db_io import update_refineries, delete_refineries
+
+# Import the result cache
+from utils.refinery_result_cache import ResultCache
+
+# Import the name search
+from utils.refinery_search import TrigramIndex, has_trigram_index, search_refineries
+
+# Import the typeahead index
+from utils.refinery_suggest import SuggestIndex, SUGGEST_REFRESH_INTERVAL
+
+# Import the metrics
+from utils.refinery_metrics import MetricsRegistry, Gauge, Histogram, ROW_BUCKETS, METRICS_CONTENT_TYPE, \
+    instrument_engine, start_request_timing, add_request_time, stop_request_timing
+
+# Import the profiling
+from utils.refinery_profiling import PROFILE_HEADER, PROFILE_PARAMETER, PROFILE_LIMIT, PROFILE_SORT_KEYS, \
+    RequestProfiler, get_profile_config, is_admin, format_profile, log_slow_queries
+
+# Import the request handling shared with the async app
+from utils.refinery_api import EXPORT_BATCH_SIZE, EXPORT_COLUMNS, EXPORT_MIMETYPES, MAX_BULK_SIZE, \
+    FILTER_CACHE_SIZE, FILTER_CACHE_TTL, TABLE_VERSION_TTL, READ_CACHE_CONTROL
+from utils.refinery_api import get_page_parameters, page_refinery_query, split_page, get_required_filter_conditions, filter_refinery_query, \
+    get_filter_cache_key, get_etag, get_group_by, get_search_parameters, get_suggest_parameters, format_export_batch, get_update_values, parse_bulk_body, check_refineries
+
 # Import sessionmaker
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy import and_
+
+
+# Metrics of the process, exposed by the metrics route
+metrics = MetricsRegistry()
+request_seconds = metrics.register(Histogram("refinery_http_request_duration_seconds", "Latency of the requests", ("method", "route", "status")))
+request_phase_seconds = metrics.register(Histogram("refinery_http_request_phase_seconds",
+                                                   "Latency of the requests split in SQL statements, JSON serialization and the rest, ORM included",
+                                                   ("method", "route", "phase")))
+requests_in_flight = metrics.register(Gauge("refinery_http_requests_in_flight", "Requests being served", ("method", "route")))
+statement_seconds = metrics.register(Histogram("refinery_sql_statement_duration_seconds", "Duration of the SQL statements", ("statement",)))
+statement_rows = metrics.register(Histogram("refinery_sql_statement_rows", "Rows returned or changed by the SQL statements", ("statement",), ROW_BUCKETS))
 
+# Profiling on demand and slow query log, configured by the REFINERY_PROFILE_* and REFINERY_SLOW_QUERY_MS environment variables
+profile_config = get_profile_config()
+request_profiler = RequestProfiler(profile_config["directory"], profile_config["sample_rate"])
+
+# Database engine, its configuration and session factory of the process, set by init_engine
+engine = None
+engine_config = None
+Session = None
+
+# Latest slow statements of the engine
+slow_queries = None
+
+# True if the database searches the names with pg_trgm, looked up on the first search
+trigram_search = None
+
+
+def init_engine()->None:
+    '''
+    Title: init_engine
+    Description: This function creates the database engine and the session factory of the process, configured by the REFINERY_DB_* environment variables.
+        A worker forked from a process that already has an engine calls it again, the inherited pool is dropped without closing the connections of the parent.
+    Args: None
+    Returns: None
+    '''
+    global engine, engine_config, Session, trigram_search, slow_queries
+    
+    trigram_search = None
+    if engine is not None:
+        engine.dispose(close=False)
+    
+    # Get the database engine, its statements are timed
+    engine_config = get_engine_config(REFINERY_DB_CONFIG_TEST)
+    engine = get_db_engine(**engine_config)
+    instrument_engine(engine, statement_seconds, statement_rows)
+    slow_queries = log_slow_queries(engine, profile_config["slow_query_ms"])
+    
+    # Create a session
+    Session = sessionmaker(bind=engine)
+
+
+init_engine()
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    '''
+    Title: TimedJSONProvider
+    Description: JSON provider of Flask adding the serialization time of jsonify to the request metrics
+    '''
+    
+    def dumps(self, obj, **kwargs)->str:
+        start = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            add_request_time("serialize", time.perf_counter() - start)
 
-# Get the database engine
-engine = get_db_engine(REFINERY_DB_CONFIG_TEST)
 
 # Create a new Flask instance
 app = Flask(__name__)
+app.json = TimedJSONProvider(app)
+
+
+# Filter result cache, emptied when a write commits
+filter_cache = ResultCache(FILTER_CACHE_SIZE, FILTER_CACHE_TTL)
+
+# Table version read by the requests, emptied when a write of this worker commits
+version_cache = ResultCache(1, TABLE_VERSION_TTL)
+
+# Name search index of the databases without pg_trgm, rebuilt when the table version moves
+search_index = TrigramIndex()
+search_index_lock = threading.Lock()
+
+# Typeahead index, loaded at startup and updated in place by the write routes
+suggest_index = SuggestIndex()
+suggest_refresh_lock = threading.Lock()
+suggest_checked = 0.0
+
+# Gauges read on every scrape
+metrics.add_collector("refinery_db_pool", "Connection pool statistics, see the pool route", lambda: get_pool_stats(engine, engine_config["max_overflow"]))
+metrics.add_collector("refinery_filter_cache", "Filter result cache statistics, see the filter/cache route", lambda: filter_cache.stats())
+
+
+
+@app.before_request
+def start_request_metrics()->None:
+    '''
+    Title: start_request_metrics
+    Description: This function counts the request in flight and starts timing it, labeled by the route rule and not the path
+    Args: None
+    Returns: None
+    '''
+    g.metrics_start = time.perf_counter()
+    g.metrics_labels = (request.method, request.url_rule.rule if request.url_rule is not None else "unmatched")
+    requests_in_flight.inc(g.metrics_labels)
+    start_request_timing()
+
+
+@app.before_request
+def start_request_profile()->None:
+    '''
+    Title: start_request_profile
+    Description: This function profiles the request if an admin asked for it with the token, or if it is drawn by the sample rate
+    Args: None
+    Returns: None
+    '''
+    # The profile routes are not profiled
+    if request.path.startswith('/profile'):
+        return
+    
+    g.profile_asked = is_admin(profile_config["token"], request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_PARAMETER))
+    g.profile = request_profiler.start(g.profile_asked)
+
+
+@app.after_request
+def record_response_status(response):
+    '''
+    Title: record_response_status
+    Description: This function keeps the status of the response for the request metrics
+    Args: response
+    Returns: The response
+    '''
+    g.metrics_status = response.status_code
+    
+    # Tell the admin where the profile is stored, or that another request was being profiled
+    if g.get("profile_asked"):
+        response.headers[PROFILE_HEADER] = g.profile[1] if g.profile is not None else "busy"
+    
+    return response
+
+
+@app.teardown_request
+def stop_request_profile(exception=None)->None:
+    '''
+    Title: stop_request_profile
+    Description: This function stores the profile of the request once its response is sent, streamed responses included
+    Args: exception
+    Returns: None
+    '''
+    if "profile" in g:
+        request_profiler.finish(g.profile)
+
+
+@app.teardown_request
+def stop_request_metrics(exception=None)->None:
+    '''
+    Title: stop_request_metrics
+    Description: This function records the latency of the request once its response is sent, streamed responses included
+    Args: exception
+    Returns: None
+    '''
+    if "metrics_start" not in g:
+        return
+    
+    seconds = time.perf_counter() - g.metrics_start
+    sql, serialize = stop_request_timing()
+    
+    requests_in_flight.dec(g.metrics_labels)
+    request_seconds.observe(g.metrics_labels + (str(g.get("metrics_status", 500)),), seconds)
+    request_phase_seconds.observe(g.metrics_labels + ("sql",), sql)
+    request_phase_seconds.observe(g.metrics_labels + ("serialize",), serialize)
+    request_phase_seconds.observe(g.metrics_labels + ("other",), max(seconds - sql - serialize, 0.0))
+
+
+
+def paginate_query(statement, limit:int, after:int)->tuple:
+    '''
+    Title: paginate_query
+    Description: This function gets one page of the statement ordered by refinery_id, starting after the cursor
+    Args: statement, limit, after
+    Returns: The refineries of the page and the cursor of the next page, None on the last page
+    '''
+    return split_page(fetch_refineries(engine, page_refinery_query(statement, limit, after)), limit)
+
+
+def read_table_version()->int:
+    '''
+    Title: read_table_version
+    Description: This function reads the version of the refinery table, from the database once per TABLE_VERSION_TTL or write
+    Args: None
+    Returns: The version of the table
+    '''
+    # Generation before the query, a write committed meanwhile discards the version read
+    generation = version_cache.generation
+    version = version_cache.get('version')
+    
+    if version is None:
+        with engine.connect() as conn:
+            version = get_table_version(conn)
+        version_cache.put('version', version, generation)
+    
+    return version
 
 
-# Create a session
-Session = sessionmaker(bind=engine)
+def invalidate_read_caches()->None:
+    '''
+    Title: invalidate_read_caches
+    Description: This function drops the cached table version and filter results once a write committed
+    Args: None
+    Returns: None
+    '''
+    version_cache.invalidate()
+    filter_cache.invalidate()
+
+
+def is_not_modified(etag:str)->bool:
+    '''
+    Title: is_not_modified
+    Description: This function tells if the client already has the response of the given ETag
+    Args: etag
+    Returns: True if the If-None-Match header matches the ETag
+    '''
+    return request.if_none_match.contains_weak(etag)
+
+
+def make_read_response(response, etag:str):
+    '''
+    Title: make_read_response
+    Description: This function tags a read response with its ETag, an empty 304 response if response is None
+    Args: response, etag
+    Returns: The tagged response
+    '''
+    if response is None:
+        response = app.response_class(status=304)
+    
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = READ_CACHE_CONTROL
+    
+    return response
 
 
 
 
 # Define a get route
+# Example
+# http://route/?limit=100&after=99
 @app.route('/')
 def index()-> dict:
     '''
     Title: Main route
-    Description: This route returns all the data from the refinery table
-    Args: None
-    Returns: A json object containing the data
+    Description: This route returns the data of the refinery table one page at a time, DEFAULT_PAGE_SIZE refineries if no limit is given
+    Args: limit, after
+    Returns: A json object containing the data and the next cursor
     '''
-    # Create a session
-    with Session() as session:
+    
+    # Get the pagination parameters
+    try:
+        limit, after = get_page_parameters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        # Answer a client holding the current version without running the query
+        etag = get_etag(read_table_version(), request.path, (limit, after))
         
-        try:
-            # Get the data
-            data = session.query(Refinery).all()
-            
-            # Convert the data to a string
-            data = [ obj.to_dict() for obj in data ]
-            
-            return jsonify(data), 200
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
+        if is_not_modified(etag):
+            return make_read_response(None, etag)
+        
+        # Get one page of the data
+        data, next_cursor = paginate_query(select_refineries(), limit, after)
+        
+        return make_read_response(jsonify({"data": data, "next": next_cursor}), etag), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 # Main filter route
 # Example 
-# http://route/filter?region=Europe&country=France&status=active
+# http://route/filter?region=Europe&country=France&status=active&limit=100&after=99
 @app.route('/filter', methods=['GET'])  
 def filter()-> dict:
     '''
     Title: filter
-    Description: This route returns all the data from the refinery table filtered by region, country and status
-    Args: region
-    Returns: A json object containing the data
+    Description: This route returns the data of the refinery table filtered by region, country and status one page at a time, DEFAULT_PAGE_SIZE refineries if no limit is given
+    Args: region, country, status, limit, after
+    Returns: A json object containing the data and the next cursor
     '''
     
     # Get any query parameters
     query_parameters = request.args
     
+    # Get the pagination parameters
+    try:
+        limit, after = get_page_parameters(query_parameters)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
     
     # Get the region
     region = query_parameters.get('region', None)
@@ -81,39 +374,390 @@ def filter()-> dict:
     # Get the status
     status = query_parameters.get('status', None)
     
-    # Create a session
-    with Session() as session:
-        try:
-            
-            # Primary query
-            primary_query = session.query(Refinery)
+    cache_key = get_filter_cache_key(region, country, status, limit, after)
+    
+    # Generation before the query, a write committed meanwhile discards the result
+    generation = filter_cache.generation
+    
+    try:
+        # Answer a client holding the current version without running the query
+        version = read_table_version()
+        etag = get_etag(version, request.path, cache_key)
+        
+        if is_not_modified(etag):
+            return make_read_response(None, etag)
+        
+        # Serve the serialized body of an identical request at this version
+        body = filter_cache.get((version,) + cache_key)
+        
+        if body is not None:
+            return make_read_response(app.response_class(body, mimetype='application/json'), etag), 200
+        
+        # Primary query, one predicate per given parameter
+        primary_query = filter_refinery_query(select_refineries(), region, country, status)
+        
+        # Get one page of the data
+        data, next_cursor = paginate_query(primary_query, limit, after)
+        
+        response = jsonify({"data": data, "next": next_cursor})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    filter_cache.put((version,) + cache_key, response.get_data(), generation)
+    
+    return make_read_response(response, etag), 200
 
-            # If region is not None
-            if region:
-                primary_query = primary_query.filter(Refinery.region == region)    
-                
-            
-            # If country is not None
-            if country:
-                primary_query = primary_query.filter(Refinery.country == country)
-            
-            # If status is not None
-            if status:
-                primary_query = primary_query.filter(Refinery.status == status)
-            
-            # Get the data
-            data = primary_query.filter(Refinery.region == region).all()
-                
-            # Convert the data to a string
-            data = [ obj.to_dict() for obj in data ]
-            
-            
-            return jsonify(data), 200
+
+def search_names(query:str, limit:int, threshold:float, version:int)->list:
+    '''
+    Title: search_names
+    Description: This function ranks the refineries by the trigram similarity of their name, with pg_trgm or with the in process index
+    Args: query, limit, threshold, version
+    Returns: The refineries with their score, best first
+    '''
+    global trigram_search
+    
+    with engine.connect() as conn:
+        if trigram_search is None:
+            trigram_search = has_trigram_index(conn)
+        
+        if trigram_search:
+            return search_refineries(conn, query, limit, threshold)
+    
+    # One thread rebuilds the index after a write, the others wait for it
+    if search_index.version != version:
+        with search_index_lock:
+            if search_index.version != version:
+                search_index.build(fetch_refineries(engine, select_refineries()), version)
+    
+    return search_index.search(query, limit, threshold)
+
+
+# Search route
+# Example
+# http://route/search?q=port arthur&limit=10&threshold=0.3
+@app.route('/search', methods=['GET'])
+def search()-> dict:
+    '''
+    Title: search
+    Description: This route returns the refineries whose name is similar to the searched text, ranked by their trigram similarity score
+    Args: q, limit, threshold
+    Returns: A json object containing the number of results and the refineries with their score
+    '''
+    
+    # Get the search parameters
+    try:
+        query, limit, threshold = get_search_parameters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        # Answer a client holding the current version without searching
+        version = read_table_version()
+        etag = get_etag(version, request.path, (query, limit, threshold))
+        
+        if is_not_modified(etag):
+            return make_read_response(None, etag)
+        
+        data = search_names(query, limit, threshold, version)
+        
+        return make_read_response(jsonify({"count": len(data), "data": data}), etag), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+def load_suggest_index()->None:
+    '''
+    Title: load_suggest_index
+    Description: This function builds the typeahead index from the refinery table.
+        The version is read before the rows, a write committed in between is caught by the next check.
+    Args: None
+    Returns: None
+    '''
+    version = read_table_version()
+    suggest_index.build(fetch_refineries(engine, select_refineries()), version)
+
+
+def reload_suggest_index()->None:
+    '''
+    Title: reload_suggest_index
+    Description: This function rebuilds the typeahead index if the table version moved, after a write of another worker
+    Args: None
+    Returns: None
+    '''
+    try:
+        if read_table_version() != suggest_index.version:
+            load_suggest_index()
+    except Exception as e:
+        app.logger.warning("Typeahead index not reloaded: %s", e)
+    finally:
+        suggest_refresh_lock.release()
+
+
+def check_suggest_index()->None:
+    '''
+    Title: check_suggest_index
+    Description: This function starts a background reload of the typeahead index at most once per SUGGEST_REFRESH_INTERVAL, the request does not wait for it
+    Args: None
+    Returns: None
+    '''
+    global suggest_checked
+    
+    now = time.monotonic()
+    if now - suggest_checked < SUGGEST_REFRESH_INTERVAL or not suggest_refresh_lock.acquire(blocking=False):
+        return
+    
+    suggest_checked = now
+    threading.Thread(target=reload_suggest_index, daemon=True).start()
+
+
+# Suggest route
+# Example
+# http://route/suggest?prefix=fra&limit=10&kind=country
+@app.route('/suggest', methods=['GET'])
+def suggest()-> dict:
+    '''
+    Title: suggest
+    Description: This route returns the regions, countries and refinery names starting with the prefix, from memory without querying the database
+    Args: prefix, limit, kind
+    Returns: A json object containing the prefix and the suggestions with the number of refineries holding them
+    '''
+    
+    # Get the suggest parameters
+    try:
+        prefix, limit, kind = get_suggest_parameters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    # Processes started without serve.py load the index on their first suggestion
+    if suggest_index.version is None:
+        try:
+            with suggest_refresh_lock:
+                if suggest_index.version is None:
+                    load_suggest_index()
         except Exception as e:
             return jsonify({"error": str(e)}), 500
+    else:
+        check_suggest_index()
+    
+    return jsonify({"prefix": prefix, "data": suggest_index.suggest(prefix, limit, kind)}), 200
+
+
+# Metrics route, scraped by Prometheus
+# Example
+# http://route/metrics
+@app.route('/metrics', methods=['GET'])
+def metrics_text()-> Response:
+    '''
+    Title: metrics_text
+    Description: This route returns the request, SQL, pool and cache metrics of the process in the Prometheus text format
+    Args: None
+    Returns: The metrics as text
+    '''
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+def is_profile_admin()->bool:
+    '''
+    Title: is_profile_admin
+    Description: This function checks the token of the request for the profile routes
+    Args: None
+    Returns: True if the request carries the token of the admins
+    '''
+    return is_admin(profile_config["token"], request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_PARAMETER))
+
+
+# Stored profiles route, admin only
+# Example
+# http://route/profile with the X-Refinery-Profile header holding the token
+@app.route('/profile', methods=['GET'])
+def list_profiles()-> dict:
+    '''
+    Title: list_profiles
+    Description: This route returns the stored profiles of the worker, newest first, and the profiling counters
+    Args: None
+    Returns: A json object containing the profile names, 403 without the token
+    '''
+    if not is_profile_admin():
+        return jsonify({"error": "forbidden"}), 403
+    
+    return jsonify({
+        "sample_rate": request_profiler.sample_rate,
+        "profiled": request_profiler.profiled,
+        "skipped": request_profiler.skipped,
+        "profiles": request_profiler.list_profiles()
+    }), 200
+
+
+# Slow statements route, admin only
+# Example
+# http://route/profile/slowqueries with the X-Refinery-Profile header holding the token
+@app.route('/profile/slowqueries', methods=['GET'])
+def list_slow_queries()-> dict:
+    '''
+    Title: list_slow_queries
+    Description: This route returns the latest statements of the worker slower than the threshold, newest first
+    Args: None
+    Returns: A json object containing the threshold and the statements with their duration and parameters, 403 without the token
+    '''
+    if not is_profile_admin():
+        return jsonify({"error": "forbidden"}), 403
+    
+    return jsonify({"threshold_ms": profile_config["slow_query_ms"], "data": list(reversed(slow_queries))}), 200
+
+
+# Stored profile route, admin only
+# Example
+# http://route/profile/20240101T120000-42-0a1b2c3d.prof?sort=tottime&limit=20, format=raw returns the pstats file
+@app.route('/profile/<name>', methods=['GET'])
+def get_profile(name)-> Response:
+    '''
+    Title: get_profile
+    Description: This route returns the summary of a stored profile, the functions taking the most time first, or the pstats file
+    Args: name, sort, limit, format
+    Returns: The pstats report as text, 403 without the token, 404 if there is no such profile
+    '''
+    if not is_profile_admin():
+        return jsonify({"error": "forbidden"}), 403
+    
+    path = request_profiler.get_profile_path(name)
+    
+    if path is None:
+        return jsonify({"error": f"profile {name} not found"}), 404
+    
+    if request.args.get('format') == 'raw':
+        return send_file(path, mimetype='application/octet-stream', as_attachment=True, download_name=name)
+    
+    # Check the report parameters
+    sort = request.args.get('sort', 'cumulative')
+    
+    if sort not in PROFILE_SORT_KEYS:
+        return jsonify({"error": f"sort must be one of {', '.join(PROFILE_SORT_KEYS)}"}), 400
+    
+    try:
+        limit = int(request.args.get('limit', PROFILE_LIMIT))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    
+    return Response(format_profile(path, sort, limit), mimetype='text/plain'), 200
+
+
+# Filter cache statistics route
+# Example
+# http://route/filter/cache
+@app.route('/filter/cache', methods=['GET'])
+def filter_cache_stats()-> dict:
+    '''
+    Title: filter_cache_stats
+    Description: This route returns the size, hits and misses of the filter result cache
+    Args: None
+    Returns: A json object containing the cache statistics
+    '''
+    return jsonify(filter_cache.stats()), 200
 
 
 
+# Connection pool statistics route
+# Example
+# http://route/pool
+@app.route('/pool', methods=['GET'])
+def pool_stats()-> dict:
+    '''
+    Title: pool_stats
+    Description: This route returns the utilization of the database connection pool and the time spent waiting for a connection
+    Args: None
+    Returns: A json object containing the pool statistics
+    '''
+    return jsonify(get_pool_stats(engine, engine_config["max_overflow"])), 200
+
+
+# Aggregate route
+# Example
+# http://route/aggregate?by=region&status=active
+@app.route('/aggregate', methods=['GET'])
+def aggregate()-> dict:
+    '''
+    Title: aggregate
+    Description: This route returns the count, total and mean capacity of the refineries grouped by region, country and/or status,
+        optionally filtered by region, country and status. It reads the summary table kept up to date by the write routes
+    Args: by, region, country, status
+    Returns: A json object containing one row per group, a single row if by is not given
+    '''
+    
+    # Get any query parameters
+    query_parameters = request.args
+    
+    # Get the grouping columns
+    try:
+        group_by = get_group_by(query_parameters)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    # Get the filters
+    region = query_parameters.get('region', None)
+    country = query_parameters.get('country', None)
+    status = query_parameters.get('status', None)
+    
+    try:
+        # Answer a client holding the current version without running the query
+        etag = get_etag(read_table_version(), request.path, (tuple(group_by),) + get_filter_cache_key(region, country, status, None, None))
+        
+        if is_not_modified(etag):
+            return make_read_response(None, etag)
+        
+        with engine.connect() as conn:
+            data = [dict(row) for row in conn.execute(select_refinery_summary(group_by, region, country, status)).mappings()]
+        
+        return make_read_response(jsonify(data), etag), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# Export route
+# Example
+# http://route/export?format=csv&region=Europe
+@app.route('/export', methods=['GET'])
+def export()-> Response:
+    '''
+    Title: export
+    Description: This route streams the refinery table as NDJSON or CSV, optionally filtered by region, country and status.
+        The rows are read with a server side cursor, so only one batch of rows is held in memory at a time
+    Args: format, region, country, status
+    Returns: A streamed NDJSON or CSV response
+    '''
+    
+    # Get any query parameters
+    query_parameters = request.args
+    
+    # Get the format
+    export_format = query_parameters.get('format', 'ndjson')
+    
+    if export_format not in EXPORT_MIMETYPES:
+        return jsonify({"error": f"format must be one of {list(EXPORT_MIMETYPES)}"}), 400
+    
+    # Get the filters
+    region = query_parameters.get('region', None)
+    country = query_parameters.get('country', None)
+    status = query_parameters.get('status', None)
+    
+    def generate():
+        # Stream the rows in batches
+        with engine.connect() as conn:
+            statement = filter_refinery_query(select_refineries(), region, country, status).order_by(Refinery.refinery_id)
+            result = conn.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE).execute(statement)
+            
+            # CSV header
+            if export_format == 'csv':
+                yield ','.join(EXPORT_COLUMNS) + "\n"
+            
+            for batch in result.mappings().partitions():
+                yield format_export_batch(batch, export_format)
+    
+    headers = {"Content-Disposition": f"attachment; filename=refinery.{export_format}"}
+    
+    return Response(stream_with_context(generate()), mimetype=EXPORT_MIMETYPES[export_format], headers=headers)
+
+
 # Add refinery
 # Example
 # POST http://route/addrefinery with the following json data 
@@ -140,109 +784,212 @@ def post_refinery()-> dict:
     with Session() as session:
         
         try:
-            # Get the maximum id
-            max_id = session.query(Refinery).order_by(Refinery.refinery_id.desc()).first().refinery_id
+            # Create a new refinery object, its id is drawn from the id sequence
+            new_refinery = Refinery(region=region, country=country, refinery=refinery, capacity=float(capacity), unit=unit, status=status)
             
-            # Ensure max id is a integer
-            max_id = int(max_id)
+            # Add the refinery and get its id
+            session.add(new_refinery)
+            session.flush()
+            new_data = new_refinery.to_dict()
             
-            # Increment the id
-            max_id += 1
+            # Count the refinery in its group
+            update_refinery_summary(session, region, country, status, 1, new_refinery.capacity)
             
-            # Create a new refinery object
-            new_refinery = Refinery(refinery_id=max_id,region=region, country=country, refinery=refinery, capacity=capacity, unit=unit, status=status)
-            
-            # Add the refinery
-            session.add(new_refinery)
+            # Move the table version forward with the write
+            bump_table_version(session)
+            version = get_table_version(session)
             
             # Commit the session
             session.commit()
             
-            return jsonify(new_refinery.to_dict()), 200
+            # Drop the cached version and filter results
+            invalidate_read_caches()
+            suggest_index.update([new_data], [], version)
+            
+            return jsonify(new_data), 200
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
 
+# Add refineries in bulk
+# Example
+# POST http://route/addrefineries with a json array of refineries, or one per line with Content-Type: application/x-ndjson
+@app.route('/addrefineries', methods=['POST'])
+def post_refineries()-> dict:
+    '''
+    Title: post_refineries
+    Description: This route adds the valid refineries of the body in one transaction, the invalid ones are reported and skipped
+    Args: None
+    Returns: A json object containing the ids of the inserted refineries and the errors, both with the position of the refinery in the body
+    '''
+    
+    # Get the data
+    try:
+        refineries = parse_bulk_body(request.mimetype, request.get_data())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    if len(refineries) > MAX_BULK_SIZE:
+        return jsonify({"error": f"at most {MAX_BULK_SIZE} refineries per request"}), 400
+    
+    # Check every refinery
+    valid, positions, errors = check_refineries(refineries)
+    
+    if not valid:
+        return jsonify({"inserted": [], "errors": errors}), 400
+    
+    try:
+        # One transaction for all the refineries
+        with engine.begin() as conn:
+            ids = insert_refineries(conn, valid)
+            version = get_table_version(conn)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    # Drop the cached version and filter results
+    invalidate_read_caches()
+    suggest_index.update([dict(refinery, index=refinery_id) for refinery, refinery_id in zip(valid, ids)], [], version)
+    
+    inserted = [{"row": position, "index": refinery_id} for position, refinery_id in zip(positions, ids)]
+    
+    return jsonify({"inserted": inserted, "errors": errors}), 200
+
+
 # Delete refinery method
 # Example
 # DELETE http://route/deleterefinery/1
-@app.route('/deleterefinery/<to_delete_id>', methods=['DELETE'])
+@app.route('/deleterefinery/<int:to_delete_id>', methods=['DELETE'])
 def delete_refinery(to_delete_id)-> dict:
     '''
     Title: delete_refinery
-    Description: This route deletes a refinery from the refinery table
+    Description: This route deletes a refinery from the refinery table with one DELETE ... RETURNING
     Args: to_delete_id
-    Returns: A json object containing the data
+    Returns: A json object containing the data, 404 if there is no refinery with this id
     '''
     
-    # Create a session
-    with Session() as session:
-        
-        try:
-            # Get the refinery to delete
-            refinery_to_delete = session.query(Refinery).filter(Refinery.refinery_id == to_delete_id).first()
-            
-            # Delete the refinery
-            session.delete(refinery_to_delete)
-            
-            # Commit the session
-            session.commit()
-            
-            return jsonify(refinery_to_delete.to_dict()), 200
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
+    try:
+        # Delete the refinery and commit
+        with engine.begin() as conn:
+            data = delete_refineries(conn, Refinery.refinery_id == to_delete_id)
+            version = get_table_version(conn)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    if not data:
+        return jsonify({"error": f"refinery {to_delete_id} not found"}), 404
+    
+    # Drop the cached version and filter results
+    invalidate_read_caches()
+    suggest_index.update([], [to_delete_id], version)
+    
+    return jsonify(data[0]), 200
 
 
 # Update refinery method
 # Example
-# PUT http://route/updaterefinery/1 with the following json data
-@app.route('/updaterefinery/<to_update_id>', methods=['PATCH'])
-def update_refinery(to_update_id)->None:
+# PATCH http://route/updaterefinery/1 with the following json data
+@app.route('/updaterefinery/<int:to_update_id>', methods=['PATCH'])
+def update_refinery(to_update_id)-> dict:
+    '''
+    Title: update_refinery
+    Description: This route updates the given columns of a refinery with one UPDATE ... RETURNING
+    Args: to_update_id
+    Returns: A json object containing the updated data, 404 if there is no refinery with this id
+    '''
     
-    # Get the put data
-    put_data = request.get_json()
+    # Get the patch data
+    try:
+        values = get_update_values(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
-    # Get the parameters
-    region = put_data.get("region",None)
-    country = put_data.get("country",None)
-    refinery = put_data.get("refinery",None)
-    capacity = put_data.get("capacity",None)
-    unit = put_data.get("unit",None)
-    status = put_data.get("status",None)
+    try:
+        # Update the refinery and commit
+        with engine.begin() as conn:
+            data = update_refineries(conn, Refinery.refinery_id == to_update_id, values)
+            version = get_table_version(conn)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
     
-    # Create a session
-    with Session() as session:
-        try:
-            # Get the refinery to update
-            refinery_to_update = session.query(Refinery).filter(Refinery.refinery_id == to_update_id).first()
-            
-            # Update the refinery
-            if region:
-                refinery_to_update.region = region
-            
-            if country:
-                refinery_to_update.country = country
-            
-            if refinery:
-                refinery_to_update.refinery = refinery
-            
-            if capacity:
-                refinery_to_update.capacity = capacity
-            
-            if unit:
-                refinery_to_update.unit = unit
-            
-            if status:
-                refinery_to_update.status = status
-                
-            # Commit the session
-            session.commit()
-        
-            # Return the updated refinery
-            return jsonify(refinery_to_update.to_dict()), 200
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
+    if not data:
+        return jsonify({"error": f"refinery {to_update_id} not found"}), 404
+    
+    # Drop the cached version and filter results
+    invalidate_read_caches()
+    suggest_index.update(data, [], version)
+    
+    # Return the updated refinery
+    return jsonify(data[0]), 200
+
+
+# Delete the refineries of a filter
+# Example
+# DELETE http://route/deleterefineries?country=France&status=closed
+@app.route('/deleterefineries', methods=['DELETE'])
+def delete_filtered_refineries()-> dict:
+    '''
+    Title: delete_filtered_refineries
+    Description: This route deletes every refinery matching the region, country and status filters with one DELETE ... RETURNING
+    Args: region, country, status
+    Returns: A json object containing the number of deleted refineries and their data
+    '''
+    
+    # Get the filters, at least one so the whole table is not deleted by mistake
+    try:
+        conditions = get_required_filter_conditions(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        with engine.begin() as conn:
+            data = delete_refineries(conn, and_(*conditions))
+            version = get_table_version(conn)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    # Drop the cached version and filter results
+    if data:
+        invalidate_read_caches()
+        suggest_index.update([], [refinery["index"] for refinery in data], version)
+    
+    return jsonify({"count": len(data), "data": data}), 200
+
+
+# Update the refineries of a filter
+# Example
+# PATCH http://route/updaterefineries?country=France with {"status": "closed"}
+@app.route('/updaterefineries', methods=['PATCH'])
+def update_filtered_refineries()-> dict:
+    '''
+    Title: update_filtered_refineries
+    Description: This route applies the same patch to every refinery matching the region, country and status filters with one UPDATE ... RETURNING
+    Args: region, country, status
+    Returns: A json object containing the number of updated refineries and their data
+    '''
+    
+    # Get the filters and the patch
+    try:
+        conditions = get_required_filter_conditions(request.args)
+        values = get_update_values(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        with engine.begin() as conn:
+            data = update_refineries(conn, and_(*conditions), values)
+            version = get_table_version(conn)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    # Drop the cached version and filter results
+    if data:
+        invalidate_read_caches()
+        suggest_index.update(data, [], version)
+    
+    return jsonify({"count": len(data), "data": data}), 200
         
 
+# Development server, serve.py runs the production workers
 if __name__ == "__main__":
+    load_suggest_index()
     app.run(debug=True)
\ No newline at end of file
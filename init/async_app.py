@@ -0,0 +1,715 @@
+# Asyncio version of the routes of app.py, same urls and responses, served by an ASGI server
+# Example
+# hypercorn async_app:app --bind 0.0.0.0:8000 --workers 4
+
+# Import asyncio
+import asyncio
+
+# Import time
+import time
+
+# Import Quart
+from quart import Quart, request, jsonify
+
+# Import util
+from utils.refinery_db_io import REFINERY_DB_CONFIG_TEST
+
+# Import get_async_db_engine
+from utils.refinery_db_io import get_async_db_engine, get_engine_config
+
+# Import the pool metrics
+from utils.refinery_db_pool import get_pool_stats
+
+# Import the class
+from utils.refinery_db_io import Refinery
+
+# Import the read path
+from utils.refinery_db_io import select_refineries, get_table_version, select_refinery_summary
+
+# Import the writes, run on the async connections with run_sync
+from utils.refinery_db_io import insert_refineries, update_refineries, delete_refineries
+
+# Import the result cache
+from utils.refinery_result_cache import ResultCache
+
+# Import the name search
+from utils.refinery_search import TrigramIndex, has_trigram_index, search_refineries
+
+# Import the typeahead index
+from utils.refinery_suggest import SuggestIndex, SUGGEST_REFRESH_INTERVAL
+
+# Import the request handling shared with the Flask app
+from utils.refinery_api import EXPORT_BATCH_SIZE, EXPORT_COLUMNS, EXPORT_MIMETYPES, MAX_BULK_SIZE, REFINERY_DEFAULTS, \
+    FILTER_CACHE_SIZE, FILTER_CACHE_TTL, TABLE_VERSION_TTL, READ_CACHE_CONTROL
+from utils.refinery_api import get_page_parameters, page_refinery_query, split_page, get_required_filter_conditions, filter_refinery_query, \
+    get_filter_cache_key, get_etag, get_group_by, get_search_parameters, get_suggest_parameters, format_export_batch, get_update_values, parse_bulk_body, check_refineries
+
+from sqlalchemy import and_
+
+
+# Get the asyncio database engine, configured by the REFINERY_DB_* environment variables
+engine_config = get_engine_config(REFINERY_DB_CONFIG_TEST)
+engine = get_async_db_engine(**engine_config)
+
+# Create a new Quart instance
+app = Quart(__name__)
+
+# Filter result cache, emptied when a write commits
+filter_cache = ResultCache(FILTER_CACHE_SIZE, FILTER_CACHE_TTL)
+
+# Table version read by the requests, emptied when a write of this worker commits
+version_cache = ResultCache(1, TABLE_VERSION_TTL)
+
+# True if the database searches the names with pg_trgm, looked up on the first search
+trigram_search = None
+
+# Name search index of the databases without pg_trgm, rebuilt when the table version moves
+search_index = TrigramIndex()
+search_index_lock = asyncio.Lock()
+
+# Typeahead index, loaded before serving and updated in place by the write routes
+suggest_index = SuggestIndex()
+suggest_refresh_lock = asyncio.Lock()
+suggest_checked = 0.0
+
+
+
+@app.before_serving
+async def load_suggest_index()->None:
+    '''
+    Title: load_suggest_index
+    Description: This function builds the typeahead index from the refinery table, off the event loop.
+        The version is read before the rows, a write committed in between is caught by the next check.
+    Args: None
+    Returns: None
+    '''
+    version = await read_table_version()
+    await asyncio.to_thread(suggest_index.build, await fetch_refineries(select_refineries()), version)
+
+
+@app.after_serving
+async def dispose_engine()->None:
+    '''
+    Title: dispose_engine
+    Description: This function closes the pooled connections when the server stops
+    Args: None
+    Returns: None
+    '''
+    await engine.dispose()
+
+
+async def fetch_refineries(statement)->list:
+    '''
+    Title: fetch_refineries
+    Description: This function executes a select_refineries statement and returns the rows in the shape of Refinery.to_dict
+    Args: statement
+    Returns: A list of dictionaries
+    '''
+    async with engine.connect() as conn:
+        result = await conn.execute(statement)
+        return [dict(row) for row in result.mappings()]
+
+
+async def paginate_query(statement, limit:int, after:int)->tuple:
+    '''
+    Title: paginate_query
+    Description: This function gets one page of the statement ordered by refinery_id, starting after the cursor
+    Args: statement, limit, after
+    Returns: The refineries of the page and the cursor of the next page, None on the last page
+    '''
+    return split_page(await fetch_refineries(page_refinery_query(statement, limit, after)), limit)
+
+
+async def read_table_version()->int:
+    '''
+    Title: read_table_version
+    Description: This function reads the version of the refinery table, from the database once per TABLE_VERSION_TTL or write
+    Args: None
+    Returns: The version of the table
+    '''
+    # Generation before the query, a write committed meanwhile discards the version read
+    generation = version_cache.generation
+    version = version_cache.get('version')
+    
+    if version is None:
+        async with engine.connect() as conn:
+            version = await conn.run_sync(get_table_version)
+        version_cache.put('version', version, generation)
+    
+    return version
+
+
+def invalidate_read_caches()->None:
+    '''
+    Title: invalidate_read_caches
+    Description: This function drops the cached table version and filter results once a write committed
+    Args: None
+    Returns: None
+    '''
+    version_cache.invalidate()
+    filter_cache.invalidate()
+
+
+def is_not_modified(etag:str)->bool:
+    '''
+    Title: is_not_modified
+    Description: This function tells if the client already has the response of the given ETag
+    Args: etag
+    Returns: True if the If-None-Match header matches the ETag
+    '''
+    return request.if_none_match.contains_weak(etag)
+
+
+def make_read_response(response, etag:str):
+    '''
+    Title: make_read_response
+    Description: This function tags a read response with its ETag, an empty 304 response if response is None
+    Args: response, etag
+    Returns: The tagged response
+    '''
+    if response is None:
+        response = app.response_class("", status=304)
+    
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = READ_CACHE_CONTROL
+    
+    return response
+
+
+
+
+# Define a get route
+# Example
+# http://route/?limit=100&after=99
+@app.route('/')
+async def index()-> dict:
+    '''
+    Title: Main route
+    Description: This route returns the data of the refinery table one page at a time, DEFAULT_PAGE_SIZE refineries if no limit is given
+    Args: limit, after
+    Returns: A json object containing the data and the next cursor
+    '''
+    
+    # Get the pagination parameters
+    try:
+        limit, after = get_page_parameters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        # Answer a client holding the current version without running the query
+        etag = get_etag(await read_table_version(), request.path, (limit, after))
+        
+        if is_not_modified(etag):
+            return make_read_response(None, etag)
+        
+        # Get one page of the data
+        data, next_cursor = await paginate_query(select_refineries(), limit, after)
+        
+        return make_read_response(jsonify({"data": data, "next": next_cursor}), etag), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# Main filter route
+# Example
+# http://route/filter?region=Europe&country=France&status=active&limit=100&after=99
+@app.route('/filter', methods=['GET'])
+async def filter()-> dict:
+    '''
+    Title: filter
+    Description: This route returns the data of the refinery table filtered by region, country and status one page at a time, DEFAULT_PAGE_SIZE refineries if no limit is given
+    Args: region, country, status, limit, after
+    Returns: A json object containing the data and the next cursor
+    '''
+    
+    # Get any query parameters
+    query_parameters = request.args
+    
+    # Get the pagination parameters
+    try:
+        limit, after = get_page_parameters(query_parameters)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    # Get the filters
+    region = query_parameters.get('region', None)
+    country = query_parameters.get('country', None)
+    status = query_parameters.get('status', None)
+    
+    cache_key = get_filter_cache_key(region, country, status, limit, after)
+    
+    # Generation before the query, a write committed meanwhile discards the result
+    generation = filter_cache.generation
+    
+    try:
+        # Answer a client holding the current version without running the query
+        version = await read_table_version()
+        etag = get_etag(version, request.path, cache_key)
+        
+        if is_not_modified(etag):
+            return make_read_response(None, etag)
+        
+        # Serve the serialized body of an identical request at this version
+        body = filter_cache.get((version,) + cache_key)
+        
+        if body is not None:
+            return make_read_response(app.response_class(body, mimetype='application/json'), etag), 200
+        
+        # Primary query, one predicate per given parameter
+        primary_query = filter_refinery_query(select_refineries(), region, country, status)
+        
+        # Get one page of the data
+        data, next_cursor = await paginate_query(primary_query, limit, after)
+        
+        response = jsonify({"data": data, "next": next_cursor})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    filter_cache.put((version,) + cache_key, await response.get_data(), generation)
+    
+    return make_read_response(response, etag), 200
+
+
+async def search_names(query:str, limit:int, threshold:float, version:int)->list:
+    '''
+    Title: search_names
+    Description: This function ranks the refineries by the trigram similarity of their name, with pg_trgm or with the in process index
+    Args: query, limit, threshold, version
+    Returns: The refineries with their score, best first
+    '''
+    global trigram_search
+    
+    async with engine.connect() as conn:
+        if trigram_search is None:
+            trigram_search = await conn.run_sync(has_trigram_index)
+        
+        if trigram_search:
+            return await conn.run_sync(search_refineries, query, limit, threshold)
+    
+    # One task rebuilds the index after a write, off the event loop, the others wait for it
+    if search_index.version != version:
+        async with search_index_lock:
+            if search_index.version != version:
+                await asyncio.to_thread(search_index.build, await fetch_refineries(select_refineries()), version)
+    
+    return search_index.search(query, limit, threshold)
+
+
+# Search route
+# Example
+# http://route/search?q=port arthur&limit=10&threshold=0.3
+@app.route('/search', methods=['GET'])
+async def search()-> dict:
+    '''
+    Title: search
+    Description: This route returns the refineries whose name is similar to the searched text, ranked by their trigram similarity score
+    Args: q, limit, threshold
+    Returns: A json object containing the number of results and the refineries with their score
+    '''
+    
+    # Get the search parameters
+    try:
+        query, limit, threshold = get_search_parameters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        # Answer a client holding the current version without searching
+        version = await read_table_version()
+        etag = get_etag(version, request.path, (query, limit, threshold))
+        
+        if is_not_modified(etag):
+            return make_read_response(None, etag)
+        
+        data = await search_names(query, limit, threshold, version)
+        
+        return make_read_response(jsonify({"count": len(data), "data": data}), etag), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+async def reload_suggest_index()->None:
+    '''
+    Title: reload_suggest_index
+    Description: This function rebuilds the typeahead index if the table version moved, after a write of another worker
+    Args: None
+    Returns: None
+    '''
+    async with suggest_refresh_lock:
+        try:
+            if await read_table_version() != suggest_index.version:
+                await load_suggest_index()
+        except Exception as e:
+            app.logger.warning("Typeahead index not reloaded: %s", e)
+
+
+def check_suggest_index()->None:
+    '''
+    Title: check_suggest_index
+    Description: This function starts a background reload of the typeahead index at most once per SUGGEST_REFRESH_INTERVAL, the request does not wait for it
+    Args: None
+    Returns: None
+    '''
+    global suggest_checked
+    
+    now = time.monotonic()
+    if now - suggest_checked < SUGGEST_REFRESH_INTERVAL or suggest_refresh_lock.locked():
+        return
+    
+    suggest_checked = now
+    app.add_background_task(reload_suggest_index)
+
+
+# Suggest route
+# Example
+# http://route/suggest?prefix=fra&limit=10&kind=country
+@app.route('/suggest', methods=['GET'])
+async def suggest()-> dict:
+    '''
+    Title: suggest
+    Description: This route returns the regions, countries and refinery names starting with the prefix, from memory without querying the database
+    Args: prefix, limit, kind
+    Returns: A json object containing the prefix and the suggestions with the number of refineries holding them
+    '''
+    
+    # Get the suggest parameters
+    try:
+        prefix, limit, kind = get_suggest_parameters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    check_suggest_index()
+    
+    return jsonify({"prefix": prefix, "data": suggest_index.suggest(prefix, limit, kind)}), 200
+
+
+# Filter cache statistics route
+# Example
+# http://route/filter/cache
+@app.route('/filter/cache', methods=['GET'])
+async def filter_cache_stats()-> dict:
+    '''
+    Title: filter_cache_stats
+    Description: This route returns the size, hits and misses of the filter result cache
+    Args: None
+    Returns: A json object containing the cache statistics
+    '''
+    return jsonify(filter_cache.stats()), 200
+
+
+# Connection pool statistics route
+# Example
+# http://route/pool
+@app.route('/pool', methods=['GET'])
+async def pool_stats()-> dict:
+    '''
+    Title: pool_stats
+    Description: This route returns the utilization of the database connection pool and the time spent waiting for a connection
+    Args: None
+    Returns: A json object containing the pool statistics
+    '''
+    return jsonify(get_pool_stats(engine, engine_config["max_overflow"])), 200
+
+
+# Aggregate route
+# Example
+# http://route/aggregate?by=region&status=active
+@app.route('/aggregate', methods=['GET'])
+async def aggregate()-> dict:
+    '''
+    Title: aggregate
+    Description: This route returns the count, total and mean capacity of the refineries grouped by region, country and/or status,
+        optionally filtered by region, country and status. It reads the summary table kept up to date by the write routes
+    Args: by, region, country, status
+    Returns: A json object containing one row per group, a single row if by is not given
+    '''
+    
+    # Get any query parameters
+    query_parameters = request.args
+    
+    # Get the grouping columns
+    try:
+        group_by = get_group_by(query_parameters)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    # Get the filters
+    region = query_parameters.get('region', None)
+    country = query_parameters.get('country', None)
+    status = query_parameters.get('status', None)
+    
+    try:
+        # Answer a client holding the current version without running the query
+        etag = get_etag(await read_table_version(), request.path, (tuple(group_by),) + get_filter_cache_key(region, country, status, None, None))
+        
+        if is_not_modified(etag):
+            return make_read_response(None, etag)
+        
+        async with engine.connect() as conn:
+            result = await conn.execute(select_refinery_summary(group_by, region, country, status))
+            data = [dict(row) for row in result.mappings()]
+        
+        return make_read_response(jsonify(data), etag), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# Export route
+# Example
+# http://route/export?format=csv&region=Europe
+@app.route('/export', methods=['GET'])
+async def export():
+    '''
+    Title: export
+    Description: This route streams the refinery table as NDJSON or CSV, optionally filtered by region, country and status.
+        The rows are read with a server side cursor, so only one batch of rows is held in memory at a time
+    Args: format, region, country, status
+    Returns: A streamed NDJSON or CSV response
+    '''
+    
+    # Get any query parameters
+    query_parameters = request.args
+    
+    # Get the format
+    export_format = query_parameters.get('format', 'ndjson')
+    
+    if export_format not in EXPORT_MIMETYPES:
+        return jsonify({"error": f"format must be one of {list(EXPORT_MIMETYPES)}"}), 400
+    
+    # Get the filters
+    region = query_parameters.get('region', None)
+    country = query_parameters.get('country', None)
+    status = query_parameters.get('status', None)
+    
+    async def generate():
+        # Stream the rows in batches
+        async with engine.connect() as conn:
+            statement = filter_refinery_query(select_refineries(), region, country, status).order_by(Refinery.refinery_id)
+            result = await conn.stream(statement, execution_options={"yield_per": EXPORT_BATCH_SIZE})
+            
+            # CSV header
+            if export_format == 'csv':
+                yield ','.join(EXPORT_COLUMNS) + "\n"
+            
+            async for batch in result.mappings().partitions():
+                yield format_export_batch(batch, export_format)
+    
+    headers = {"Content-Type": EXPORT_MIMETYPES[export_format], "Content-Disposition": f"attachment; filename=refinery.{export_format}"}
+    
+    return generate(), 200, headers
+
+
+# Add refinery
+# Example
+# POST http://route/addrefinery with the following json data
+@app.route('/addrefinery', methods=['POST'])
+async def post_refinery()-> dict:
+    '''
+    Title: post_refinery
+    Description: This route adds a new refinery to the refinery table
+    Args: None
+    Returns: A json object containing the data
+    '''
+    # Get the data
+    post_data = await request.get_json()
+    
+    try:
+        # Know the keys
+        refinery = {column: post_data.get(column, default) for column, default in REFINERY_DEFAULTS.items()}
+        refinery['capacity'] = float(refinery['capacity'])
+        
+        # Its id is drawn from the id sequence
+        async with engine.begin() as conn:
+            ids = await conn.run_sync(insert_refineries, [refinery])
+            version = await conn.run_sync(get_table_version)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    # Drop the cached version and filter results
+    invalidate_read_caches()
+    suggest_index.update([{"index": ids[0], **refinery}], [], version)
+    
+    return jsonify({"index": ids[0], **refinery}), 200
+
+
+# Add refineries in bulk
+# Example
+# POST http://route/addrefineries with a json array of refineries, or one per line with Content-Type: application/x-ndjson
+@app.route('/addrefineries', methods=['POST'])
+async def post_refineries()-> dict:
+    '''
+    Title: post_refineries
+    Description: This route adds the valid refineries of the body in one transaction, the invalid ones are reported and skipped
+    Args: None
+    Returns: A json object containing the ids of the inserted refineries and the errors, both with the position of the refinery in the body
+    '''
+    
+    # Get the data
+    try:
+        refineries = parse_bulk_body(request.mimetype, await request.get_data())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    if len(refineries) > MAX_BULK_SIZE:
+        return jsonify({"error": f"at most {MAX_BULK_SIZE} refineries per request"}), 400
+    
+    # Check every refinery
+    valid, positions, errors = check_refineries(refineries)
+    
+    if not valid:
+        return jsonify({"inserted": [], "errors": errors}), 400
+    
+    try:
+        # One transaction for all the refineries
+        async with engine.begin() as conn:
+            ids = await conn.run_sync(insert_refineries, valid)
+            version = await conn.run_sync(get_table_version)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    # Drop the cached version and filter results
+    invalidate_read_caches()
+    suggest_index.update([dict(refinery, index=refinery_id) for refinery, refinery_id in zip(valid, ids)], [], version)
+    
+    inserted = [{"row": position, "index": refinery_id} for position, refinery_id in zip(positions, ids)]
+    
+    return jsonify({"inserted": inserted, "errors": errors}), 200
+
+
+# Delete refinery method
+# Example
+# DELETE http://route/deleterefinery/1
+@app.route('/deleterefinery/<int:to_delete_id>', methods=['DELETE'])
+async def delete_refinery(to_delete_id)-> dict:
+    '''
+    Title: delete_refinery
+    Description: This route deletes a refinery from the refinery table with one DELETE ... RETURNING
+    Args: to_delete_id
+    Returns: A json object containing the data, 404 if there is no refinery with this id
+    '''
+    
+    try:
+        # Delete the refinery and commit
+        async with engine.begin() as conn:
+            data = await conn.run_sync(delete_refineries, Refinery.refinery_id == to_delete_id)
+            version = await conn.run_sync(get_table_version)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    if not data:
+        return jsonify({"error": f"refinery {to_delete_id} not found"}), 404
+    
+    # Drop the cached version and filter results
+    invalidate_read_caches()
+    suggest_index.update([], [to_delete_id], version)
+    
+    return jsonify(data[0]), 200
+
+
+# Update refinery method
+# Example
+# PATCH http://route/updaterefinery/1 with the following json data
+@app.route('/updaterefinery/<int:to_update_id>', methods=['PATCH'])
+async def update_refinery(to_update_id)-> dict:
+    '''
+    Title: update_refinery
+    Description: This route updates the given columns of a refinery with one UPDATE ... RETURNING
+    Args: to_update_id
+    Returns: A json object containing the updated data, 404 if there is no refinery with this id
+    '''
+    
+    # Get the patch data
+    try:
+        values = get_update_values(await request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        # Update the refinery and commit
+        async with engine.begin() as conn:
+            data = await conn.run_sync(update_refineries, Refinery.refinery_id == to_update_id, values)
+            version = await conn.run_sync(get_table_version)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    if not data:
+        return jsonify({"error": f"refinery {to_update_id} not found"}), 404
+    
+    # Drop the cached version and filter results
+    invalidate_read_caches()
+    suggest_index.update(data, [], version)
+    
+    # Return the updated refinery
+    return jsonify(data[0]), 200
+
+
+# Delete the refineries of a filter
+# Example
+# DELETE http://route/deleterefineries?country=France&status=closed
+@app.route('/deleterefineries', methods=['DELETE'])
+async def delete_filtered_refineries()-> dict:
+    '''
+    Title: delete_filtered_refineries
+    Description: This route deletes every refinery matching the region, country and status filters with one DELETE ... RETURNING
+    Args: region, country, status
+    Returns: A json object containing the number of deleted refineries and their data
+    '''
+    
+    # Get the filters, at least one so the whole table is not deleted by mistake
+    try:
+        conditions = get_required_filter_conditions(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        async with engine.begin() as conn:
+            data = await conn.run_sync(delete_refineries, and_(*conditions))
+            version = await conn.run_sync(get_table_version)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    # Drop the cached version and filter results
+    if data:
+        invalidate_read_caches()
+        suggest_index.update([], [refinery["index"] for refinery in data], version)
+    
+    return jsonify({"count": len(data), "data": data}), 200
+
+
+# Update the refineries of a filter
+# Example
+# PATCH http://route/updaterefineries?country=France with {"status": "closed"}
+@app.route('/updaterefineries', methods=['PATCH'])
+async def update_filtered_refineries()-> dict:
+    '''
+    Title: update_filtered_refineries
+    Description: This route applies the same patch to every refinery matching the region, country and status filters with one UPDATE ... RETURNING
+    Args: region, country, status
+    Returns: A json object containing the number of updated refineries and their data
+    '''
+    
+    # Get the filters and the patch
+    try:
+        conditions = get_required_filter_conditions(request.args)
+        values = get_update_values(await request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        async with engine.begin() as conn:
+            data = await conn.run_sync(update_refineries, and_(*conditions), values)
+            version = await conn.run_sync(get_table_version)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    # Drop the cached version and filter results
+    if data:
+        invalidate_read_caches()
+        suggest_index.update(data, [], version)
+    
+    return jsonify({"count": len(data), "data": data}), 200
+
+
+if __name__ == "__main__":
+    app.run()
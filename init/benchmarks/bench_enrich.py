@@ -0,0 +1,242 @@
+# Benchmark of the enrichment crawler against a local stand-in of Wikipedia
+# Run from the init folder, nothing is sent outside of the machine
+# python -m benchmarks.bench_enrich --pages 2000 --workers 1,8,32
+
+# Global imports
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import tempfile
+import threading
+import time
+
+from utils.refinery_db_ext import get_refinery_data
+from utils.refinery_enrich import ENRICH_RETRIES, get_refinery_links, enrich_refinery_data
+from benchmarks.synthetic import REGIONS, CITIES, OPERATORS
+
+
+# Constants
+PAGES = 1000
+
+WORKERS = "1,8,32"
+
+# Seconds the stand-in takes to answer an article
+LATENCY = 0.02
+
+# Requests per second per host, high enough for the stand-in to be the limit
+HOST_RATE = 2000.0
+
+BACKOFF = 0.01
+
+# Every FLAKY_EVERY article answers 503 the first time, every MISSING_EVERY article does not exist
+FLAKY_EVERY = 10
+
+MISSING_EVERY = 50
+
+HOST = "127.0.0.1"
+
+LIST_PATH = "/wiki/List_of_oil_refineries"
+
+ARTICLE_TEMPLATE = """<!DOCTYPE html>
+<html lang="en"><head><meta charset="UTF-8"><title>{name} - Wikipedia</title></head>
+<body><h1 id="firstHeading">{name}</h1>
+<span id="coordinates"><span class="geo-dec">{latitude}N {longitude}E</span><span class="geo">{latitude}; {longitude}</span></span>
+<table class="infobox vcard"><tbody>
+<tr><th colspan="2" class="infobox-above">{name}</th></tr>
+<tr><th scope="row" class="infobox-label">Country</th><td class="infobox-data">{country}</td></tr>
+<tr><th scope="row" class="infobox-label">Operator</th><td class="infobox-data"><a href="/wiki/{operator}">{operator}</a><sup class="reference"><a href="#cite_note-1">[1]</a></sup></td></tr>
+<tr><th scope="row" class="infobox-label">Capacity</th><td class="infobox-data">{capacity:,}&#160;bbl/d ({cubic:,}&#160;m<sup>3</sup>/d)</td></tr>
+</tbody></table>
+<p>The <b>{name}</b> is an oil refinery.</p></body></html>"""
+
+
+
+# Stand-in
+############################################################################################################
+
+
+# Describe the synthetic refineries
+def make_articles(pages:int)->dict:
+    '''
+    Title: make_articles
+    Description: This function describes the refineries of the stand-in, the article of each one and the fields expected from it.
+    Arguments:
+        pages: The number of refineries with an article
+    Returns:
+        articles: The fields of every refinery by article path
+    '''
+    countries = [(region, country) for region, region_countries in REGIONS.items() for country in region_countries]
+    articles = {}
+    for number in range(pages):
+        region, country = countries[number % len(countries)]
+        name = f"{CITIES[number % len(CITIES)]} Refinery {number}"
+        articles[f"/wiki/{name.replace(' ', '_')}"] = {
+            "number": number,
+            "name": name,
+            "region": region,
+            "country": country,
+            "operator": OPERATORS[number % len(OPERATORS)],
+            "latitude": round(-60 + number * 0.037 % 120, 4),
+            "longitude": round(-170 + number * 0.071 % 340, 4),
+            "capacity": 5000 + number * 1000 % 900000
+        }
+    return articles
+
+
+# Build the list page
+def make_list_page(articles:dict)->bytes:
+    '''
+    Title: make_list_page
+    Description: This function lays out the refineries like the Wikipedia list, grouped by region and country.
+        The capacity of every fifth refinery is only given in its infobox and one unit without article follows every tenth refinery.
+    Arguments:
+        articles: The refineries by article path, see make_articles
+    Returns:
+        content: The HTML content of the list page
+    '''
+    sections = {}
+    for path, article in articles.items():
+        capacity = "" if article["number"] % 5 == 0 else f"{article['capacity']:,}&#160;bbl/d"
+        row = f'<li><a href="{path}" title="{article["name"]}">{article["name"]}</a> (<a href="/wiki/{article["operator"]}">{article["operator"]}</a>), {capacity}'
+        if article["number"] % 10 == 0:
+            row += "\n<ul>\n<li>Unit 1 10,000&#160;bpd</li>\n</ul>"
+        sections.setdefault(article["region"], {}).setdefault(article["country"], []).append(row + "</li>")
+
+    body = []
+    for region, countries in sections.items():
+        body.append(f'<h2><span class="mw-headline" id="{region}">{region}</span></h2>')
+        for country, rows in countries.items():
+            body.append(f'<h3><span class="mw-headline" id="{country}">{country}</span></h3>\n<ul>\n' + "\n".join(rows) + "\n</ul>")
+    body.append('<h2><span class="mw-headline" id="See_also">See also</span></h2>')
+
+    return ('<!DOCTYPE html>\n<html lang="en"><head><meta charset="UTF-8"><title>List of oil refineries - Wikipedia</title></head>\n<body>\n'
+            + "\n".join(body) + "\n</body></html>").encode()
+
+
+# Start the stand-in
+def start_standin(articles:dict, latency:float)->tuple:
+    '''
+    Title: start_standin
+    Description: This function serves the list page and the articles on a free local port, in a daemon thread.
+        The articles answer after the latency, some of them 503 on the first request or 404.
+    Arguments:
+        articles: The refineries by article path, see make_articles
+        latency: The seconds taken to answer an article
+    Returns:
+        server, state: The server, and the requests it received and the articles that already failed, to reset between runs
+    '''
+    list_page = make_list_page(articles)
+    state = {"lock": threading.Lock(), "requests": 0, "failed": set()}
+
+    class StandinHandler(BaseHTTPRequestHandler):
+
+        # Keep the connections of the pooled session open
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            with state["lock"]:
+                state["requests"] += 1
+                article = articles.get(self.path)
+                flaky = article is not None and article["number"] % FLAKY_EVERY == 1 and self.path not in state["failed"]
+                if flaky:
+                    state["failed"].add(self.path)
+
+            if self.path == LIST_PATH:
+                return self.answer(200, list_page)
+
+            time.sleep(latency)
+            if article is None or article["number"] % MISSING_EVERY == 2:
+                return self.answer(404, b"Not found")
+            if flaky:
+                return self.answer(503, b"Try again")
+
+            return self.answer(200, ARTICLE_TEMPLATE.format(cubic=article["capacity"] * 159 // 1000, **article).encode())
+
+        def answer(self, status, body):
+            self.send_response(status)
+            self.send_header("Content-Type", "text/html; charset=UTF-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *arguments):
+            pass
+
+    server = ThreadingHTTPServer((HOST, 0), StandinHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+
+# Checks
+############################################################################################################
+
+
+# Check the enriched table
+def check_enriched(enriched, links:list, articles:dict, base:str)->None:
+    '''
+    Title: check_enriched
+    Description: This function checks every row with an existing article got the fields of its infobox and the other rows none.
+    Arguments:
+        enriched: The table returned by enrich_refinery_data
+        links: The article of each row
+        articles: The refineries by article path, see make_articles
+        base: The URL of the stand-in
+    Returns:
+        None
+    '''
+    for (_, row), link in zip(enriched.iterrows(), links):
+        article = articles.get(link[len(base):]) if link else None
+        if article is None or article["number"] % MISSING_EVERY == 2:
+            if row["operator"] is not None:
+                raise Exception(f"{row['refinery']} has an operator without an article")
+            continue
+
+        expected = (article["operator"], article["latitude"], article["longitude"], article["capacity"] / 1000)
+        if (row["operator"], row["latitude"], row["longitude"], row["infobox_capacity"]) != expected:
+            raise Exception(f"{row['refinery']} enriched with {row[['operator', 'latitude', 'longitude', 'infobox_capacity']].tolist()}, expected {expected}")
+        if row["capacity"] == 0:
+            raise Exception(f"{row['refinery']} capacity not filled from its infobox")
+
+
+def main():
+
+    # Parse the arguments
+    parser = argparse.ArgumentParser(description="Benchmark the enrichment crawler against a local stand-in")
+    parser.add_argument("--pages", type=int, default=PAGES, help="Number of refinery articles")
+    parser.add_argument("--workers", default=WORKERS, help="Comma separated numbers of threads")
+    parser.add_argument("--latency", type=float, default=LATENCY, help="Seconds the stand-in takes to answer an article")
+    parser.add_argument("--host-rate", type=float, default=HOST_RATE, help="Requests per second per host, 0 for no limit")
+    parser.add_argument("--retries", type=int, default=ENRICH_RETRIES, help="Attempts after the first one")
+    arguments = parser.parse_args()
+
+    articles = make_articles(arguments.pages)
+    server, state = start_standin(articles, arguments.latency)
+    base = f"http://{HOST}:{server.server_address[1]}"
+
+    try:
+        # Scrape the list page of the stand-in through a temporary cache
+        with tempfile.TemporaryDirectory() as cache_dir:
+            refinery_data = get_refinery_data(url=base + LIST_PATH, cache_dir=cache_dir)
+            links = get_refinery_links(base + LIST_PATH, cache_dir)
+
+        print(f"{len(refinery_data)} refineries, {len(set(link for link in links if link))} articles, {arguments.latency*1000:.0f} ms per article")
+        print(f"{'workers':>7} {'seconds':>9} {'articles/s':>11} {'requests':>9} {'speedup':>8}")
+        baseline = None
+        for workers in [int(count) for count in arguments.workers.split(",")]:
+            with state["lock"]:
+                state["requests"], state["failed"] = 0, set()
+
+            start = time.perf_counter()
+            enriched = enrich_refinery_data(refinery_data, links, workers=workers, host_rate=arguments.host_rate, retries=arguments.retries, backoff=BACKOFF)
+            seconds = time.perf_counter() - start
+            check_enriched(enriched, links, articles, base)
+
+            baseline = baseline or seconds
+            print(f"{workers:>7} {seconds:>9.2f} {arguments.pages/seconds:>11.0f} {state['requests']:>9} {baseline/seconds:>7.2f}x")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
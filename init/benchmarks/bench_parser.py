@@ -0,0 +1,139 @@
+# Benchmark of the refinery page parser backends
+# Run from the init folder
+# python -m benchmarks.bench_parser --fixture benchmarks/fixtures/list_of_oil_refineries.html
+
+# Global imports
+import argparse
+import multiprocessing
+import os
+import resource
+import statistics
+import time
+
+from utils.refinery_db_ext import parse_refinery_page, REFINERY_PARSERS
+
+
+# Constants
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), "fixtures", "list_of_oil_refineries.html")
+
+REPEAT = 10
+
+
+# Reset the peak memory
+def reset_peak_memory()->None:
+    '''
+    Title: reset_peak_memory
+    Description: This function resets the peak resident memory of the process, only supported on Linux.
+    Arguments:
+        None
+    Returns:
+        None
+    '''
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+
+# Get the peak memory
+def peak_memory()->int:
+    '''
+    Title: peak_memory
+    Description: This function returns the peak resident memory of the process.
+    Arguments:
+        None
+    Returns:
+        peak: The peak resident memory in KiB
+    '''
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+# Benchmark one backend
+def benchmark_parser(content:bytes, parser:str, repeat:int)->dict:
+    '''
+    Title: benchmark_parser
+    Description: This function times the given parser backend and measures the growth of the peak resident memory.
+        It is meant to run in a fresh process so the peak memory of one backend does not hide the other.
+    Arguments:
+        content: The HTML content of the page
+        parser: The parser backend to benchmark
+        repeat: The number of timed runs
+    Returns:
+        result: A dictionary with the number of rows, the timings in seconds and the peak memory growth in KiB
+    '''
+
+    # Peak memory before parsing
+    reset_peak_memory()
+    baseline = peak_memory()
+
+    # First run also measures the memory
+    rows = parse_refinery_page(content, parser)
+    peak = peak_memory()
+
+    # Timed runs
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse_refinery_page(content, parser)
+        timings.append(time.perf_counter() - start)
+
+    return {
+        "parser": parser,
+        "rows": len(rows),
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "peak_memory_kib": peak - baseline
+    }
+
+
+# Run a benchmark in a fresh process
+def run_in_process(content:bytes, parser:str, repeat:int)->dict:
+    '''
+    Title: run_in_process
+    Description: This function runs benchmark_parser in a new spawned process.
+    Arguments:
+        content: The HTML content of the page
+        parser: The parser backend to benchmark
+        repeat: The number of timed runs
+    Returns:
+        result: The result of benchmark_parser
+    '''
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(benchmark_parser, (content, parser, repeat))
+
+
+def main():
+
+    # Parse the arguments
+    argument_parser = argparse.ArgumentParser(description="Benchmark the refinery page parser backends")
+    argument_parser.add_argument("--fixture", default=FIXTURE_PATH, help="Saved copy of the refinery page")
+    argument_parser.add_argument("--repeat", type=int, default=REPEAT, help="Number of timed runs per backend")
+    argument_parser.add_argument("--parser", action="append", choices=list(REFINERY_PARSERS), help="Backend to benchmark, all by default")
+    arguments = argument_parser.parse_args()
+
+    # Read the fixture
+    with open(arguments.fixture, "rb") as fixture:
+        content = fixture.read()
+
+    # Check every backend extracts the same rows
+    parsers = arguments.parser or list(REFINERY_PARSERS)
+    rows = {parser: parse_refinery_page(content, parser) for parser in parsers}
+    if any(rows[parser] != rows[parsers[0]] for parser in parsers):
+        raise Exception("Parser backends do not extract the same rows")
+
+    print(f"{'parser':<12} {'rows':>6} {'min (ms)':>10} {'median (ms)':>12} {'peak memory (KiB)':>18}")
+    for parser in parsers:
+        result = run_in_process(content, parser, arguments.repeat)
+        print(f"{result['parser']:<12} {result['rows']:>6} {result['min']*1000:>10.2f} {result['median']*1000:>12.2f} {result['peak_memory_kib']:>18}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# Benchmark of the ORM and Core read paths of the API
+# Run from the init folder, against a temporary SQLite database by default
+# python -m benchmarks.bench_read_path --rows 10000
+
+# Global imports
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+from utils.refinery_db_io import Refinery, get_db_engine, insert_table_into_db, select_refineries, fetch_refineries
+from benchmarks.synthetic import make_refinery_table
+
+
+# Constants
+ROWS = 10000
+
+REPEAT = 20
+
+
+# ORM read path
+def read_orm(Session)->list:
+    '''
+    Title: read_orm
+    Description: This function reads the refineries by building Refinery objects then calling to_dict.
+    Arguments:
+        Session: The session factory
+    Returns:
+        refineries: A list of dictionaries
+    '''
+    with Session() as session:
+        return [obj.to_dict() for obj in session.query(Refinery).all()]
+
+
+# Core read path
+def read_core(engine)->list:
+    '''
+    Title: read_core
+    Description: This function reads the refineries as Core row mappings.
+    Arguments:
+        engine: The engine object to connect to the database
+    Returns:
+        refineries: A list of dictionaries
+    '''
+    return fetch_refineries(engine, select_refineries())
+
+
+# Time a read path
+def time_read(read, argument, repeat:int)->float:
+    '''
+    Title: time_read
+    Description: This function returns the median time of the given read path.
+    Arguments:
+        read: The read function
+        argument: The argument of the read function
+        repeat: The number of timed runs
+    Returns:
+        seconds: The median time of one read
+    '''
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        read(argument)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+
+    # Parse the arguments
+    parser = argparse.ArgumentParser(description="Benchmark the ORM and Core read paths")
+    parser.add_argument("--db", default=None, help="Database URL, a temporary SQLite database by default. The refinery table is replaced")
+    parser.add_argument("--rows", type=int, default=ROWS, help="Number of refineries")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="Number of timed runs per path")
+    arguments = parser.parse_args()
+
+    # Temporary database
+    temporary_dir = tempfile.TemporaryDirectory()
+    engine = get_db_engine(arguments.db or f"sqlite:///{os.path.join(temporary_dir.name, 'refinery.db')}")
+    Session = sessionmaker(bind=engine)
+
+    try:
+        insert_table_into_db(engine, refinery_data=make_refinery_table(arguments.rows))
+
+        # Both paths return the same rows
+        if sorted(read_orm(Session), key=lambda row: row['index']) != sorted(read_core(engine), key=lambda row: row['index']):
+            raise Exception("The ORM and Core read paths do not return the same rows")
+
+        orm = time_read(read_orm, Session, arguments.repeat)
+        core = time_read(read_core, engine, arguments.repeat)
+
+        print(f"{'path':<6} {'ms/read':>9} {'us/row':>8}")
+        print(f"{'orm':<6} {orm*1000:>9.2f} {orm*1e6/arguments.rows:>8.2f}")
+        print(f"{'core':<6} {core*1000:>9.2f} {core*1e6/arguments.rows:>8.2f}")
+        print(f"core is {orm/core:.1f}x faster per row")
+    finally:
+        engine.dispose()
+        temporary_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
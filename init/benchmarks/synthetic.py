@@ -0,0 +1,107 @@
+# Synthetic refinery data for the benchmarks
+
+# Global imports
+import numpy as np
+import pandas as pd
+
+
+# Constants
+REGIONS = {
+    "Africa": ["Algeria", "Egypt", "Nigeria", "South Africa"],
+    "Asia": ["China", "India", "Japan", "South Korea", "Singapore"],
+    "Europe": ["France", "Germany", "Italy", "Netherlands", "United Kingdom"],
+    "Middle East": ["Iran", "Kuwait", "Saudi Arabia", "United Arab Emirates"],
+    "North America": ["Canada", "Mexico", "United States"],
+    "Oceania": ["Australia", "New Zealand"],
+    "South America": ["Argentina", "Brazil", "Venezuela"]
+}
+
+CITIES = ["Memphis", "Port Arthur", "Sines", "Ulsan", "Jamnagar", "Rotterdam", "Antwerp", "Pernis", "Ras Tanura", "Ruwais"]
+
+OPERATORS = ["Valero", "Shell", "TotalEnergies", "ExxonMobil", "Sinopec", "Saudi Aramco", "Petrobras", "Eni", "Repsol", "BP"]
+
+STATUSES = ["active", "closed"]
+
+
+# Make a refinery table
+def make_refinery_table(rows:int, seed:int=0)->pd.DataFrame:
+    '''
+    Title: make_refinery_table
+    Description: This function makes a synthetic refinery table shaped like the output of format_refinery_table.
+    Arguments:
+        rows: The number of refineries
+        seed: The seed of the random generator
+    Returns:
+        refinery_data: A pandas DataFrame with the region, country, refinery, capacity, unit and status columns
+    '''
+    generator = np.random.default_rng(seed)
+
+    # Pick a region then one of its countries
+    countries = [(region, country) for region, region_countries in REGIONS.items() for country in region_countries]
+    picked = generator.integers(0, len(countries), rows)
+    regions = np.array([region for region, _ in countries], dtype=object)[picked]
+    country_names = np.array([country for _, country in countries], dtype=object)[picked]
+
+    # Unique refinery names
+    cities = np.array(CITIES, dtype=object)[generator.integers(0, len(CITIES), rows)]
+    refineries = cities + " Refinery " + pd.Series(np.arange(rows)).astype(str).to_numpy(dtype=object)
+
+    return pd.DataFrame({
+        "region": regions,
+        "country": country_names,
+        "refinery": refineries,
+        "capacity": np.round(generator.uniform(5, 900, rows), 1),
+        "unit": "kbd",
+        "status": np.array(STATUSES, dtype=object)[(generator.random(rows) < 0.1).astype(int)]
+    })
+
+
+# Capacity texts of the raw rows, filled from a capacity in kbd
+RAW_CAPACITIES = [
+    "{barrels:,}\xa0bbl/d ({cubic:,}\xa0m3/d)",
+    "{barrels:,}\xa0bpd",
+    "{barrels:,} barrels per day",
+    "{tonnes_per_year:,} tonnes/year",
+    "{tonnes_per_day:,} tonnes/day",
+    "{million_tonnes:.1f} million tonnes per year",
+    ""
+]
+
+# Status texts of the raw rows, mostly empty
+RAW_STATUSES = ["", "", "", "", "", "", " mothballed", " (closed in 2012)", " biorefinery", " to be commissioned in 2027"]
+
+
+# Make a raw refinery table
+def make_raw_refinery_table(rows:int, seed:int=0)->pd.DataFrame:
+    '''
+    Title: make_raw_refinery_table
+    Description: This function makes a synthetic refinery table shaped like the rows scraped from the refinery page, the input of format_refinery_table.
+        The raw texts mix every capacity unit, status keyword and the non ASCII spaces of the page.
+    Arguments:
+        rows: The number of refineries
+        seed: The seed of the random generator
+    Returns:
+        refinery_data: A pandas DataFrame with the Region, Country and Raw columns
+    '''
+    generator = np.random.default_rng(seed)
+
+    # Pick a region then one of its countries, with the headings of the page
+    countries = [(region, country) for region, region_countries in REGIONS.items() for country in region_countries]
+    picked = generator.integers(0, len(countries), rows)
+    regions = np.array([f"{region}[edit]" for region, _ in countries], dtype=object)[picked]
+    country_names = np.array([f"{country}[edit]" for _, country in countries], dtype=object)[picked]
+
+    # Name, operator and location
+    cities = np.array(CITIES, dtype=object)[generator.integers(0, len(CITIES), rows)]
+    operators = np.array(OPERATORS, dtype=object)[generator.integers(0, len(OPERATORS), rows)]
+
+    # Capacity and status
+    kbd = generator.integers(5, 900, rows)
+    capacities = generator.integers(0, len(RAW_CAPACITIES), rows)
+    statuses = np.array(RAW_STATUSES, dtype=object)[generator.integers(0, len(RAW_STATUSES), rows)]
+
+    raw = [f"{city} Refinery ({operator}), {city} " + RAW_CAPACITIES[capacity].format(barrels=value * 1000, cubic=value * 159, tonnes_per_year=value * 49600,
+                                                                                             tonnes_per_day=value * 136, million_tonnes=value * 0.0496) + status
+           for city, operator, value, capacity, status in zip(cities, operators, kbd.tolist(), capacities.tolist(), statuses)]
+
+    return pd.DataFrame({"Region": regions, "Country": country_names, "Raw": raw})
@@ -1,4 +1,7 @@
 import utils.refinery_db_ext
+import utils.refinery_db_cache
+import utils.refinery_db_io
+import argparse
 
 
 # Import logging
@@ -14,18 +17,61 @@ FILE_HANDLER.setFormatter(FORMATTER)
 LOGGER.addHandler(FILE_HANDLER)
 
 
+# Name used to remember which version of the page was written
+CONSUMER = "generateCSV"
+
+
+def parse_arguments()->argparse.Namespace:
+    '''
+    Title: parse_arguments
+    Description: This function parses the command line arguments.
+    Arguments:
+        None
+    Returns:
+        arguments: The parsed arguments
+    '''
+    parser = argparse.ArgumentParser(description="Write the refinery table to a csv file")
+    parser.add_argument("--cache-dir", default=utils.refinery_db_cache.REFINERY_CACHE_DIR, help="Directory of the cached refinery page")
+    parser.add_argument("--offline", action="store_true", help="Read the refinery page from the cache without any request")
+    parser.add_argument("--force", action="store_true", help="Write the csv file even if this version of the page was already written")
+    parser.add_argument("--from-db", action="store_true", help="Export the refinery table of the database instead of scraping the page")
+    return parser.parse_args()
 
 
 # Main function
 def main():
  
+    # Parse the arguments
+    arguments = parse_arguments()
+
+    # Export the table already in the database
+    if arguments.from_db:
+        LOGGER.info("Exporting the refinery table")
+        
+        engine = utils.refinery_db_io.get_db_engine(**utils.refinery_db_io.get_engine_config())
+        try:
+            utils.refinery_db_io.export_table_to_csv(engine, "refinery_data.csv")
+        except Exception as e:
+            LOGGER.error("Error exporting refinery data: %s", e)
+            raise e
+        finally:
+            engine.dispose()
+        
+        LOGGER.info("Refinery data written to refinery_data.csv")
+        return
+
     # Get the refinery data
     LOGGER.info("Getting refinery data")   
 
 
     try:
         
-        table = utils.refinery_db_ext.get_refinery_data()
+        table = utils.refinery_db_ext.get_refinery_data(cache_dir=arguments.cache_dir, offline=arguments.offline, consumer=None if arguments.force else CONSUMER)
+
+        # Nothing to do if this version of the page was already written
+        if table is None:
+            LOGGER.info("Refinery page unchanged, refinery_data.csv is up to date")
+            return
 
         # Write the table to a csv file
         table.to_csv("refinery_data.csv", index=False)
@@ -33,8 +79,11 @@ def main():
         LOGGER.error("Error getting refinery data: %s", e)
         raise e
     
+    # Remember the written version of the page
+    utils.refinery_db_cache.mark_page_processed(utils.refinery_db_ext.REFINERY_LINK, CONSUMER, table.attrs["content_hash"], arguments.cache_dir)
+
     LOGGER.info("Refinery data written to refinery_data.csv")
     
     
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,5 +1,9 @@
 # Import the necessary libraries
 import utils.refinery_db_io 
+import utils.refinery_db_ext
+import utils.refinery_db_cache
+import utils.refinery_enrich
+import argparse
 
 
 # Import logging
@@ -15,11 +19,62 @@ FILE_HANDLER.setFormatter(FORMATTER)
 LOGGER.addHandler(FILE_HANDLER)
 
 
+# Name used to remember which version of the page was loaded
+CONSUMER = "generateDB"
+
+
+def parse_arguments()->argparse.Namespace:
+    '''
+    Title: parse_arguments
+    Description: This function parses the command line arguments.
+    Arguments:
+        None
+    Returns:
+        arguments: The parsed arguments
+    '''
+    parser = argparse.ArgumentParser(description="Load the refinery table into the database")
+    parser.add_argument("--cache-dir", default=utils.refinery_db_cache.REFINERY_CACHE_DIR, help="Directory of the cached refinery page")
+    parser.add_argument("--offline", action="store_true", help="Read the refinery page from the cache without any request")
+    parser.add_argument("--force", action="store_true", help="Load the table even if this version of the page was already loaded")
+    parser.add_argument("--replace", action="store_true", help="Rewrite the whole table instead of syncing the changed rows")
+    parser.add_argument("--enrich", action="store_true", help="Add the operator, coordinates and infobox capacity from the article of every refinery and country, requires --replace")
+    arguments = parser.parse_args()
+
+    # The sync only writes the columns of the refinery table, the added ones would be dropped
+    if arguments.enrich and not arguments.replace:
+        parser.error("--enrich requires --replace, the sync keeps the columns of the refinery table")
+
+    return arguments
+
 
 def main():
 
+    # Parse the arguments
+    arguments = parse_arguments()
+
+    # Get the refinery data, None if this version of the page is already loaded
+    try:
+        refinery_data = utils.refinery_db_ext.get_refinery_data(cache_dir=arguments.cache_dir, offline=arguments.offline, consumer=None if arguments.force else CONSUMER)
+    except Exception as e:
+        LOGGER.error("Error getting refinery data: %s", e)
+        raise e
+    
+    if refinery_data is None:
+        LOGGER.info("Refinery page unchanged, nothing to load")
+        return
+
+    # Crawl the refinery articles linked by the page
+    if arguments.enrich:
+        try:
+            links = utils.refinery_enrich.get_refinery_links(utils.refinery_db_ext.REFINERY_LINK, arguments.cache_dir)
+            country_links = utils.refinery_enrich.get_country_links(utils.refinery_db_ext.REFINERY_LINK, arguments.cache_dir)
+            refinery_data = utils.refinery_enrich.enrich_refinery_data(refinery_data, links, country_links=country_links, **utils.refinery_enrich.get_enrich_config())
+        except Exception as e:
+            LOGGER.error("Error enriching refinery data: %s", e)
+            raise e
+
     # Test connection to the database
-    engine = utils.refinery_db_io.get_db_engine()
+    engine = utils.refinery_db_io.get_db_engine(**utils.refinery_db_io.get_engine_config())
     
     
     # Try to create the refinery table
@@ -35,18 +90,38 @@ def main():
     # Test the connection
     try:
         utils.refinery_db_io.test_connection(engine)
-        try:
-            utils.refinery_db_io.insert_table_into_db(engine)
-        except Exception as e:
-            LOGGER.error("Error inserting table into database: %s", e)
-            raise e
 
-        # Add the primary key
-        try:
-            utils.refinery_db_io.add_primary_key(engine)
-        except Exception as e:
-            LOGGER.error("Error adding primary key: %s", e)
-            raise e
+        # Only write the changed rows, the table created above already has its primary key
+        if not arguments.replace:
+            try:
+                utils.refinery_db_io.sync_table_into_db(engine, refinery_data=refinery_data)
+            except Exception as e:
+                LOGGER.error("Error syncing table into database: %s", e)
+                raise e
+        else:
+            try:
+                utils.refinery_db_io.insert_table_into_db(engine, refinery_data=refinery_data)
+            except Exception as e:
+                LOGGER.error("Error inserting table into database: %s", e)
+                raise e
+
+            # Add the primary key
+            try:
+                utils.refinery_db_io.add_primary_key(engine)
+            except Exception as e:
+                LOGGER.error("Error adding primary key: %s", e)
+                raise e
+
+            # Recreate the indexes dropped with the old table
+            utils.refinery_db_io.create_indexes(engine)
+
+            # Draw the next ids from a sequence following the loaded ones
+            utils.refinery_db_io.sync_id_sequence(engine)
+
+            # Move the version forward and rebuild the summary for the API clients
+            with engine.begin() as conn:
+                utils.refinery_db_io.bump_table_version(conn)
+                utils.refinery_db_io.refresh_refinery_summary(conn)
         
     except Exception as e:
         LOGGER.error("Error testing connection to database: %s", e)
@@ -56,6 +131,9 @@ def main():
     # Dispose of the engine
     engine.dispose()
 
+    # Remember the loaded version of the page
+    utils.refinery_db_cache.mark_page_processed(utils.refinery_db_ext.REFINERY_LINK, CONSUMER, refinery_data.attrs["content_hash"], arguments.cache_dir)
+
     
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
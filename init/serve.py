@@ -0,0 +1,141 @@
+# Production server of app.py, pre-fork gunicorn workers with a thread pool each
+# Example
+# REFINERY_WORKERS=4 REFINERY_THREADS=8 python serve.py
+
+# Global imports
+import multiprocessing
+import os
+
+from gunicorn.app.base import BaseApplication
+
+# Import the pool warm up
+from utils.refinery_db_io import warm_up_pool
+
+
+# Constants, overridden by the REFINERY_* environment variables
+BIND = "0.0.0.0:8000"
+
+# Workers are processes, two per core and one waiting on the database
+WORKERS = multiprocessing.cpu_count() * 2 + 1
+
+# Threads per worker, 1 runs the sync worker
+THREADS = 4
+
+# Seconds before a silent worker is killed and replaced
+TIMEOUT = 30
+
+# Seconds the workers have to finish their requests on shutdown
+GRACEFUL_TIMEOUT = 30
+
+# Requests before a worker is replaced, 0 never replaces it
+MAX_REQUESTS = 0
+
+# Connections of a worker beyond one per thread, for the reload of the typeahead index
+SPARE_CONNECTIONS = 1
+
+
+
+def get_server_config()->dict:
+    '''
+    Title: get_server_config
+    Description: This function reads the gunicorn settings from the REFINERY_* environment variables, defaulting to the constants of the module
+    Args: None
+    Returns: The settings of the server
+    '''
+    threads = int(os.environ.get("REFINERY_THREADS", THREADS))
+    max_requests = int(os.environ.get("REFINERY_MAX_REQUESTS", MAX_REQUESTS))
+
+    return {
+        "bind": os.environ.get("REFINERY_BIND", BIND),
+        "workers": int(os.environ.get("REFINERY_WORKERS", WORKERS)),
+        "threads": threads,
+        "worker_class": "gthread" if threads > 1 else "sync",
+        "timeout": int(os.environ.get("REFINERY_TIMEOUT", TIMEOUT)),
+        "graceful_timeout": int(os.environ.get("REFINERY_GRACEFUL_TIMEOUT", GRACEFUL_TIMEOUT)),
+        "max_requests": max_requests,
+        # Spread the replacements so the workers do not restart together
+        "max_requests_jitter": max_requests // 10,
+        # Import the app once in the arbiter, the workers share its memory until they write to it
+        "preload_app": True,
+        "accesslog": os.environ.get("REFINERY_ACCESS_LOG"),
+        "errorlog": "-"
+    }
+
+
+def get_pool_config(threads:int)->dict:
+    '''
+    Title: get_pool_config
+    Description: This function sizes the connection pool of a worker from its threads, a thread holds one connection at a time.
+        The whole server opens up to workers * (threads + SPARE_CONNECTIONS) connections instead of a full default pool per worker.
+    Args: threads
+    Returns: The REFINERY_DB_* environment variables of the pool, the variables already set are kept
+    '''
+    return {
+        "REFINERY_DB_POOL_SIZE": os.environ.get("REFINERY_DB_POOL_SIZE", str(threads + SPARE_CONNECTIONS)),
+        "REFINERY_DB_MAX_OVERFLOW": os.environ.get("REFINERY_DB_MAX_OVERFLOW", "0")
+    }
+
+
+# Server hooks, run by gunicorn
+def post_fork(server, worker)->None:
+    '''
+    Title: post_fork
+    Description: This function gives the new worker its own engine, the pooled connections of the arbiter cannot be shared across processes
+    Args: server, worker
+    Returns: None
+    '''
+    import app
+    app.init_engine()
+
+
+def post_worker_init(worker)->None:
+    '''
+    Title: post_worker_init
+    Description: This function opens one connection per thread and loads the typeahead index before the worker accepts its first request
+    Args: worker
+    Returns: None
+    '''
+    import app
+    warm_up_pool(app.engine, worker.cfg.threads)
+    app.load_suggest_index()
+
+
+def worker_exit(server, worker)->None:
+    '''
+    Title: worker_exit
+    Description: This function closes the pooled connections of a stopping worker, once its requests are finished
+    Args: server, worker
+    Returns: None
+    '''
+    import app
+    app.engine.dispose()
+
+
+class RefineryServer(BaseApplication):
+    '''
+    Title: RefineryServer
+    Description: Gunicorn application serving app.py with the given settings, without a configuration file
+    '''
+
+    def __init__(self, options:dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+        self.cfg.set("post_fork", post_fork)
+        self.cfg.set("post_worker_init", post_worker_init)
+        self.cfg.set("worker_exit", worker_exit)
+
+    def load(self):
+        from app import app
+        return app
+
+
+if __name__ == "__main__":
+    config = get_server_config()
+
+    # Set before the app is imported, the engines of the arbiter and of the workers read it
+    os.environ.update(get_pool_config(config["threads"]))
+    RefineryServer(config).run()
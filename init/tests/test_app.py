@@ -0,0 +1,77 @@
+# Tests of the routes of the Flask app on a temporary SQLite database
+
+# Global imports
+import pytest
+from sqlalchemy import event
+
+from utils.refinery_api import DEFAULT_PAGE_SIZE
+from utils.refinery_db_io import get_db_engine, create_refinery_db, sync_table_into_db
+from benchmarks.synthetic import make_refinery_table
+
+
+# Constants
+ROWS = 250
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    url = f"sqlite:///{tmp_path / 'refinery.db'}"
+    engine = get_db_engine(url)
+    create_refinery_db(engine)
+    sync_table_into_db(engine, refinery_data=make_refinery_table(ROWS))
+    engine.dispose()
+
+    # Engine of the app on the temporary database
+    import app
+    monkeypatch.setenv("REFINERY_DB_URL", url)
+    app.init_engine()
+    app.invalidate_read_caches()
+
+    # Statements sent by the routes
+    client = app.app.test_client()
+    client.statements = []
+    event.listen(app.engine, "before_cursor_execute", lambda *arguments: client.statements.append(arguments[2]))
+    yield client
+    app.engine.dispose()
+
+
+def test_index_without_limit_returns_the_first_page(client):
+    body = client.get("/").get_json()
+
+    assert len(body["data"]) == DEFAULT_PAGE_SIZE
+    assert body["next"] == body["data"][-1]["index"]
+
+    # The cursor gives the next page
+    following = client.get(f"/?after={body['next']}").get_json()
+    assert following["data"][0]["index"] > body["next"]
+
+
+def test_filter_without_limit_returns_the_first_page(client):
+    region = make_refinery_table(ROWS)["region"].mode()[0]
+    body = client.get(f"/filter?region={region}").get_json()
+
+    assert 0 < len(body["data"]) <= DEFAULT_PAGE_SIZE
+    assert all(row["region"] == region for row in body["data"])
+    assert "next" in body
+
+
+def test_filter_cache_hit_without_query(client):
+    first = client.get("/filter?region=Europe")
+    client.statements.clear()
+
+    # Same request, the version and the body come from memory
+    second = client.get("/filter?region=Europe")
+    assert second.get_data() == first.get_data() and second.headers["ETag"] == first.headers["ETag"]
+    assert client.statements == []
+
+
+def test_write_moves_the_cached_version(client):
+    etag = client.get("/filter?region=Europe").headers["ETag"]
+
+    added = {"region": "Europe", "country": "Iceland", "refinery": "Reykjavik Refinery", "capacity": 10, "unit": "kbd", "status": "active"}
+    assert client.post("/addrefinery", json=added).status_code == 200
+
+    response = client.get("/filter?region=Europe&country=Iceland")
+    assert response.headers["ETag"] != etag
+    assert [row["refinery"] for row in response.get_json()["data"]] == ["Reykjavik Refinery"]
+    assert client.get("/filter?region=Europe", headers={"If-None-Match": etag}).status_code == 200
@@ -0,0 +1,30 @@
+# Tests of the request checks shared by the Flask app and the async app
+
+# Global imports
+import pytest
+
+from utils.refinery_api import get_update_values, validate_refinery
+
+
+REFINERY = {"region": "Asia", "country": "Japan", "refinery": "Chiba", "capacity": 190, "unit": "kbd", "status": "active"}
+
+
+@pytest.mark.parametrize("capacity", ["nan", "inf", "-inf", float("inf"), -1])
+def test_bulk_refinery_rejects_capacity(capacity):
+    with pytest.raises(ValueError, match="capacity must be a non negative number"):
+        validate_refinery(dict(REFINERY, capacity=capacity))
+
+
+def test_bulk_refinery_accepts_capacity():
+    assert validate_refinery(dict(REFINERY, capacity="0"))["capacity"] == 0.0
+    assert validate_refinery(dict(REFINERY, capacity=190))["capacity"] == 190.0
+
+
+@pytest.mark.parametrize("capacity", ["nan", "inf", float("-inf"), -1])
+def test_update_rejects_capacity(capacity):
+    with pytest.raises(ValueError, match="capacity must be a non negative number"):
+        get_update_values({"capacity": capacity})
+
+
+def test_update_accepts_capacity():
+    assert get_update_values({"capacity": "250.5", "status": "closed"}) == {"capacity": 250.5, "status": "closed"}
@@ -0,0 +1,71 @@
+# Tests of the on disk cache of the refinery page, against a local stand-in
+
+# Global imports
+import pytest
+
+from benchmarks.bench_parser import FIXTURE_PATH
+from utils.refinery_db_cache import fetch_page, is_page_processed, mark_page_processed, read_cache
+from utils.refinery_db_ext import get_refinery_data
+
+
+def test_cached_page_answered_with_304(page_server, tmp_path):
+    url = page_server["url"] + "/wiki/List_of_oil_refineries"
+
+    first = fetch_page(url, str(tmp_path))
+    second = fetch_page(url, str(tmp_path))
+
+    assert first["changed"] and not second["changed"]
+    assert second["content"] == page_server["body"] and second["content_hash"] == first["content_hash"]
+
+    # The second request is conditional and answered without a body
+    assert page_server["requests"][0][1] is None
+    assert page_server["requests"][1][1] == read_cache(url, str(tmp_path))[1]["etag"]
+
+
+def test_changed_hash_without_etag(page_server, tmp_path):
+    url = page_server["url"] + "/wiki/List_of_oil_refineries"
+    page_server["etag"] = False
+
+    first = fetch_page(url, str(tmp_path))
+
+    # Same content downloaded again, the hash tells it did not change
+    same = fetch_page(url, str(tmp_path))
+    assert not same["changed"] and same["content_hash"] == first["content_hash"]
+
+    page_server["body"] = b"<html><body>new page</body></html>"
+    changed = fetch_page(url, str(tmp_path))
+    assert changed["changed"] and changed["content_hash"] != first["content_hash"]
+    assert read_cache(url, str(tmp_path))[0] == page_server["body"]
+
+
+def test_processed_page_is_not_parsed_again(page_server, tmp_path):
+    url = page_server["url"] + "/wiki/List_of_oil_refineries"
+    with open(FIXTURE_PATH, "rb") as fixture:
+        page_server["body"] = fixture.read()
+
+    refinery_data = get_refinery_data(url, cache_dir=str(tmp_path), consumer="test")
+    assert len(refinery_data) > 0
+    assert not is_page_processed(url, "test", refinery_data.attrs["content_hash"], str(tmp_path))
+
+    # Once marked, the unchanged page is skipped
+    mark_page_processed(url, "test", refinery_data.attrs["content_hash"], str(tmp_path))
+    assert get_refinery_data(url, cache_dir=str(tmp_path), consumer="test") is None
+
+    # A changed page is parsed again
+    page_server["body"] = page_server["body"].replace(b"Sines", b"Sinez")
+    assert get_refinery_data(url, cache_dir=str(tmp_path), consumer="test") is not None
+
+
+def test_offline(page_server, tmp_path):
+    url = page_server["url"] + "/wiki/List_of_oil_refineries"
+
+    # Nothing cached yet
+    with pytest.raises(Exception, match="Page not cached"):
+        fetch_page(url, str(tmp_path), offline=True)
+    assert page_server["requests"] == []
+
+    # Read from the cache without any request
+    fetch_page(url, str(tmp_path))
+    page = fetch_page(url, str(tmp_path), offline=True)
+    assert page["content"] == page_server["body"] and not page["changed"]
+    assert len(page_server["requests"]) == 1
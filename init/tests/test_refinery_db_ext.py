@@ -0,0 +1,169 @@
+# Tests of the extraction pipeline of format_refinery_table
+
+# Global imports
+import os
+import random
+import re
+
+import pandas as pd
+import pytest
+
+from utils.refinery_db_ext import REFINERY_PARSERS, get_refinery_data, format_refinery_table, parse_refinery_page, TONNES_INTO_BBLS, ROUND_DIGITS, BBLD_UNITS, TONNES_PER_YEAR_UNITS, TONNES_PER_DAY_UNITS, \
+    MILLION_TONNES_PER_YEAR_UNITS, extract_bbld, extract_bbld_series, extract_tonnes_to_bbld, extract_tonnes_to_bbld_series, \
+    checkstatus, checkstatus_series
+from benchmarks.bench_parser import FIXTURE_PATH
+from benchmarks.synthetic import make_raw_refinery_table
+
+
+# Output of the row wise format_refinery_table, frozen before the vectorized rewrite
+FROZEN_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+# Texts the random ones do not reach
+EDGE_CASES = [
+    "3\n650 million tonnes/year",
+    "3.650 million tonnes/year",
+    "Memphis\n180,000 bbl/d (29,000 m3/d)",
+    "12 bpd then 180,000 bbl/d",
+    "100,000 tonnes/day and 3,650,000 tonnes/year",
+    "mothballed\nto be reopened",
+    "",
+]
+
+
+# Reference implementations, one re.search per pattern as before the extraction was vectorized
+def reference_extract_bbld(text:str)->float:
+    for unit in BBLD_UNITS:
+        string_match = re.search(r'(\d{1,3}(?:,\d{3})*) ' + re.escape(unit), text)
+        if string_match:
+            return int(string_match.group(1).replace(",", "")) / 1000
+    return 0
+
+
+def reference_extract_tonnes_to_bbld(text:str)->float:
+    text = text.replace(".", ",")
+    for units, number, factor in [(TONNES_PER_YEAR_UNITS, r'(\d{1,3}(?:,\d{3})*)', TONNES_INTO_BBLS / (1000*365)),
+                                  (TONNES_PER_DAY_UNITS, r'(\d{1,3}(?:,\d{3})*)', TONNES_INTO_BBLS / 1000),
+                                  (MILLION_TONNES_PER_YEAR_UNITS, r'(\d{1,3}(?:.\d{3})*)', TONNES_INTO_BBLS * 1000000 / (1000*1000*365))]:
+        for unit in units:
+            string_match = re.search(number + ' ' + re.escape(unit), text)
+            if string_match:
+                return round(float(string_match.group(1).replace(",", "")) * factor, ROUND_DIGITS)
+    return 0
+
+
+def reference_checkstatus(text:str)->str:
+    lower = text.lower()
+    closed = any(lower.find(value) != -1 for value in ["mothballed", "closed", "biorefinery"])
+    return "closed" if closed and lower.find("to be") == -1 else "active"
+
+
+def make_texts(count:int, seed:int=0)->list:
+    '''
+    Title: make_texts
+    Description: This function draws raw texts mixing numbers, every unit, status keywords, separators and newlines.
+    Arguments:
+        count: The number of texts
+        seed: The seed of the random generator
+    Returns:
+        texts: The raw texts
+    '''
+    generator = random.Random(seed)
+    units = BBLD_UNITS + TONNES_PER_YEAR_UNITS + TONNES_PER_DAY_UNITS + MILLION_TONNES_PER_YEAR_UNITS
+    words = ["Refinery", "(closed in 2012)", "mothballed", "to be", "biorefinery", "\n", "m3/d", "[12]"]
+    separators = [",", ".", "\n", " "]
+
+    texts = []
+    for _ in range(count):
+        parts = []
+        for _ in range(generator.randint(1, 4)):
+            number = str(generator.randint(1, 999))
+            for _ in range(generator.randint(0, 2)):
+                number += generator.choice(separators) + f"{generator.randint(0, 999):03d}"
+            parts.append(f"{number} {generator.choice(units)}")
+            parts.append(generator.choice(words))
+        texts.append(" ".join(parts))
+    return EDGE_CASES + texts
+
+
+def outcome(function, text:str):
+    '''
+    Title: outcome
+    Description: This function returns the result of an extractor or the type of the error it raised.
+        The unescaped . of the million tonnes numbers lets some texts fail the conversion, in both implementations.
+    Arguments:
+        function: The extractor
+        text: The raw text
+    Returns:
+        outcome: The result or the exception type
+    '''
+    try:
+        return function(text)
+    except ValueError as e:
+        return type(e)
+
+
+def test_extractors_match_reference():
+    texts = make_texts(5000)
+
+    for text in texts:
+        assert outcome(extract_bbld, text) == outcome(reference_extract_bbld, text), text
+        assert outcome(extract_tonnes_to_bbld, text) == outcome(reference_extract_tonnes_to_bbld, text), text
+        assert checkstatus(text) == reference_checkstatus(text), text
+
+
+def test_series_extractors_match_reference():
+    texts = [text for text in make_texts(5000, seed=1) if outcome(reference_extract_tonnes_to_bbld, text) is not ValueError]
+    raw = pd.Series(texts)
+
+    assert extract_bbld_series(raw).tolist() == [reference_extract_bbld(text) for text in texts]
+    assert extract_tonnes_to_bbld_series(raw).tolist() == [reference_extract_tonnes_to_bbld(text) for text in texts]
+    assert checkstatus_series(raw).tolist() == [reference_checkstatus(text) for text in texts]
+
+
+def test_million_tonnes_separator_does_not_cross_lines():
+    assert extract_tonnes_to_bbld("3\n650 million tonnes/year") == 13.1
+    assert extract_tonnes_to_bbld_series(pd.Series(["3\n650 million tonnes/year"])).tolist() == [13.1]
+
+
+def read_frozen_table(name:str)->pd.DataFrame:
+    return pd.read_csv(os.path.join(FROZEN_DIR, name), dtype={"capacity": float}, keep_default_na=False, float_precision="round_trip")
+
+
+def fixture_page_rows()->pd.DataFrame:
+    with open(FIXTURE_PATH, "rb") as fixture:
+        return pd.DataFrame(parse_refinery_page(fixture.read(), "html.parser"), columns=["Region", "Country", "Raw"])
+
+
+@pytest.mark.parametrize("raw, frozen", [
+    (fixture_page_rows, "format_refinery_table_page.csv"),
+    (lambda: make_raw_refinery_table(2000, seed=0), "format_refinery_table_synthetic.csv")
+], ids=["page", "synthetic"])
+def test_format_refinery_table_matches_frozen_output(raw, frozen):
+    table = format_refinery_table(raw())
+
+    # Same columns, types, rows and order
+    assert table.dtypes.to_dict() == {"region": object, "country": object, "refinery": object, "capacity": float, "unit": object, "status": object}
+    pd.testing.assert_frame_equal(table.reset_index(drop=True), read_frozen_table(frozen), check_exact=True)
+
+
+def test_parsers_give_the_same_rows():
+    with open(FIXTURE_PATH, "rb") as fixture:
+        content = fixture.read()
+
+    rows = {parser: parse_refinery_page(content, parser) for parser in REFINERY_PARSERS}
+    assert rows["lxml"] == rows["html.parser"]
+
+    # The headers of the page keep their [edit] link, removed by format_refinery_table
+    assert any(country.endswith("[edit]") for _, country, _ in rows["lxml"])
+
+
+def test_parsers_give_the_same_table(page_server):
+    with open(FIXTURE_PATH, "rb") as fixture:
+        page_server["body"] = fixture.read()
+
+    tables = {parser: get_refinery_data(url=page_server["url"] + "/wiki/List_of_oil_refineries", parser=parser) for parser in REFINERY_PARSERS}
+
+    pd.testing.assert_frame_equal(tables["lxml"], tables["html.parser"], check_exact=True)
+    assert tables["lxml"].attrs == tables["html.parser"].attrs
+    assert not tables["lxml"]["country"].str.contains("edit").any()
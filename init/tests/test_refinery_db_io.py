@@ -0,0 +1,172 @@
+# Tests of the bulk load of the refinery table
+
+# Global imports
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import pandas as pd
+from sqlalchemy import text, select, delete, insert
+from sqlalchemy.orm import sessionmaker
+
+from utils.refinery_db_io import Refinery, RefineryVersion, RefinerySummary, copy_from_stdin, format_copy_value, get_chunk_size, get_insert_method, insert_table_into_db, \
+    get_db_engine, create_refinery_db, get_table_version, bump_table_version, sync_table_into_db, sync_id_sequence, \
+    update_refinery_summary
+from benchmarks.synthetic import make_refinery_table
+
+
+# Constants
+ROWS = 500
+
+NEW_REFINERY = {"region": "Europe", "country": "France", "refinery": "Concurrent Refinery", "capacity": 100.0, "unit": "kbd", "status": "active"}
+
+
+def test_copy_fields_tell_empty_strings_from_nulls():
+    assert format_copy_value(None) == "" and format_copy_value(float("nan")) == ""
+    assert format_copy_value("") == '""'
+    assert format_copy_value('12" pipe') == '"12"" pipe"'
+    assert format_copy_value(1.5) == '"1.5"'
+
+
+def test_chunk_size_from_environment(monkeypatch):
+    monkeypatch.delenv("REFINERY_CHUNK_SIZE", raising=False)
+    assert get_chunk_size() == 50000
+
+    monkeypatch.setenv("REFINERY_CHUNK_SIZE", "1000")
+    assert get_chunk_size() == 1000
+
+
+def test_copy_keeps_empty_strings_and_nulls(postgres_engine):
+    refinery_data = pd.DataFrame({
+        "region": ["Asia", "Asia", "Europe"],
+        "country": ["Japan", "", None],
+        "refinery": ['Chiba "East"', "Mizushima", "Gonfreville, Total"],
+        "capacity": [190.0, None, 247.0],
+        "unit": ["bbl/d", "bbl/d", ""],
+        "status": ["active", None, "closed"]
+    })
+
+    assert get_insert_method(postgres_engine, "copy") is copy_from_stdin
+    try:
+        insert_table_into_db(postgres_engine, refinery_table_name="refinery_copy_test", refinery_data=refinery_data, method="copy", chunksize=2)
+        with postgres_engine.connect() as conn:
+            rows = conn.execute(text("SELECT country, refinery, capacity, unit, status FROM refinery_copy_test ORDER BY refinery_id")).all()
+    finally:
+        with postgres_engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS refinery_copy_test"))
+
+    assert [tuple(row) for row in rows] == [
+        ("Japan", 'Chiba "East"', 190.0, "bbl/d", "active"),
+        ("", "Mizushima", None, "bbl/d", None),
+        (None, "Gonfreville, Total", 247.0, "", "closed")
+    ]
+
+
+def test_bump_table_version_without_row(tmp_path):
+    engine = get_db_engine(f"sqlite:///{tmp_path / 'refinery.db'}")
+    create_refinery_db(engine)
+    with engine.begin() as conn:
+        conn.execute(delete(RefineryVersion))
+
+    # Connections and sessions
+    with engine.begin() as conn:
+        bump_table_version(conn)
+    with sessionmaker(bind=engine).begin() as session:
+        bump_table_version(session)
+
+    with engine.connect() as conn:
+        assert get_table_version(conn) == 2
+    engine.dispose()
+
+
+def test_concurrent_first_bumps(postgres_engine):
+    create_refinery_db(postgres_engine)
+    with postgres_engine.begin() as conn:
+        conn.execute(delete(RefineryVersion))
+
+    # Every thread bumps the missing row at once
+    writers = 8
+    barrier = threading.Barrier(writers)
+
+    def write():
+        with postgres_engine.begin() as conn:
+            barrier.wait()
+            bump_table_version(conn)
+
+    with ThreadPoolExecutor(writers) as executor:
+        list(executor.map(lambda _: write(), range(writers)))
+
+    with postgres_engine.connect() as conn:
+        assert get_table_version(conn) == writers
+
+
+def test_concurrent_inserts_take_the_next_ids(postgres_engine):
+    # Table loaded with explicit ids, then the sequence moved past them
+    create_refinery_db(postgres_engine)
+    sync_table_into_db(postgres_engine, refinery_data=make_refinery_table(ROWS))
+    with postgres_engine.begin() as conn:
+        conn.execute(insert(Refinery).values(refinery_id=ROWS + 100, **NEW_REFINERY))
+    sync_id_sequence(postgres_engine)
+
+    # Inserts of the addrefinery route from several threads at once
+    Session = sessionmaker(bind=postgres_engine)
+    threads, inserts = 8, 25
+
+    def write(_):
+        ids = []
+        for _ in range(inserts):
+            with Session() as session:
+                refinery = Refinery(**NEW_REFINERY)
+                session.add(refinery)
+                session.commit()
+                ids.append(refinery.refinery_id)
+        return ids
+
+    with ThreadPoolExecutor(threads) as executor:
+        ids = [refinery_id for ids in executor.map(write, range(threads)) for refinery_id in ids]
+
+    # No conflict, every insert took the next free id
+    assert sorted(ids) == list(range(ROWS + 101, ROWS + 101 + threads * inserts))
+    with postgres_engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) = COUNT(DISTINCT refinery_id) FROM refinery")).scalar()
+
+
+def test_first_refinery_of_a_group_twice(tmp_path):
+    engine = get_db_engine(f"sqlite:///{tmp_path / 'refinery.db'}")
+    create_refinery_db(engine)
+
+    # Both writes find no row of the group
+    with engine.begin() as conn:
+        update_refinery_summary(conn, "Europe", "Iceland", "active", 1, 10.0)
+    with sessionmaker(bind=engine).begin() as session:
+        update_refinery_summary(session, "Europe", "Iceland", "active", 1, 15.0)
+
+    group = select(RefinerySummary.refinery_count, RefinerySummary.total_capacity).where(RefinerySummary.country == "Iceland")
+    with engine.connect() as conn:
+        assert tuple(conn.execute(group).one()) == (2, 25.0)
+
+    # The last refinery removes the group
+    with engine.begin() as conn:
+        update_refinery_summary(conn, "Europe", "Iceland", "active", -2, -25.0)
+    with engine.connect() as conn:
+        assert conn.execute(group).first() is None
+    engine.dispose()
+
+
+def test_concurrent_first_refineries_of_a_group(postgres_engine):
+    create_refinery_db(postgres_engine)
+
+    # Every thread adds the first refinery of the same new group at once
+    writers = 8
+    barrier = threading.Barrier(writers)
+
+    def write():
+        with postgres_engine.begin() as conn:
+            barrier.wait()
+            update_refinery_summary(conn, "Europe", "Iceland", "active", 1, 10.0)
+
+    with ThreadPoolExecutor(writers) as executor:
+        list(executor.map(lambda _: write(), range(writers)))
+
+    with postgres_engine.connect() as conn:
+        count, capacity = conn.execute(text("SELECT refinery_count, total_capacity FROM refinery_summary WHERE country = 'Iceland'")).one()
+    assert (count, capacity) == (writers, writers * 10.0)
@@ -0,0 +1,123 @@
+# Tests of the enrichment crawler, against a local stand-in of Wikipedia
+
+# Global imports
+import pytest
+
+from utils.refinery_db_ext import get_refinery_data
+from utils.refinery_enrich import get_refinery_links, get_country_links, enrich_refinery_data
+
+
+# Constants
+LIST_PATH = "/wiki/List_of_oil_refineries"
+
+LIST_PAGE = """<!DOCTYPE html>
+<html lang="en"><head><meta charset="UTF-8"><title>List of oil refineries - Wikipedia</title></head>
+<body>
+<h2><span class="mw-headline" id="Africa">Africa</span></h2>
+<h3><span class="mw-headline" id="Algeria">Algeria</span></h3>
+<div role="note" class="hatnote navigation-not-searchable">Main article: <a href="/wiki/Oil_refineries_in_Algeria">Oil refineries in Algeria</a></div>
+<ul>
+<li><a href="/wiki/Skikda_Refinery" title="Skikda Refinery">Skikda Refinery</a> (<a href="/wiki/Sonatrach">Sonatrach</a>), 300,000&#160;bbl/d</li>
+<li>Arzew Refinery (<a href="/wiki/Sonatrach">Sonatrach</a>), 80,000&#160;bbl/d</li>
+<li><a href="/wiki/Missing_Refinery" title="Missing Refinery">Missing Refinery</a>, 50,000&#160;bbl/d</li>
+<li><a href="/wiki/Flaky_Refinery" title="Flaky Refinery">Flaky Refinery</a>, </li>
+</ul>
+<h2><span class="mw-headline" id="See_also">See also</span></h2>
+</body></html>""".encode()
+
+COUNTRY_ARTICLE = """<!DOCTYPE html>
+<html lang="en"><head><title>Oil refineries in Algeria - Wikipedia</title></head>
+<body><ul><li><a href="/wiki/Arzew_Refinery" title="Arzew Refinery">Arzew Refinery</a>, Oran</li></ul></body></html>""".encode()
+
+ARTICLE_TEMPLATE = """<!DOCTYPE html>
+<html lang="en"><head><title>{name} - Wikipedia</title></head>
+<body><span id="coordinates"><span class="geo">{latitude}; {longitude}</span></span>
+<table class="infobox vcard"><tbody>
+<tr><th scope="row" class="infobox-label">Operator</th><td class="infobox-data"><a href="/wiki/{operator}">{operator}</a><sup class="reference"><a href="#cite_note-1">[1]</a></sup></td></tr>
+<tr><th scope="row" class="infobox-label">Capacity</th><td class="infobox-data">{capacity:,}&#160;bbl/d</td></tr>
+</tbody></table></body></html>"""
+
+# Infobox of every refinery with an article, as operator, latitude, longitude and capacity in bbl/d
+ARTICLES = {
+    "/wiki/Skikda_Refinery": ("Sonatrach", 36.88, 6.95, 323000),
+    "/wiki/Arzew_Refinery": ("Naftec", 35.82, -0.27, 81000),
+    "/wiki/Flaky_Refinery": ("Flaky Oil", 30.5, 2.5, 120000)
+}
+
+
+def article(path:str)->bytes:
+    operator, latitude, longitude, capacity = ARTICLES[path]
+    return ARTICLE_TEMPLATE.format(name=path, operator=operator, latitude=latitude, longitude=longitude, capacity=capacity).encode()
+
+
+@pytest.fixture
+def wikipedia(page_server, tmp_path):
+    page_server["body"] = LIST_PAGE
+    page_server["answers"].update({path: (200, article(path)) for path in ARTICLES})
+    page_server["answers"]["/wiki/Oil_refineries_in_Algeria"] = (200, COUNTRY_ARTICLE)
+    page_server["answers"]["/wiki/Missing_Refinery"] = (404, b"Not found")
+
+    # Scrape the list page of the stand-in through a temporary cache
+    url = page_server["url"] + LIST_PATH
+    page_server["refinery_data"] = get_refinery_data(url=url, cache_dir=str(tmp_path))
+    page_server["links"] = get_refinery_links(url, str(tmp_path))
+    page_server["country_links"] = get_country_links(url, str(tmp_path))
+    return page_server
+
+
+def enrich(wikipedia, **arguments):
+    arguments = {"workers": 4, "host_rate": 0, "retries": 2, "backoff": 0.01, "country_links": wikipedia["country_links"], **arguments}
+    enriched = enrich_refinery_data(wikipedia["refinery_data"], wikipedia["links"], **arguments)
+
+    # The names keep the space before the operator
+    return enriched.set_index(enriched["refinery"].str.strip())
+
+
+def test_infobox_merged_into_its_row(wikipedia):
+    enriched = enrich(wikipedia)
+
+    skikda = enriched.loc["Skikda Refinery"]
+    assert (skikda["operator"], skikda["latitude"], skikda["longitude"], skikda["infobox_capacity"]) == ("Sonatrach", 36.88, 6.95, 323.0)
+
+    # The list capacity is kept, the infobox one only fills the missing ones
+    assert skikda["capacity"] == 300.0
+    assert enriched.loc["Flaky Refinery", "capacity"] == 120.0
+
+
+def test_refinery_without_link_found_in_its_country_article(wikipedia):
+    assert wikipedia["country_links"] == {"algeria": wikipedia["url"] + "/wiki/Oil_refineries_in_Algeria"}
+
+    arzew = enrich(wikipedia).loc["Arzew Refinery"]
+    assert (arzew["operator"], arzew["infobox_capacity"]) == ("Naftec", 81.0)
+
+    # Without the country articles the refinery has no article
+    assert enrich(wikipedia, country_links=None).loc["Arzew Refinery", "operator"] is None
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_unavailable_article_retried(wikipedia, status):
+    wikipedia["answers"]["/wiki/Flaky_Refinery"] = [(status, b"Try again"), (status, b"Try again"), (200, article("/wiki/Flaky_Refinery"))]
+
+    assert enrich(wikipedia).loc["Flaky Refinery", "operator"] == "Flaky Oil"
+    assert [path for path, _ in wikipedia["requests"]].count("/wiki/Flaky_Refinery") == 3
+
+
+def test_missing_article_left_empty(wikipedia):
+    missing = enrich(wikipedia).loc["Missing Refinery"]
+
+    assert missing["operator"] is None and missing[["latitude", "longitude", "infobox_capacity"]].isna().all()
+    assert missing["capacity"] == 50.0
+
+    # A 404 is not retried
+    assert [path for path, _ in wikipedia["requests"]].count("/wiki/Missing_Refinery") == 1
+
+
+def test_host_rate_respected(wikipedia):
+    host_rate = 20.0
+    start = len(wikipedia["requests"])
+    enrich(wikipedia, workers=8, host_rate=host_rate)
+
+    # The list page was fetched before, the country article and the four refinery articles are spaced
+    times = sorted(wikipedia["times"][start:])
+    assert len(times) == 5
+    assert times[-1] - times[0] >= (len(times) - 1) / host_rate * 0.9
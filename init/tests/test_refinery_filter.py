@@ -0,0 +1,38 @@
+# Tests of the query plans of the filter route
+
+# Global imports
+import pytest
+from sqlalchemy import text
+
+from utils.refinery_api import filter_refinery_query
+from utils.refinery_db_io import Refinery, get_db_engine, create_refinery_db, insert_table_into_db, create_indexes, select_refineries
+from benchmarks.bench_filter import FILTERS, explain
+from benchmarks.synthetic import make_refinery_table
+
+
+# Constants
+ROWS = 5000
+
+INDEX_NAMES = {index.name for index in Refinery.__table__.indexes}
+
+
+@pytest.fixture(scope="module")
+def filter_engine(tmp_path_factory):
+    engine = get_db_engine(f"sqlite:///{tmp_path_factory.mktemp('filter') / 'refinery.db'}")
+
+    # Loaded the same way as generateDB
+    create_refinery_db(engine)
+    insert_table_into_db(engine, refinery_data=make_refinery_table(ROWS))
+    create_indexes(engine)
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+
+    yield engine
+    engine.dispose()
+
+
+@pytest.mark.parametrize("filters", FILTERS, ids=lambda filters: ",".join(filters))
+def test_filter_uses_an_index(filter_engine, filters):
+    plan = explain(filter_engine, filter_refinery_query(select_refineries(), **filters))
+
+    assert any(name in plan for name in INDEX_NAMES), plan
@@ -0,0 +1,61 @@
+# Tests of the request profiler with a profiler recording every thread, as from Python 3.12
+
+# Global imports
+import threading
+import time
+
+from utils.refinery_profiling import RequestProfiler
+
+
+def test_not_profiled_while_another_request_is_in_flight(tmp_path):
+    profiler = RequestProfiler(str(tmp_path), thread_wide=True)
+
+    other = profiler.start(False)
+    assert profiler.start(True) is None and profiler.skipped == 1
+    profiler.finish(None)
+    profiler.finish(other)
+
+    # Alone again
+    profile = profiler.start(True)
+    assert profile is not None
+    assert profiler.finish(profile) == str(tmp_path / profile[1])
+    assert profiler.in_flight == 0 and profiler.profiled == 1
+
+
+def test_requests_wait_for_the_profiled_one(tmp_path):
+    profiler = RequestProfiler(str(tmp_path), thread_wide=True)
+    profile = profiler.start(True)
+
+    started = threading.Event()
+
+    def request():
+        profiler.finish(profiler.start(False))
+        started.set()
+
+    thread = threading.Thread(target=request)
+    thread.start()
+
+    # The request arriving during the profile is held until it ends
+    assert not started.wait(0.2)
+    profiler.finish(profile)
+    assert started.wait(5)
+    thread.join()
+    assert profiler.in_flight == 0
+
+
+def test_concurrent_requests_without_thread_wide_profiler(tmp_path):
+    profiler = RequestProfiler(str(tmp_path), thread_wide=False)
+
+    other = profiler.start(False)
+    profile = profiler.start(True)
+    assert profile is not None
+
+    # A second profile is refused, the requests are not held
+    start = time.perf_counter()
+    assert profiler.start(True) is None
+    assert time.perf_counter() - start < 1
+    profiler.finish(None)
+
+    profiler.finish(profile)
+    profiler.finish(other)
+    assert profiler.in_flight == 0
@@ -0,0 +1,393 @@
+# Request handling shared by the Flask app and the async app
+
+# Global imports
+import csv
+import hashlib
+import io
+import json
+import math
+
+from utils.refinery_db_io import Refinery, REFINERY_STATUSES, REFINERY_GROUP_COLUMNS
+from utils.refinery_search import SEARCH_LIMIT, MAX_SEARCH_LIMIT, SEARCH_THRESHOLD
+from utils.refinery_suggest import SUGGEST_LIMIT, MAX_SUGGEST_LIMIT, SUGGEST_KINDS
+
+
+# Constants
+# Pagination
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Export
+EXPORT_BATCH_SIZE = 1000
+EXPORT_COLUMNS = ['index', 'region', 'country', 'refinery', 'capacity', 'unit', 'status']
+EXPORT_MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+# Bulk insert
+MAX_BULK_SIZE = 50000
+REFINERY_DEFAULTS = {'region': 'Unknown', 'country': 'Unknown', 'refinery': 'Unknown', 'capacity': 0, 'unit': 'kbd', 'status': 'closed'}
+
+# Filter result cache, emptied when a write commits
+FILTER_CACHE_SIZE = 256
+FILTER_CACHE_TTL = 60
+
+# Seconds a worker reuses the table version it read, the writes of the other workers are seen after at most this long
+TABLE_VERSION_TTL = 1
+
+# Clients and proxies may store the responses but must revalidate them
+READ_CACHE_CONTROL = 'no-cache'
+
+
+
+def get_page_parameters(query_parameters)->tuple:
+    '''
+    Title: get_page_parameters
+    Description: This function reads the limit and after pagination parameters, a request without them gets the first page of DEFAULT_PAGE_SIZE refineries
+    Args: query_parameters
+    Returns: The limit and the after cursor
+    '''
+    
+    # Get the parameters
+    limit = query_parameters.get('limit', None)
+    after = query_parameters.get('after', None)
+    
+    # Check the limit
+    try:
+        limit = int(limit) if limit is not None else DEFAULT_PAGE_SIZE
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    
+    # Check the cursor
+    try:
+        after = int(after) if after is not None else None
+    except ValueError:
+        raise ValueError("after must be a refinery id")
+    
+    return limit, after
+
+
+def get_search_parameters(query_parameters)->tuple:
+    '''
+    Title: get_search_parameters
+    Description: This function reads the q, limit and threshold parameters of the search route
+    Args: query_parameters
+    Returns: The searched text, the maximum number of results and the minimum similarity, raises ValueError if one is invalid
+    '''
+    
+    # Check the searched text
+    query = query_parameters.get('q', '').strip()
+    
+    if not query:
+        raise ValueError("q is required")
+    
+    # Check the limit
+    try:
+        limit = int(query_parameters.get('limit', SEARCH_LIMIT))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    
+    if limit < 1 or limit > MAX_SEARCH_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_SEARCH_LIMIT}")
+    
+    # Check the threshold
+    try:
+        threshold = float(query_parameters.get('threshold', SEARCH_THRESHOLD))
+    except ValueError:
+        raise ValueError("threshold must be a number")
+    
+    if not 0 <= threshold <= 1:
+        raise ValueError("threshold must be between 0 and 1")
+    
+    return query, limit, threshold
+
+
+def get_suggest_parameters(query_parameters)->tuple:
+    '''
+    Title: get_suggest_parameters
+    Description: This function reads the prefix, limit and kind parameters of the suggest route
+    Args: query_parameters
+    Returns: The typed prefix, the maximum number of suggestions and the suggested column, raises ValueError if one is invalid
+    '''
+    
+    # Check the prefix
+    prefix = query_parameters.get('prefix', '').strip()
+    
+    if not prefix:
+        raise ValueError("prefix is required")
+    
+    # Check the limit
+    try:
+        limit = int(query_parameters.get('limit', SUGGEST_LIMIT))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    
+    if limit < 1 or limit > MAX_SUGGEST_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_SUGGEST_LIMIT}")
+    
+    # Check the column, all of them by default
+    kind = query_parameters.get('kind', None)
+    
+    if kind is not None and kind not in SUGGEST_KINDS:
+        raise ValueError(f"kind must be one of {', '.join(SUGGEST_KINDS)}")
+    
+    return prefix, limit, kind
+
+
+def page_refinery_query(statement, limit:int, after:int):
+    '''
+    Title: page_refinery_query
+    Description: This function orders the statement by refinery_id and seeks past the cursor, with one more row than the page to know if there is a next page
+    Args: statement, limit, after
+    Returns: The statement of the page
+    '''
+    
+    # Seek past the cursor on the primary key
+    if after is not None:
+        statement = statement.where(Refinery.refinery_id > after)
+    
+    return statement.order_by(Refinery.refinery_id).limit(limit + 1)
+
+
+def split_page(data:list, limit:int)->tuple:
+    '''
+    Title: split_page
+    Description: This function splits the rows of page_refinery_query into the page and the cursor of the next page
+    Args: data, limit
+    Returns: The refineries of the page and the cursor of the next page, None on the last page
+    '''
+    
+    # Cursor of the next page
+    next_cursor = data[limit - 1]['index'] if len(data) > limit else None
+    
+    return data[:limit], next_cursor
+
+
+def get_filter_conditions(region:str=None, country:str=None, status:str=None)->list:
+    '''
+    Title: get_filter_conditions
+    Description: This function returns one predicate per given region, country and status
+    Args: region, country, status
+    Returns: The list of predicates
+    '''
+    
+    conditions = []
+    
+    # If region is not None
+    if region:
+        conditions.append(Refinery.region == region)
+    
+    # If country is not None
+    if country:
+        conditions.append(Refinery.country == country)
+    
+    # If status is not None
+    if status:
+        conditions.append(Refinery.status == status)
+    
+    return conditions
+
+
+def get_required_filter_conditions(query_parameters)->list:
+    '''
+    Title: get_required_filter_conditions
+    Description: This function returns the predicates of the region, country and status parameters of a bulk write
+    Args: query_parameters
+    Returns: The list of predicates, raises ValueError if no filter is given
+    '''
+    
+    conditions = get_filter_conditions(query_parameters.get('region', None), query_parameters.get('country', None), query_parameters.get('status', None))
+    
+    if not conditions:
+        raise ValueError("at least one of region, country and status is required")
+    
+    return conditions
+
+
+def filter_refinery_query(statement, region:str=None, country:str=None, status:str=None):
+    '''
+    Title: filter_refinery_query
+    Description: This function adds one predicate per given region, country and status
+    Args: statement, region, country, status
+    Returns: The filtered statement
+    '''
+    return statement.where(*get_filter_conditions(region, country, status))
+
+
+def get_filter_cache_key(region:str, country:str, status:str, limit:int, after:int)->tuple:
+    '''
+    Title: get_filter_cache_key
+    Description: This function normalizes the filter parameters into a cache key, missing and empty filters are the same query
+    Args: region, country, status, limit, after
+    Returns: The cache key
+    '''
+    return (region or None, country or None, status or None, limit, after)
+
+
+def get_etag(version:int, path:str, cache_key:tuple)->str:
+    '''
+    Title: get_etag
+    Description: This function derives the strong ETag of a read from the table version, the route and its parameters
+    Args: version, path, cache_key
+    Returns: The ETag
+    '''
+    return hashlib.sha1(f"{version}:{path}:{cache_key}".encode()).hexdigest()
+
+
+def get_group_by(query_parameters)->list:
+    '''
+    Title: get_group_by
+    Description: This function reads the grouping columns of the aggregate route
+    Args: query_parameters
+    Returns: The list of columns, raises ValueError if a column cannot be grouped by
+    '''
+    
+    group_by = [column for column in query_parameters.get('by', '').split(',') if column]
+    
+    if any(column not in REFINERY_GROUP_COLUMNS for column in group_by):
+        raise ValueError(f"by must be a comma separated list of {REFINERY_GROUP_COLUMNS}")
+    
+    return group_by
+
+
+def format_export_batch(batch:list, export_format:str)->str:
+    '''
+    Title: format_export_batch
+    Description: This function writes a batch of exported rows as NDJSON or CSV lines
+    Args: batch, export_format
+    Returns: The lines of the batch
+    '''
+    
+    buffer = io.StringIO()
+    
+    if export_format == 'csv':
+        csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS).writerows(batch)
+    else:
+        buffer.writelines(json.dumps(dict(row)) + "\n" for row in batch)
+    
+    return buffer.getvalue()
+
+
+def get_update_values(patch)->dict:
+    '''
+    Title: get_update_values
+    Description: This function reads the columns to update from a patch, empty values are left unchanged
+    Args: patch
+    Returns: The new values of the columns, raises ValueError if the patch is invalid or changes nothing
+    '''
+    
+    if not isinstance(patch, dict):
+        raise ValueError("body must be a json object")
+    
+    # Get the parameters
+    values = {column: patch[column] for column in REFINERY_DEFAULTS if patch.get(column, None)}
+    
+    if not values:
+        raise ValueError(f"body must set at least one of {list(REFINERY_DEFAULTS)}")
+    
+    # Check the new values
+    if 'capacity' in values:
+        try:
+            values['capacity'] = float(values['capacity'])
+        except (TypeError, ValueError):
+            raise ValueError("capacity must be a number")
+        
+        if not (math.isfinite(values['capacity']) and values['capacity'] >= 0):
+            raise ValueError("capacity must be a non negative number")
+    
+    if 'status' in values and values['status'] not in REFINERY_STATUSES:
+        raise ValueError(f"status must be one of {REFINERY_STATUSES}")
+    
+    return values
+
+
+def validate_refinery(refinery)->dict:
+    '''
+    Title: validate_refinery
+    Description: This function checks one refinery of a bulk insert and fills the missing keys with the defaults of addrefinery
+    Args: refinery
+    Returns: The refinery with every column, raises ValueError if it is invalid
+    '''
+    
+    if not isinstance(refinery, dict):
+        raise ValueError("refinery must be a json object")
+    
+    unknown = set(refinery) - set(REFINERY_DEFAULTS)
+    if unknown:
+        raise ValueError(f"unknown keys {sorted(unknown)}")
+    
+    refinery = {**REFINERY_DEFAULTS, **refinery}
+    
+    # Text columns
+    for column in ('region', 'country', 'refinery', 'unit'):
+        if not isinstance(refinery[column], str) or not refinery[column].strip():
+            raise ValueError(f"{column} must be a non empty string")
+    
+    # Capacity, numbers given as strings like addrefinery
+    try:
+        refinery['capacity'] = float(refinery['capacity'])
+    except (TypeError, ValueError):
+        raise ValueError("capacity must be a number")
+    
+    # Rejects NaN and infinity, which float reads from strings too
+    if not (math.isfinite(refinery['capacity']) and refinery['capacity'] >= 0):
+        raise ValueError("capacity must be a non negative number")
+    
+    if refinery['status'] not in REFINERY_STATUSES:
+        raise ValueError(f"status must be one of {REFINERY_STATUSES}")
+    
+    return refinery
+
+
+def parse_bulk_body(mimetype:str, data:bytes)->list:
+    '''
+    Title: parse_bulk_body
+    Description: This function reads the refineries of a bulk request, a json array or one json object per line with the NDJSON content type
+    Args: mimetype, data
+    Returns: A list of (refinery, error) pairs, the refinery is None if its line is not valid json. Raises ValueError if the body is not valid
+    '''
+    
+    # One refinery per line
+    if mimetype == EXPORT_MIMETYPES['ndjson']:
+        refineries = []
+        for line in data.decode().splitlines():
+            if not line.strip():
+                continue
+            try:
+                refineries.append((json.loads(line), None))
+            except ValueError as e:
+                refineries.append((None, f"invalid json: {e}"))
+        return refineries
+    
+    # Json array
+    try:
+        refineries = json.loads(data)
+    except ValueError:
+        refineries = None
+    
+    if not isinstance(refineries, list):
+        raise ValueError("body must be a json array or NDJSON")
+    
+    return [(refinery, None) for refinery in refineries]
+
+
+def check_refineries(refineries:list)->tuple:
+    '''
+    Title: check_refineries
+    Description: This function validates the refineries of a bulk request
+    Args: refineries, the (refinery, error) pairs of parse_bulk_body
+    Returns: The valid refineries, their positions in the body and the errors of the others
+    '''
+    
+    valid, positions, errors = [], [], []
+    for position, (refinery, error) in enumerate(refineries):
+        try:
+            if error is not None:
+                raise ValueError(error)
+            valid.append(validate_refinery(refinery))
+            positions.append(position)
+        except ValueError as e:
+            errors.append({"row": position, "error": str(e)})
+    
+    return valid, positions, errors
@@ -0,0 +1,224 @@
+# Global imports
+import requests
+import hashlib
+import json
+import os
+
+
+# Constants
+REFINERY_CACHE_DIR = os.environ.get("REFINERY_CACHE_DIR", "cache")
+
+REQUEST_TIMEOUT = 30
+
+# Shared session so the connection is reused between requests
+SESSION = requests.Session()
+
+
+# Import logging
+import logging
+
+# Set up logging
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+LOGGGER_FORMAT = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+LOGGER_STREAM_HANDLER = logging.StreamHandler()
+LOGGER_STREAM_HANDLER.setFormatter(LOGGGER_FORMAT)
+LOGGER.addHandler(LOGGER_STREAM_HANDLER)
+
+
+
+# Cache functions
+############################################################################################################
+
+
+# Get the cache paths
+def get_cache_paths(url:str, cache_dir:str=REFINERY_CACHE_DIR)->tuple:
+    '''
+    Title: get_cache_paths
+    Description: This function returns the paths of the cached page and of its metadata.
+    Arguments:
+        url: URL of the page
+        cache_dir: The cache directory
+    Returns:
+        paths: The path of the page and the path of the metadata
+    '''
+
+    # One entry per URL
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    return os.path.join(cache_dir, f"{key}.html"), os.path.join(cache_dir, f"{key}.json")
+
+
+# Read the cache
+def read_cache(url:str, cache_dir:str=REFINERY_CACHE_DIR)->tuple:
+    '''
+    Title: read_cache
+    Description: This function reads the cached page and its metadata.
+    Arguments:
+        url: URL of the page
+        cache_dir: The cache directory
+    Returns:
+        cache: The content and the metadata of the page, (None, {}) if the page is not cached
+    '''
+
+    page_path, metadata_path = get_cache_paths(url, cache_dir)
+
+    # Nothing cached yet
+    if not os.path.exists(page_path) or not os.path.exists(metadata_path):
+        return None, {}
+
+    with open(page_path, "rb") as page_file:
+        content = page_file.read()
+
+    with open(metadata_path, "r") as metadata_file:
+        metadata = json.load(metadata_file)
+
+    return content, metadata
+
+
+# Write a file in one step
+def write_file(path:str, data:bytes)->None:
+    '''
+    Title: write_file
+    Description: This function writes to a temporary file then renames it, so readers never see a partial file.
+    Arguments:
+        path: The path of the file
+        data: The bytes to write
+    Returns:
+        None
+    '''
+    temporary_path = f"{path}.tmp"
+
+    with open(temporary_path, "wb") as temporary_file:
+        temporary_file.write(data)
+
+    os.replace(temporary_path, path)
+
+
+# Write the cache
+def write_cache(url:str, content:bytes, metadata:dict, cache_dir:str=REFINERY_CACHE_DIR)->None:
+    '''
+    Title: write_cache
+    Description: This function writes the page and its metadata to the cache.
+    Arguments:
+        url: URL of the page
+        content: The content of the page, None to only update the metadata
+        metadata: The metadata of the page
+        cache_dir: The cache directory
+    Returns:
+        None
+    '''
+
+    os.makedirs(cache_dir, exist_ok=True)
+
+    page_path, metadata_path = get_cache_paths(url, cache_dir)
+
+    # Write the page before the metadata that describes it
+    if content is not None:
+        write_file(page_path, content)
+
+    write_file(metadata_path, json.dumps(metadata, indent=4).encode("utf-8"))
+
+
+# Fetch a page through the cache
+def fetch_page(url:str, cache_dir:str=REFINERY_CACHE_DIR, offline:bool=False, session:requests.Session=SESSION)->dict:
+    '''
+    Title: fetch_page
+    Description: This function gets a page through the on disk cache.
+        The ETag and Last-Modified headers of the cached copy are sent back, so an unchanged page is answered with a 304.
+        In offline mode the cached copy is returned without any request.
+    Arguments:
+        url: URL of the page
+        cache_dir: The cache directory
+        offline: Whether to only read from the cache
+        session: The session used to send the request
+    Returns:
+        page: A dictionary with the content, its sha256 content_hash and whether it changed since the cached copy
+    '''
+
+    # Read the cached copy
+    cached_content, metadata = read_cache(url, cache_dir)
+
+    # Offline mode
+    if offline:
+        if cached_content is None:
+            LOGGER.error(f"Page not cached: {url}")
+            raise Exception(f"Page not cached: {url}")
+
+        LOGGER.info(f"Reading {url} from the cache")
+        return {"content": cached_content, "content_hash": metadata["content_hash"], "changed": False}
+
+    # Conditional request headers
+    headers = {}
+    if cached_content is not None:
+        if metadata.get("etag"):
+            headers["If-None-Match"] = metadata["etag"]
+        if metadata.get("last_modified"):
+            headers["If-Modified-Since"] = metadata["last_modified"]
+
+    # Send a GET request to the URL
+    response = session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+
+    # The cached copy is still valid
+    if response.status_code == 304 and cached_content is not None:
+        LOGGER.info(f"{url} not modified")
+        return {"content": cached_content, "content_hash": metadata["content_hash"], "changed": False}
+
+    # Check if the request was successful
+    if response.status_code != 200:
+        LOGGER.error(f"Failed to get data from URL: {url}")
+        raise Exception(f"Failed to get data from URL: {url}")
+
+    content_hash = hashlib.sha256(response.content).hexdigest()
+    changed = content_hash != metadata.get("content_hash")
+
+    # Update the cache, the page is only rewritten when it changed
+    metadata.update({
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "content_hash": content_hash
+    })
+    write_cache(url, response.content if changed else None, metadata, cache_dir)
+
+    LOGGER.info(f"{url} {'changed' if changed else 'unchanged'}")
+    return {"content": response.content, "content_hash": content_hash, "changed": changed}
+
+
+# Check if a page was processed
+def is_page_processed(url:str, consumer:str, content_hash:str, cache_dir:str=REFINERY_CACHE_DIR)->bool:
+    '''
+    Title: is_page_processed
+    Description: This function checks if the given consumer already processed this version of the page.
+    Arguments:
+        url: URL of the page
+        consumer: The name of the consumer i.e generateDB
+        content_hash: The content hash of the page
+        cache_dir: The cache directory
+    Returns:
+        processed: Whether the consumer marked this content hash as processed
+    '''
+    _, metadata = read_cache(url, cache_dir)
+
+    return metadata.get("processed", {}).get(consumer) == content_hash
+
+
+# Mark a page as processed
+def mark_page_processed(url:str, consumer:str, content_hash:str, cache_dir:str=REFINERY_CACHE_DIR)->None:
+    '''
+    Title: mark_page_processed
+    Description: This function records that the given consumer processed this version of the page.
+        It is meant to be called once the consumer succeeded, so a failed run is retried on the next one.
+    Arguments:
+        url: URL of the page
+        consumer: The name of the consumer i.e generateDB
+        content_hash: The content hash of the page
+        cache_dir: The cache directory
+    Returns:
+        None
+    '''
+    _, metadata = read_cache(url, cache_dir)
+
+    metadata.setdefault("processed", {})[consumer] = content_hash
+
+    write_cache(url, None, metadata, cache_dir)
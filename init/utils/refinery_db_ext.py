@@ -1,9 +1,15 @@
 # Global imports
-import requests 
 import bs4
+import hashlib
+import io
+from lxml import etree
 import pandas as pd
+import numpy as np
 import re
 
+# Import the page cache
+from utils.refinery_db_cache import SESSION, REQUEST_TIMEOUT, REFINERY_CACHE_DIR, fetch_page, is_page_processed
+
 
 # Constants
 REFINERY_LINK = "https://en.wikipedia.org/wiki/List_of_oil_refineries"
@@ -11,6 +17,42 @@ REFINERY_LINK = "https://en.wikipedia.org/wiki/List_of_oil_refineries"
 TONNES_INTO_BBLS = 7.36
 ROUND_DIGITS = 1
 
+# Number in front of a unit i.e 180,000
+NUMBER_PATTERN = r'(\d{1,3}(?:,\d{3})*)'
+
+# Number in front of a million tonnes unit, the separator can be any character i.e 3,65
+MILLION_NUMBER_PATTERN = r'(\d{1,3}(?:.\d{3})*)'
+
+# Units in order of priority
+BBLD_UNITS = ['bbl/d', 'bbl/day', 'bp/d', 'bpd', 'barrels/day', 'barrels per day']
+
+TONNES_PER_YEAR_UNITS = ['ton/annum', 'tonnes/annum', 'tonnes/year']
+
+TONNES_PER_DAY_UNITS = ['ton/day', 'tonnes/day', 'tonnes/d']
+
+MILLION_TONNES_PER_YEAR_UNITS = ['million tonne/year',
+                                 'million tonnes/year',
+                                 'million tonne/annum',
+                                 'million tonnes/annum',
+                                 'million tonne per year',
+                                 'million tonnes per year']
+
+# Status keywords
+CLOSED_KEYWORDS = ["mothballed", "closed", "biorefinery"]
+PLANNED_KEYWORD = "to be"
+
+# Non ASCII characters
+NON_ASCII_PATTERN = re.compile(r'[^\x00-\x7F]+')
+
+# Default parser backend, see REFINERY_PARSERS
+REFINERY_PARSER = "lxml"
+
+# Tags extracted from the page
+EXTRACTED_TAGS = ("h2", "h3", "li")
+
+# Tags whose text BeautifulSoup leaves out of .text
+IGNORED_TEXT_TAGS = ("style", "script", "template", "rt", "rp")
+
 
 # Import logging
 import logging
@@ -25,75 +67,282 @@ LOGGER.addHandler(LOGGER_STREAM_HANDLER)
 
 
 
+# Build a priority pattern
+def build_priority_pattern(patterns:list)->re.Pattern:
+    '''
+    Title: build_priority_pattern
+    Description: This function combines the given patterns into one precompiled alternation.
+        Every alternative is prefixed with a lazy .*? and anchored at the start, so the first pattern
+        of the list found anywhere in the text wins, the same as calling re.search on each pattern in turn.
+        Only the prefix crosses newlines, the flags of the given patterns are left as they are.
+    Arguments:
+        patterns: The patterns in order of priority, each with one capturing group
+    Returns:
+        pattern: The compiled pattern with one group per given pattern
+    '''
+    return re.compile(r'^(?:' + '|'.join(f'(?s:.*?){pattern}' for pattern in patterns) + ')')
+
+
+# Compiled capacity patterns
+BBLD_PATTERN = build_priority_pattern([f'{NUMBER_PATTERN} {re.escape(unit)}' for unit in BBLD_UNITS])
+
+TONNES_PATTERN = build_priority_pattern([f'{NUMBER_PATTERN} {re.escape(unit)}' for unit in TONNES_PER_YEAR_UNITS] +
+                                        [f'{NUMBER_PATTERN} {re.escape(unit)}' for unit in TONNES_PER_DAY_UNITS] +
+                                        [f'{MILLION_NUMBER_PATTERN} {re.escape(unit)}' for unit in MILLION_TONNES_PER_YEAR_UNITS])
+
+# Any of the units, used to skip the rows without a capacity
+BBLD_KEYWORD_PATTERN = re.compile('|'.join(re.escape(unit) for unit in BBLD_UNITS))
+
+TONNES_KEYWORD_PATTERN = re.compile('|'.join(re.escape(unit) for unit in TONNES_PER_YEAR_UNITS + TONNES_PER_DAY_UNITS + MILLION_TONNES_PER_YEAR_UNITS))
+
+CLOSED_PATTERN = re.compile('|'.join(re.escape(value) for value in CLOSED_KEYWORDS))
+
+
+
 # Data Manipulation functions
 ############################################################################################################
 
 
 # Get refinery data
-def get_refinery_data(url=REFINERY_LINK):
+def get_refinery_data(url=REFINERY_LINK, parser:str=REFINERY_PARSER, cache_dir:str=None, offline:bool=False, consumer:str=None):
     '''
     Title: get_refinery_data
     Description: This function scrapes the refinery data from the given URL.
     Arguments:
         url: URL of the website to scrape the data from
+        parser: The parser backend to use, one of REFINERY_PARSERS
+        cache_dir: The cache directory, None to download the page without caching it
+        offline: Whether to only read the page from the cache
+        consumer: The name of the caller, if it already processed this version of the page nothing is parsed
+    Returns:
+        refinery_data: A pandas DataFrame containing the refinery data, with the content hash of the page in refinery_data.attrs["content_hash"]
+            None if the consumer already processed this version of the page
+    '''
+    
+    # Get the page through the cache
+    if cache_dir is not None or offline:
+        cache_dir = cache_dir or REFINERY_CACHE_DIR
+        page = fetch_page(url, cache_dir, offline)
+        
+        # Skip the parse if the page was already processed
+        if consumer and is_page_processed(url, consumer, page["content_hash"], cache_dir):
+            LOGGER.info(f"{consumer} already processed {url}, skipping")
+            return None
+        
+        content, content_hash = page["content"], page["content_hash"]
+    else:
+        # Send a GET request to the URL
+        response = SESSION.get(url, timeout=REQUEST_TIMEOUT)
+        
+        # Check if the request was not successful
+        if response.status_code != 200:
+            # If the request was not successful, print an error message
+            LOGGER.error(f"Failed to get data from URL: {url}")
+            raise Exception(f"Failed to get data from URL: {url}")
+        
+        content, content_hash = response.content, hashlib.sha256(response.content).hexdigest()
+    
+    # Parse the HTML content of the page
+    data = parse_refinery_page(content, parser)
+    
+    # Return the data as a pandas DataFrame
+    refinery_data = format_refinery_table(pd.DataFrame(data, columns=["Region", "Country", "Raw"]))
+    refinery_data.attrs["content_hash"] = content_hash
+    
+    return refinery_data
+
+
+# Parse the refinery page
+def parse_refinery_page(content:bytes, parser:str=REFINERY_PARSER)->list:
+    '''
+    Title: parse_refinery_page
+    Description: This function extracts the refinery rows from the HTML content of the refinery page.
+    Arguments:
+        content: The HTML content of the page
+        parser: The parser backend to use, one of REFINERY_PARSERS
     Returns:
-        refinery_data: A pandas DataFrame containing the refinery data
+        data: A list of [region, country, raw] rows
     '''
     
-    # Send a GET request to the URL
-    response = requests.get(url)
+    # Check the parser exists
+    if parser not in REFINERY_PARSERS:
+        LOGGER.error(f"Unknown parser: {parser}")
+        raise ValueError(f"Unknown parser: {parser}, expected one of {list(REFINERY_PARSERS)}")
+    
+    return REFINERY_PARSERS[parser](content)
+
+
+# Parse the refinery page with BeautifulSoup
+def parse_refinery_page_soup(content:bytes)->list:
+    '''
+    Title: parse_refinery_page_soup
+    Description: This function builds the full html.parser tree of the page and walks every element.
+    Arguments:
+        content: The HTML content of the page
+    Returns:
+        data: A list of [region, country, raw] rows
+    '''
     
-    # Check if the request was successful
-    if response.status_code == 200:
-        # Parse the HTML content of the page
-        soup = bs4.BeautifulSoup(response.content, 'html.parser')
+    # Parse the HTML content of the page
+    soup = bs4.BeautifulSoup(content, 'html.parser')
+   
+    # Extraction flag
+    extraction_flag = False
+    
+    # region_level_header
+    region_level_header = ''
+    # Country level header
+    country_level_header = ''
+    # Extracted data
+    data = []
+    
+    # Iterate through the siblings of the european header
+    for element in soup.find_all():
+        # Country header
+        if element.name == "h2":
+            if element.text.lower().find("africa") != -1:
+                extraction_flag = True
+       
+       # Goes through the HTML page until it finds the Africa Header then starts extracting
        
-        # Extraction flag
-        extraction_flag = False
-        
-        # region_level_header
-        region_level_header = ''
-        # Country level header
-        country_level_header = ''
-        # Extracted data
-        data = []
         
-        # Iterate through the siblings of the european header
-        for element in soup.find_all():
-            # Country header
+        # If the extraction flag is set to True, extract the data
+        if extraction_flag:
+            
+            # Check if the element is header
             if element.name == "h2":
-                if element.text.lower().find("africa") != -1:
-                    extraction_flag = True
-           
-           # Goes through the HTML page until it finds the Africa Header then starts extracting
-           
+                region_level_header = element.text
+                
+            # Check if the element is header
+            if element.name == "h3":
+                country_level_header = element.text
+                
+            # Check if it is a li
+            if element.name == "li":
+                data.append([region_level_header, country_level_header, element.text])
+        
+        # Stops at the se also page
+        # If see also is found, break the loop
+        if element.name == "h2" and element.text.lower().find("see also") != -1:
+            break
+    
+    return data
+
+
+# Parse the refinery page with a streaming lxml walk
+def parse_refinery_page_lxml(content:bytes)->list:
+    '''
+    Title: parse_refinery_page_lxml
+    Description: This function walks the h2, h3 and li events of the page with lxml and stops at the See also header.
+        Elements outside of a header or a li are dropped as soon as they are closed, so the tree is never fully built.
+        On a well formed page such as the Wikipedia one, the rows are the same as the ones of parse_refinery_page_soup.
+    Arguments:
+        content: The HTML content of the page
+    Returns:
+        data: A list of [region, country, raw] rows
+    '''
+    
+    # Extraction flag
+    extraction_flag = False
+    
+    # region_level_header
+    region_level_header = ''
+    # Country level header
+    country_level_header = ''
+    # Extracted data
+    data = []
+    
+    # Rows of the open li, the text is only complete once the li is closed
+    open_rows = []
+    
+    # Number of open headers and li
+    open_elements = 0
+    
+    for event, element in etree.iterparse(io.BytesIO(content), events=("start", "end"), html=True):
+        
+        # Keep the document order of the rows, nested li come after their parent
+        if event == "start":
+            if element.tag in EXTRACTED_TAGS:
+                open_elements += 1
+            if element.tag == "li":
+                row = [region_level_header, country_level_header, None] if extraction_flag else None
+                if row:
+                    data.append(row)
+                open_rows.append(row)
+            continue
+        
+        if element.tag in EXTRACTED_TAGS:
+            open_elements -= 1
+        
+        # Goes through the HTML page until it finds the Africa Header then starts extracting
+        if element.tag == "h2":
+            header = element_text(element)
+            
+            if header.lower().find("africa") != -1:
+                extraction_flag = True
             
-            # If the extraction flag is set to True, extract the data
             if extraction_flag:
-                
-                # Check if the element is header
-                if element.name == "h2":
-                    region_level_header = element.text
-                    
-                # Check if the element is header
-                if element.name == "h3":
-                    country_level_header = element.text
-                    
-                # Check if it is a li
-                if element.name == "li":
-                    data.append([region_level_header, country_level_header, element.text])
+                region_level_header = header
             
-            # Stops at the se also page
-            # If see also is found, break the loop
-            if element.name == "h2" and element.text.lower().find("see also") != -1:
+            # Stops at the see also header
+            if header.lower().find("see also") != -1:
                 break
         
-        # Return the data as a pandas DataFrame
-        return format_refinery_table(pd.DataFrame(data, columns=["Region", "Country", "Raw"]))
-    else:
-        # If the request was not successful, print an error message
-        LOGGER.error(f"Failed to get data from URL: {url}")
-        raise Exception(f"Failed to get data from URL: {url}")
+        # Check if the element is header
+        if element.tag == "h3" and extraction_flag:
+            country_level_header = element_text(element)
+        
+        # Check if it is a li
+        if element.tag == "li":
+            row = open_rows.pop()
+            if row:
+                row[2] = element_text(element)
+        
+        # Drop the element and its previous siblings when nothing open needs their text
+        if open_elements == 0:
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+    
+    # Close any li left open by a truncated page
+    for row in open_rows:
+        if row and row[2] is None:
+            row[2] = ''
+    
+    return data
+
+
+# Get the text of an lxml element
+def element_text(element)->str:
+    '''
+    Title: element_text
+    Description: This function concatenates the text of an lxml element the same way BeautifulSoup's .text does,
+        i.e without comments and without the content of style, script, template, rt and rp tags.
+    Arguments:
+        element: The lxml element
+    Returns:
+        text: The text of the element
+    '''
+    
+    parts = []
+    
+    # Comments have a function as their tag
+    if isinstance(element.tag, str) and element.tag not in IGNORED_TEXT_TAGS and element.text:
+        parts.append(element.text)
+    
+    for child in element:
+        parts.append(element_text(child))
+        if child.tail:
+            parts.append(child.tail)
+    
+    return ''.join(parts)
+
+
+# Parser backends
+REFINERY_PARSERS = {
+    "html.parser": parse_refinery_page_soup,
+    "lxml": parse_refinery_page_lxml
+}
     
     
 # Format refinery data
@@ -114,7 +363,7 @@ def format_refinery_table(table:pd.DataFrame)->pd.DataFrame:
     table['Region'] = table['Region'].str.replace("[edit]", "")
     
     # Replace A hat with A
-    table['Raw'] = table['Raw'].apply(convert_to_ascii)
+    table['Raw'] = convert_to_ascii_series(table['Raw'])
     
     # Remove [edit] from the Country column
     table['Country'] = table['Country'].str.strip()
@@ -136,15 +385,16 @@ def format_refinery_table(table:pd.DataFrame)->pd.DataFrame:
     table['Refinery'] = table['Refinery'].str.replace(')', '')
     
     # Get the capacity
-    table['Capacity'] = table['Raw'].apply(extract_bbld)
+    table['Capacity'] = extract_bbld_series(table['Raw'])
     
-    # Get the capacity
-    table['Capacity'] = table['Capacity'].where(table['Capacity'] != 0, table['Raw'].apply(extract_tonnes_to_bbld))
+    # Get the capacity in tonnes for the refineries without bbl/day
+    missing_capacity = (table['Capacity'] == 0).to_numpy()
+    table.loc[missing_capacity, 'Capacity'] = extract_tonnes_to_bbld_series(table.loc[missing_capacity, 'Raw']).to_numpy()
     
     
     
     # Status
-    table['Status'] = table['Raw'].apply(checkstatus)
+    table['Status'] = checkstatus_series(table['Raw'])
     
     
     # Add unit
@@ -152,7 +402,7 @@ def format_refinery_table(table:pd.DataFrame)->pd.DataFrame:
     
     
     # Format regions
-    table['Region'] = table['Region'].apply(format_regions)
+    table['Region'] = format_regions_series(table['Region'])
     
    # Debugging
    # return table
@@ -175,6 +425,24 @@ def format_refinery_table(table:pd.DataFrame)->pd.DataFrame:
     # Return the formatted table
     return table[['region', 'country', 'refinery', 'capacity', 'unit', 'status']]
 
+# Get the first matched number
+def first_number(matches:pd.DataFrame)->pd.Series:
+    '''
+    Title: first_number
+    Description: This function converts the captured groups to floats and returns the first one matched in each row.
+    Arguments:
+        matches: The captured groups, one column per pattern, as returned by Series.str.extract
+    Returns:
+        number: The first matched number of each row, NaN where nothing matched
+    '''
+    
+    # Remove the commas and convert each column to floats
+    numbers = pd.DataFrame({column: matches[column].str.replace(",", "", regex=False).astype(float) for column in matches.columns}, index=matches.index)
+    
+    # Take the first column that matched
+    return numbers.bfill(axis=1).iloc[:, 0]
+
+
 # Extract bbl/day from the raw data
 def extract_bbld(text:str)-> int:
     '''
@@ -186,20 +454,36 @@ def extract_bbld(text:str)-> int:
     Returns:
         bbl_day: The extracted bbl/day value
     '''
-    patterns = [r'(\d{1,3}(?:,\d{3})*) bbl/d',
-                r'(\d{1,3}(?:,\d{3})*) bbl/day',
-                r'(\d{1,3}(?:,\d{3})*) bp/d',
-                r'(\d{1,3}(?:,\d{3})*) bpd',
-                r'(\d{1,3}(?:,\d{3})*) barrels/day',
-                r'(\d{1,3}(?:,\d{3})*) barrels per day']
-   
-    for pattern in patterns:
-        string_match = re.search(pattern, text)
-        if string_match:
-            value = string_match.group(1)
-            value = value.replace(",", "")
-            return int(value) / 1000
+    string_match = BBLD_PATTERN.match(text)
+    if string_match:
+        value = string_match.group(string_match.lastindex)
+        value = value.replace(",", "")
+        return int(value) / 1000
     return 0
+
+
+# Extract bbl/day from a column of raw data
+def extract_bbld_series(raw:pd.Series)->pd.Series:
+    '''
+    Title: extract_bbld_series
+    Description: This function extracts the bbl/day from a column of raw data in one pass.
+    Arguments:
+        raw: The raw data column
+    Returns:
+        bbl_day: The extracted bbl/day values, 0 where no unit is found
+    '''
+    
+    # Only search the rows mentioning one of the units
+    candidates = raw.str.contains(BBLD_KEYWORD_PATTERN).to_numpy(dtype=bool)
+    
+    # One column per unit, only the first unit found is filled
+    matches = raw[candidates].str.extract(BBLD_PATTERN)
+    
+    # Take the matched value and convert to kbd
+    value = np.zeros(len(raw))
+    value[candidates] = (first_number(matches) / 1000).fillna(0).to_numpy()
+    
+    return pd.Series(value, index=raw.index)
     
 # Extract tonnes to bbl/day
 def extract_tonnes_to_bbld(text:str)->int:
@@ -217,74 +501,71 @@ def extract_tonnes_to_bbld(text:str)->int:
     # Replace the periods with commas
     text = text.replace(".", ",")
     
-    # List the patterns
-    patterns_tonnes_per_year = [r'(\d{1,3}(?:,\d{3})*) ton/annum', 
-                                r'(\d{1,3}(?:,\d{3})*) tonnes/annum', 
-                                r'(\d{1,3}(?:,\d{3})*) tonnes/year']
+    # Search for the first unit found
+    string_match = TONNES_PATTERN.match(text)
     
-    pattern_tonnes_per_day = [r'(\d{1,3}(?:,\d{3})*) ton/day', 
-                              r'(\d{1,3}(?:,\d{3})*) tonnes/day', 
-                              r'(\d{1,3}(?:,\d{3})*) tonnes/d']
+    # If no unit is found
+    if not string_match:
+        return 0
     
-    pattern_million_tonnes_per_year = [r'(\d{1,3}(?:.\d{3})*) million tonne/year',
-                                       r'(\d{1,3}(?:.\d{3})*) million tonnes/year',
-                                        r'(\d{1,3}(?:.\d{3})*) million tonne/annum',
-                                        r'(\d{1,3}(?:.\d{3})*) million tonnes/annum',
-                                        r'(\d{1,3}(?:.\d{3})*) million tonne per year',
-                                        r'(\d{1,3}(?:.\d{3})*) million tonnes per year']
+    # Extract the value and remove the commas
+    value = string_match.group(string_match.lastindex).replace(",", "")
     
+    # Tonnes per year
+    if string_match.lastindex <= len(TONNES_PER_YEAR_UNITS):
+        return round(int(value) * TONNES_INTO_BBLS / (1000*365) , ROUND_DIGITS)
     
-    # Iterate through the patterns
-    for pattern in patterns_tonnes_per_year:
-        # Search for the pattern in the text
-        string_match = re.search(pattern, text)
-        
-        # If the pattern is found, extract the value
-        if string_match:
-            # Extract the value
-            value = string_match.group(1)
-            
-            # Remove the commas
-            value = value.replace(",", "")
-            
-            # Convert the value to an integer
-            return round(int(value) * TONNES_INTO_BBLS / (1000*365) , ROUND_DIGITS)
-        
+    # Tonnes per day
+    if string_match.lastindex <= len(TONNES_PER_YEAR_UNITS) + len(TONNES_PER_DAY_UNITS):
+        return round(int(value) * TONNES_INTO_BBLS / 1000, ROUND_DIGITS)
     
-    # Iterate through the patterns
-    for pattern in pattern_tonnes_per_day:
-        # Search for the pattern in the text
-        string_match = re.search(pattern, text)
-        
-        # If the pattern is found, extract the value
-        if string_match:
-            # Extract the value
-            value = string_match.group(1)
-            
-            # Remove the commas
-            value = value.replace(",", "")
-            
-            # Convert the value to an integer
-            return round(int(value) * TONNES_INTO_BBLS / 1000, ROUND_DIGITS)
+    # Million tonnes per year
+    # Extra 1000 to convert to bbl/day due to matching i.e 3.65 -> 3650
+    return round(float(value) * TONNES_INTO_BBLS * 1000000 / (1000*1000*365), ROUND_DIGITS)
+
+
+# Extract tonnes to bbl/day from a column of raw data
+def extract_tonnes_to_bbld_series(raw:pd.Series)->pd.Series:
+    '''
+    Title: extract_tonnes_to_bbld_series
+    Description: This function converts the tonnes found in a column of raw data to bbl/day in one pass.
+        Tonnes per year take priority over tonnes per day, which take priority over million tonnes per year.
+    Arguments:
+        raw: The raw data column
+    Returns:
+        bbl_day: The converted bbl/day values, 0 where no unit is found
+    '''
     
-    # Iterate through the patterns
-    for pattern in pattern_million_tonnes_per_year:
-        # Search for the pattern in the text
-        string_match = re.search(pattern, text)
-        
-        # If the pattern is found, extract the value
-        if string_match:
-            # Extract the value
-            value = string_match.group(1)
-            
-            # Remove the commas
-            value = value.replace(",", "")
-            
-            # Convert the value to an integer
-            # Extra 1000 to convert to bbl/day due to matching i.e 3.65 -> 3650
-            return round(float(value) * TONNES_INTO_BBLS * 1000000 / (1000*1000*365), ROUND_DIGITS)
+    # Only search the rows mentioning one of the units
+    candidates = raw.str.contains(TONNES_KEYWORD_PATTERN).to_numpy(dtype=bool)
     
-    return 0
+    # Replace the periods with commas
+    text = raw[candidates].str.replace(".", ",", regex=False)
+    
+    # One column per unit, only the first unit found is filled
+    matches = text.str.extract(TONNES_PATTERN)
+    
+    # Split the columns by unit family
+    per_year_end = len(TONNES_PER_YEAR_UNITS)
+    per_day_end = per_year_end + len(TONNES_PER_DAY_UNITS)
+    
+    per_year = first_number(matches.iloc[:, :per_year_end]).to_numpy()
+    per_day = first_number(matches.iloc[:, per_year_end:per_day_end]).to_numpy()
+    million_per_year = first_number(matches.iloc[:, per_day_end:]).to_numpy()
+    
+    # Convert to bbl/day
+    # Extra 1000 to convert to bbl/day due to matching i.e 3.65 -> 3650
+    converted = np.select([~np.isnan(per_year), ~np.isnan(per_day), ~np.isnan(million_per_year)],
+                          [per_year * TONNES_INTO_BBLS / (1000*365),
+                           per_day * TONNES_INTO_BBLS / 1000,
+                           million_per_year * TONNES_INTO_BBLS * 1000000 / (1000*1000*365)],
+                          default=0)
+    
+    # Round with the builtin round as numpy rounds halves differently
+    value = np.zeros(len(raw))
+    value[candidates] = [round(bbl_day, ROUND_DIGITS) for bbl_day in converted.tolist()]
+    
+    return pd.Series(value, index=raw.index)
    
 
 # Format regions
@@ -306,6 +587,21 @@ def format_regions(text:str)->str:
     return text
 
 
+# Format a column of regions
+def format_regions_series(regions:pd.Series)->pd.Series:
+    '''
+    Title: format_regions_series
+    Description: This function formats a column of regions in one pass.
+    Arguments:
+        regions: The region column
+    Returns:
+        formatted_regions: The formatted region column
+    '''
+    
+    # Convert North America & Central America to North America
+    return regions.where(~regions.str.lower().str.contains("north", regex=False), "North America")
+
+
 
 # Check the status of the refinery 
 def checkstatus(text:str)->str:
@@ -318,20 +614,32 @@ def checkstatus(text:str)->str:
         status: The status of the refinery
     '''
     
-    values_to_find = ["mothballed", "closed", "biorefinery"]
-    
-    # Check if the text contains the values
-    are_values_present = any([text.lower().find(value) != -1 for value in values_to_find])
-    
-    
-    # Check if to be is present
-    if text.lower().find("to be") != -1:
-        are_values_present = False
+    lower = text.lower()
     
-    if are_values_present:
+    # Check if the text contains the values and to be is not present
+    if CLOSED_PATTERN.search(lower) and lower.find(PLANNED_KEYWORD) == -1:
         return "closed"
     else:
         return "active"
+
+
+# Check the status of a column of refineries
+def checkstatus_series(raw:pd.Series)->pd.Series:
+    '''
+    Title: checkstatus_series
+    Description: This function checks the status of a column of refineries in one pass.
+    Arguments:
+        raw: The raw data column
+    Returns:
+        status: The status of each refinery
+    '''
+    
+    lower = raw.str.lower()
+    
+    # Check if the text contains the values and to be is not present
+    are_values_present = lower.str.contains(CLOSED_PATTERN) & ~lower.str.contains(PLANNED_KEYWORD, regex=False)
+    
+    return pd.Series(np.where(are_values_present, "closed", "active"), index=raw.index, dtype=object)
     
     
 
@@ -347,6 +655,18 @@ def convert_to_ascii(text:str)->str:
         ascii_text: The text converted to ASCII
     '''
     
-    return re.sub(r'[^\x00-\x7F]+', ' ', text)
+    return NON_ASCII_PATTERN.sub(' ', text)
 
 
+# Convert a column of text to ASCII
+def convert_to_ascii_series(text:pd.Series)->pd.Series:
+    '''
+    Title: convert_to_ascii_series
+    Description: This function converts a column of text to ASCII in one pass.
+    Arguments:
+        text: The text column to convert to ASCII
+    Returns:
+        ascii_text: The text column converted to ASCII
+    '''
+    
+    return text.str.replace(NON_ASCII_PATTERN, ' ', regex=True)
@@ -0,0 +1,102 @@
+# Global imports
+import threading
+import time
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+
+
+# Pool metrics
+############################################################################################################
+
+
+class MeteredQueuePool(QueuePool):
+    '''
+    Title: MeteredQueuePool
+    Description: Queue pool timing every checkout. The wait covers the time spent queueing for a free connection
+        and opening a new one, and the checkouts that timed out are counted.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.metrics_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def connect(self):
+        '''
+        Title: connect
+        Description: This function checks a connection out of the pool and records the wait.
+        Arguments:
+            None
+        Returns:
+            connection: The pooled connection
+        '''
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            with self.metrics_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            wait = time.perf_counter() - start
+            with self.metrics_lock:
+                self.checkouts += 1
+                self.wait_seconds_total += wait
+                self.wait_seconds_max = max(self.wait_seconds_max, wait)
+
+
+class MeteredAsyncQueuePool(MeteredQueuePool, AsyncAdaptedQueuePool):
+    '''
+    Title: MeteredAsyncQueuePool
+    Description: Metered queue pool of the asyncio engines, the checkouts are timed in the greenlet of the awaiting task.
+    '''
+
+
+def get_pool_stats(engine, max_overflow:int)->dict:
+    '''
+    Title: get_pool_stats
+    Description: This function returns the utilization of the connection pool of the engine and the checkout waits.
+    Arguments:
+        engine: The engine object to connect to the database, sync or asyncio
+        max_overflow: The max overflow the engine was created with, see get_engine_config
+    Returns:
+        stats: The pool size, connections in use, utilization and wait times, only the sizes for pools without metrics
+    '''
+    pool = engine.pool
+
+    # Pool of another class, SQLite memory databases for example
+    if not isinstance(pool, QueuePool):
+        return {"pool": type(pool).__name__}
+
+    # A negative max overflow does not bound the connections
+    max_connections = pool.size() + max_overflow if max_overflow >= 0 else None
+    checked_out = pool.checkedout()
+
+    stats = {
+        "pool": type(pool).__name__,
+        "size": pool.size(),
+        "max_overflow": max_overflow,
+        "checked_out": checked_out,
+        "checked_in": pool.checkedin(),
+        # The overflow counts from -size while the pool fills
+        "overflow": max(pool.overflow(), 0),
+        "utilization": checked_out / max_connections if max_connections else None
+    }
+
+    if isinstance(pool, MeteredQueuePool):
+        with pool.metrics_lock:
+            stats.update({
+                "checkouts": pool.checkouts,
+                "timeouts": pool.timeouts,
+                "wait_seconds_total": pool.wait_seconds_total,
+                "wait_seconds_mean": pool.wait_seconds_total / pool.checkouts if pool.checkouts else 0.0,
+                "wait_seconds_max": pool.wait_seconds_max
+            })
+
+    return stats
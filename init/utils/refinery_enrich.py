@@ -0,0 +1,530 @@
+# Global imports
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+from urllib.parse import urljoin, urlsplit
+
+from lxml import html
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.refinery_db_cache import REFINERY_CACHE_DIR, REQUEST_TIMEOUT, read_cache
+from utils.refinery_db_ext import convert_to_ascii, extract_bbld, extract_tonnes_to_bbld
+
+
+# Constants, overridden by the REFINERY_ENRICH_* environment variables, see get_enrich_config
+# Articles fetched at once
+ENRICH_WORKERS = 8
+
+# Requests per second sent to one host, 0 for no limit
+ENRICH_HOST_RATE = 10.0
+
+# Attempts after the first one, for the connection errors and the statuses of RETRY_STATUSES
+ENRICH_RETRIES = 3
+
+# Seconds before the first retry, doubled on every retry
+ENRICH_BACKOFF = 0.5
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+ENRICH_USER_AGENT = "RefineryDatabase/1.0 (refinery enrichment crawler)"
+
+# Columns added by enrich_refinery_data
+ENRICH_COLUMNS = ["operator", "latitude", "longitude", "infobox_capacity"]
+
+# Infobox labels of the operator, in order of priority
+OPERATOR_LABELS = ["operator", "operator(s)", "operators", "owner", "owner(s)", "owners"]
+
+CAPACITY_LABEL = "capacity"
+
+# Links to articles, other namespaces such as File: or Help: have a colon
+ARTICLE_PREFIX = "/wiki/"
+
+# Class of the Main article notes under the country headers of the list page
+HATNOTE_CLASS = "hatnote"
+
+
+# Import logging
+import logging
+
+# Set up logging
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+LOGGGER_FORMAT = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+LOGGER_STREAM_HANDLER = logging.StreamHandler()
+LOGGER_STREAM_HANDLER.setFormatter(LOGGGER_FORMAT)
+LOGGER.addHandler(LOGGER_STREAM_HANDLER)
+
+
+
+# Configuration
+############################################################################################################
+
+
+def get_enrich_config()->dict:
+    '''
+    Title: get_enrich_config
+    Description: This function reads the crawler configuration from the environment, the constants of this module are the defaults.
+        REFINERY_ENRICH_WORKERS, REFINERY_ENRICH_HOST_RATE, REFINERY_ENRICH_RETRIES and REFINERY_ENRICH_BACKOFF.
+    Arguments:
+        None
+    Returns:
+        config: The keyword arguments of enrich_refinery_data
+    '''
+    environ = os.environ
+
+    return {
+        "workers": int(environ.get("REFINERY_ENRICH_WORKERS", ENRICH_WORKERS)),
+        "host_rate": float(environ.get("REFINERY_ENRICH_HOST_RATE", ENRICH_HOST_RATE)),
+        "retries": int(environ.get("REFINERY_ENRICH_RETRIES", ENRICH_RETRIES)),
+        "backoff": float(environ.get("REFINERY_ENRICH_BACKOFF", ENRICH_BACKOFF))
+    }
+
+
+def get_enrich_session(workers:int=ENRICH_WORKERS)->requests.Session:
+    '''
+    Title: get_enrich_session
+    Description: This function creates the session shared by the crawler threads, its pool keeps one connection per thread to every host.
+    Arguments:
+        workers: The number of threads of the crawler
+    Returns:
+        session: The session
+    '''
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = ENRICH_USER_AGENT
+    return session
+
+
+
+# Article links
+############################################################################################################
+
+
+def parse_refinery_links(content:bytes, url:str)->list:
+    '''
+    Title: parse_refinery_links
+    Description: This function finds the article of every refinery of the list page, in the order of the rows of parse_refinery_page.
+        The article is the link the li starts with, the links further in the text are the operators or the references.
+    Arguments:
+        content: The HTML content of the list page
+        url: URL of the list page, the links are relative to it
+    Returns:
+        links: The absolute URL of the article of each row, None for the rows without one
+    '''
+    root = html.fromstring(content)
+
+    # Extraction flag
+    extraction_flag = False
+    links = []
+
+    # Same walk as the parsers, the h3 headers do not change the rows
+    for element in root.iter("h2", "li"):
+        if element.tag == "h2":
+            header = element.text_content().lower()
+            if header.find("africa") != -1:
+                extraction_flag = True
+            if header.find("see also") != -1:
+                break
+            continue
+
+        if not extraction_flag:
+            continue
+
+        first = element[0] if len(element) else None
+        href = first.get("href", "") if first is not None and first.tag == "a" else ""
+        if (element.text or "").strip() == "" and href.startswith(ARTICLE_PREFIX) and ":" not in href[len(ARTICLE_PREFIX):]:
+            links.append(urljoin(url, href))
+        else:
+            links.append(None)
+
+    return links
+
+
+def article_link(element, url:str)->str:
+    '''
+    Title: article_link
+    Description: This function returns the absolute URL of the first article linked in the element.
+    Arguments:
+        element: The lxml element
+        url: URL of the page, the links are relative to it
+    Returns:
+        link: The absolute URL of the article, None if the element links none
+    '''
+    for anchor in element.iter("a"):
+        href = anchor.get("href", "")
+        if href.startswith(ARTICLE_PREFIX) and ":" not in href[len(ARTICLE_PREFIX):]:
+            return urljoin(url, href)
+    return None
+
+
+def normalize_name(name:str)->str:
+    '''
+    Title: normalize_name
+    Description: This function lowers a country or refinery name and collapses its spaces, to match the names of the table with the text of the links.
+    Arguments:
+        name: The name
+    Returns:
+        name: The normalized name
+    '''
+    return " ".join(convert_to_ascii(name).replace("[edit]", "").split()).lower()
+
+
+def parse_country_links(content:bytes, url:str)->dict:
+    '''
+    Title: parse_country_links
+    Description: This function finds the article of every country of the list page, linked by its header or by the Main article note under it.
+    Arguments:
+        content: The HTML content of the list page
+        url: URL of the list page, the links are relative to it
+    Returns:
+        links: The absolute URL of the article of each country by normalized country name, the countries without one are left out
+    '''
+    root = html.fromstring(content)
+
+    # Extraction flag
+    extraction_flag = False
+    country = None
+    links = {}
+
+    # Same walk as parse_refinery_links, a note belongs to the last country header
+    for element in root.iter("h2", "h3", "div"):
+        if element.tag == "h2":
+            header = element.text_content().lower()
+            if header.find("africa") != -1:
+                extraction_flag = True
+            if header.find("see also") != -1:
+                break
+            country = None
+            continue
+
+        if not extraction_flag:
+            continue
+
+        if element.tag == "h3":
+            headline = element.find_class("mw-headline")
+            country = normalize_name((headline[0] if headline else element).text_content())
+            link = article_link(headline[0], url) if headline else None
+        elif country and HATNOTE_CLASS in element.get("class", "").split():
+            link = article_link(element, url)
+        else:
+            continue
+
+        if country and link:
+            links.setdefault(country, link)
+
+    return links
+
+
+def parse_country_article(content:bytes, url:str)->dict:
+    '''
+    Title: parse_country_article
+    Description: This function finds the refinery articles listed by a country article, a li starting with a link like on the list page.
+    Arguments:
+        content: The HTML content of the country article
+        url: URL of the article, the links are relative to it
+    Returns:
+        links: The absolute URL of the article of each refinery by normalized refinery name
+    '''
+    root = html.fromstring(content)
+    links = {}
+
+    for element in root.iter("li"):
+        first = element[0] if len(element) else None
+        if first is None or first.tag != "a" or (element.text or "").strip():
+            continue
+
+        link = article_link(first, url)
+        if link:
+            links.setdefault(normalize_name(first.get("title") or first.text_content()), link)
+            links.setdefault(normalize_name(first.text_content()), link)
+
+    return links
+
+
+def read_list_page(url:str, cache_dir:str=REFINERY_CACHE_DIR)->bytes:
+    '''
+    Title: read_list_page
+    Description: This function reads the cached list page, the one get_refinery_data just parsed.
+    Arguments:
+        url: URL of the list page
+        cache_dir: The cache directory
+    Returns:
+        content: The HTML content of the list page
+    '''
+    content, _ = read_cache(url, cache_dir)
+    if content is None:
+        LOGGER.error(f"Page not cached: {url}")
+        raise Exception(f"Page not cached: {url}")
+
+    return content
+
+
+def get_refinery_links(url:str, cache_dir:str=REFINERY_CACHE_DIR)->list:
+    '''
+    Title: get_refinery_links
+    Description: This function finds the refinery articles of the cached list page.
+    Arguments:
+        url: URL of the list page
+        cache_dir: The cache directory
+    Returns:
+        links: The absolute URL of the article of each row, None for the rows without one
+    '''
+    return parse_refinery_links(read_list_page(url, cache_dir), url)
+
+
+def get_country_links(url:str, cache_dir:str=REFINERY_CACHE_DIR)->dict:
+    '''
+    Title: get_country_links
+    Description: This function finds the country articles of the cached list page.
+    Arguments:
+        url: URL of the list page
+        cache_dir: The cache directory
+    Returns:
+        links: The absolute URL of the article of each country by normalized country name
+    '''
+    return parse_country_links(read_list_page(url, cache_dir), url)
+
+
+def parse_infobox(content:bytes)->dict:
+    '''
+    Title: parse_infobox
+    Description: This function reads the operator, the coordinates and the capacity of a refinery article.
+        The operator and capacity come from the labeled rows of the infobox, the coordinates from the geo microformat.
+    Arguments:
+        content: The HTML content of the article
+    Returns:
+        fields: The operator, latitude, longitude and infobox_capacity in kbd, None when missing
+    '''
+    root = html.fromstring(content)
+    fields = dict.fromkeys(ENRICH_COLUMNS)
+
+    # References would end up in the values
+    for reference in root.xpath("//sup[contains(@class, 'reference')]"):
+        reference.drop_tree()
+
+    # Labeled rows of the first infobox
+    labels = {}
+    for infobox in root.xpath("//table[contains(concat(' ', normalize-space(@class), ' '), ' infobox ')]")[:1]:
+        for row in infobox.iter("tr"):
+            label, value = row.find("th"), row.find("td")
+            if label is not None and value is not None:
+                labels.setdefault(" ".join(label.text_content().split()).lower(), " ".join(convert_to_ascii(value.text_content()).split()))
+
+    fields["operator"] = next((labels[label] for label in OPERATOR_LABELS if labels.get(label)), None)
+
+    # Capacity with the units of the list page
+    if labels.get(CAPACITY_LABEL):
+        capacity = extract_bbld(labels[CAPACITY_LABEL]) or extract_tonnes_to_bbld(labels[CAPACITY_LABEL])
+        fields["infobox_capacity"] = capacity or None
+
+    # Decimal coordinates i.e 29.85; -93.96
+    for geo in root.xpath("//span[contains(concat(' ', normalize-space(@class), ' '), ' geo ')]")[:1]:
+        try:
+            latitude, longitude = (float(value) for value in geo.text_content().split(";"))
+        except ValueError:
+            continue
+        fields["latitude"], fields["longitude"] = latitude, longitude
+
+    return fields
+
+
+
+# Crawler
+############################################################################################################
+
+
+class HostRateLimiter:
+    '''
+    Title: HostRateLimiter
+    Description: Spacing of the requests sent to every host, shared by the threads of the crawler.
+        Each request reserves the next free slot of its host under the lock and sleeps until it outside of it.
+    '''
+
+    def __init__(self, rate:float=ENRICH_HOST_RATE):
+        '''
+        Title: __init__
+        Description: This function creates a limiter without any reserved slot.
+        Arguments:
+            rate: The requests per second sent to one host, 0 for no limit
+        Returns:
+            None
+        '''
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_slots = {}
+
+    def wait(self, url:str)->None:
+        '''
+        Title: wait
+        Description: This function blocks until the host of the URL can receive another request.
+        Arguments:
+            url: URL of the request
+        Returns:
+            None
+        '''
+        host = urlsplit(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slots.get(host, now))
+            self.next_slots[host] = slot + self.interval
+
+        if slot > now:
+            time.sleep(slot - now)
+
+    def delay(self, url:str, seconds:float)->None:
+        '''
+        Title: delay
+        Description: This function holds back every request to the host of the URL, i.e for the Retry-After of a 429.
+        Arguments:
+            url: URL of the request that was answered
+            seconds: The seconds to wait
+        Returns:
+            None
+        '''
+        host = urlsplit(url).netloc
+        with self.lock:
+            self.next_slots[host] = max(self.next_slots.get(host, 0.0), time.monotonic() + seconds)
+
+
+def fetch_article(session:requests.Session, url:str, limiter:HostRateLimiter, retries:int=ENRICH_RETRIES, backoff:float=ENRICH_BACKOFF)->bytes:
+    '''
+    Title: fetch_article
+    Description: This function gets an article, retrying the connection errors and the statuses of RETRY_STATUSES with an exponential backoff.
+    Arguments:
+        session: The shared session
+        url: URL of the article
+        limiter: The rate limiter of the hosts
+        retries: The number of attempts after the first one
+        backoff: The seconds before the first retry, doubled on every retry
+    Returns:
+        content: The content of the article, None if it does not exist or every attempt failed
+    '''
+    error = None
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(backoff * 2 ** (attempt - 1))
+
+        limiter.wait(url)
+        try:
+            response = session.get(url, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            error = e
+            continue
+
+        if response.status_code == 200:
+            return response.content
+
+        # Not every refinery has an article
+        if response.status_code == 404:
+            LOGGER.info(f"No article at {url}")
+            return None
+
+        error = f"status {response.status_code}"
+        if response.status_code not in RETRY_STATUSES:
+            break
+
+        # Slow down every thread, not only this one
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            limiter.delay(url, float(retry_after))
+
+    LOGGER.warning(f"Failed to get {url}: {error}")
+    return None
+
+
+def find_country_links(refinery_data:pd.DataFrame, links:list, country_links:dict, fetch, executor:ThreadPoolExecutor)->list:
+    '''
+    Title: find_country_links
+    Description: This function fetches the articles of the countries with refineries the list page does not link,
+        and takes the article of those refineries from the list of their country article.
+    Arguments:
+        refinery_data: The formatted refinery data, in the order of the rows of the list page
+        links: The article of each row, see parse_refinery_links
+        country_links: The article of each country, see parse_country_links
+        fetch: The function getting the content of an article, None if it failed
+        executor: The pool of threads fetching the articles
+    Returns:
+        links: The article of each row, completed with the ones of the country articles
+    '''
+    countries = [normalize_name(country) for country in refinery_data["country"]]
+    urls = list(dict.fromkeys(country_links[country] for country, link in zip(countries, links) if not link and country in country_links))
+
+    def listed(url):
+        content = fetch(url)
+        return parse_country_article(content, url) if content is not None else {}
+
+    articles = dict(zip(urls, executor.map(listed, urls)))
+    LOGGER.info(f"Fetched {sum(bool(article) for article in articles.values())} of {len(urls)} country articles")
+
+    return [link or articles.get(country_links.get(country), {}).get(normalize_name(name))
+            for link, country, name in zip(links, countries, refinery_data["refinery"])]
+
+
+def enrich_refinery_data(refinery_data:pd.DataFrame, links:list, workers:int=ENRICH_WORKERS, host_rate:float=ENRICH_HOST_RATE,
+                         retries:int=ENRICH_RETRIES, backoff:float=ENRICH_BACKOFF, session:requests.Session=None, country_links:dict=None)->pd.DataFrame:
+    '''
+    Title: enrich_refinery_data
+    Description: This function fetches the article of every refinery with a pool of threads and merges its infobox into the table.
+        The refineries the list page does not link are first looked up in the article of their country, see find_country_links.
+        An article linked by several rows is fetched once. The infobox capacity fills the capacity of the rows whose text had none.
+    Arguments:
+        refinery_data: The formatted refinery data, in the order of the rows of the list page
+        links: The article of each row, see parse_refinery_links
+        workers: The number of articles fetched at once
+        host_rate: The requests per second sent to one host, 0 for no limit
+        retries: The number of attempts after the first one
+        backoff: The seconds before the first retry, doubled on every retry
+        session: The session to send the requests with, a pooled one is created if None
+        country_links: The article of each country, see parse_country_links, no country article is fetched if None
+    Returns:
+        refinery_data: A copy of the refinery data with the columns of ENRICH_COLUMNS, empty for the rows without an article
+    '''
+    if len(links) != len(refinery_data):
+        raise ValueError(f"{len(links)} links for {len(refinery_data)} refineries")
+
+    limiter = HostRateLimiter(host_rate)
+    own_session = session is None
+    session = get_enrich_session(workers) if own_session else session
+
+    def fetch(url):
+        return fetch_article(session, url, limiter, retries, backoff)
+
+    def enrich(url):
+        content = fetch(url)
+        return parse_infobox(content) if content is not None else None
+
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            if country_links:
+                links = find_country_links(refinery_data, links, country_links, fetch, executor)
+
+            urls = list(dict.fromkeys(link for link in links if link))
+            articles = dict(zip(urls, executor.map(enrich, urls)))
+    finally:
+        if own_session:
+            session.close()
+
+    found = sum(article is not None for article in articles.values())
+    LOGGER.info(f"Fetched {found} of {len(urls)} refinery articles in {time.perf_counter() - start:.1f}s")
+
+    # One row of fields per refinery
+    empty = dict.fromkeys(ENRICH_COLUMNS)
+    fields = pd.DataFrame([articles.get(link) or empty if link else empty for link in links], columns=ENRICH_COLUMNS, index=refinery_data.index)
+
+    enriched = refinery_data.copy()
+    enriched["operator"] = fields["operator"].astype(object)
+    for column in ["latitude", "longitude", "infobox_capacity"]:
+        enriched[column] = fields[column].astype(float)
+
+    # Fill the capacities the list page did not give
+    missing_capacity = (enriched["capacity"] == 0) & enriched["infobox_capacity"].notna()
+    enriched["capacity"] = np.where(missing_capacity, enriched["infobox_capacity"], enriched["capacity"])
+
+    return enriched
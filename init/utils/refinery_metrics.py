@@ -0,0 +1,401 @@
+# Global imports
+from bisect import bisect_left
+import re
+import threading
+import time
+
+from sqlalchemy import event
+
+
+# Constants
+# Upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the row count buckets
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Main statement after the common table expressions of a WITH
+MAIN_STATEMENT_PATTERN = re.compile(r"\)\s*(SELECT|INSERT|UPDATE|DELETE)\b", re.IGNORECASE)
+
+# First table of a statement, by statement kind
+TABLE_PATTERNS = {
+    "SELECT": re.compile(r"\bFROM\s+\"?(\w+)", re.IGNORECASE),
+    "DELETE": re.compile(r"\bFROM\s+\"?(\w+)", re.IGNORECASE),
+    "INSERT": re.compile(r"\bINTO\s+\"?(\w+)", re.IGNORECASE),
+    "UPDATE": re.compile(r"^\s*\"?(\w+)"),
+    "COPY": re.compile(r"^\s*\"?(\w+)")
+}
+
+# Timing of the request running on the thread, see start_request_timing
+REQUEST_TIMING = threading.local()
+
+
+
+# Metrics
+############################################################################################################
+
+
+def format_labels(names:tuple, values:tuple)->str:
+    '''
+    Title: format_labels
+    Description: This function formats the labels of a sample in the Prometheus text format, escaping the values.
+    Arguments:
+        names: The names of the labels
+        values: The values of the labels
+    Returns:
+        labels: The labels between braces, empty without labels
+    '''
+    labels = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        labels.append(f'{name}="{value}"')
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def format_value(value:float)->str:
+    '''
+    Title: format_value
+    Description: This function formats a sample value, integers without a decimal point.
+    Arguments:
+        value: The value
+    Returns:
+        value: The formatted value
+    '''
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    '''
+    Title: Metric
+    Description: Base of the metrics, one value per combination of label values, thread safe.
+    '''
+
+    kind = "untyped"
+
+    def __init__(self, name:str, description:str, labels:tuple=()):
+        '''
+        Title: __init__
+        Description: This function creates a metric without samples.
+        Arguments:
+            name: The name of the metric
+            description: The help text of the metric
+            labels: The names of the labels
+        Returns:
+            None
+        '''
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def render(self)->list:
+        '''
+        Title: render
+        Description: This function returns the lines of the metric in the Prometheus text format.
+        Arguments:
+            None
+        Returns:
+            lines: The HELP and TYPE lines and one line per sample
+        '''
+        with self.lock:
+            values = dict(self.values)
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{format_labels(self.labels, label_values)} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    '''
+    Title: Counter
+    Description: Value that only goes up.
+    '''
+
+    kind = "counter"
+
+    def inc(self, label_values:tuple=(), amount:float=1)->None:
+        '''
+        Title: inc
+        Description: This function adds to the counter of the label values.
+        Arguments:
+            label_values: The values of the labels
+            amount: The positive amount to add
+        Returns:
+            None
+        '''
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    '''
+    Title: Gauge
+    Description: Value that goes up and down.
+    '''
+
+    kind = "gauge"
+
+    def inc(self, label_values:tuple=(), amount:float=1)->None:
+        '''
+        Title: inc
+        Description: This function adds to the gauge of the label values.
+        Arguments:
+            label_values: The values of the labels
+            amount: The amount to add
+        Returns:
+            None
+        '''
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dec(self, label_values:tuple=(), amount:float=1)->None:
+        '''
+        Title: dec
+        Description: This function subtracts from the gauge of the label values.
+        Arguments:
+            label_values: The values of the labels
+            amount: The amount to subtract
+        Returns:
+            None
+        '''
+        self.inc(label_values, -amount)
+
+
+class Histogram(Metric):
+    '''
+    Title: Histogram
+    Description: Observations counted in cumulative buckets, with their sum and count.
+    '''
+
+    kind = "histogram"
+
+    def __init__(self, name:str, description:str, labels:tuple=(), buckets:tuple=LATENCY_BUCKETS):
+        '''
+        Title: __init__
+        Description: This function creates a histogram without observations.
+        Arguments:
+            name: The name of the metric
+            description: The help text of the metric
+            labels: The names of the labels
+            buckets: The upper bounds of the buckets, the +Inf bucket is added
+        Returns:
+            None
+        '''
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, label_values:tuple=(), value:float=0)->None:
+        '''
+        Title: observe
+        Description: This function counts one observation in the first bucket holding it, found by bisection, the render accumulates the buckets.
+        Arguments:
+            label_values: The values of the labels
+            value: The observed value
+        Returns:
+            None
+        '''
+        with self.lock:
+            counts = self.values.get(label_values)
+            if counts is None:
+                counts = self.values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            counts[0][bisect_left(self.buckets, value)] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    def render(self)->list:
+        '''
+        Title: render
+        Description: This function returns the cumulative buckets, the sum and the count of every label values in the Prometheus text format.
+        Arguments:
+            None
+        Returns:
+            lines: The HELP and TYPE lines and the samples
+        '''
+        with self.lock:
+            values = {label_values: ([*counts[0]], counts[1], counts[2]) for label_values, counts in self.values.items()}
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        for label_values, (buckets, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, buckets):
+                cumulative += bucket
+                lines.append(f"{self.name}_bucket{format_labels(self.labels + ('le',), label_values + (format_value(bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, label_values)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, label_values)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    '''
+    Title: MetricsRegistry
+    Description: Metrics of the process rendered together, with the gauges computed at scrape time by the collectors.
+    '''
+
+    def __init__(self):
+        '''
+        Title: __init__
+        Description: This function creates an empty registry.
+        Arguments:
+            None
+        Returns:
+            None
+        '''
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric:Metric)->Metric:
+        '''
+        Title: register
+        Description: This function adds a metric to the rendered ones.
+        Arguments:
+            metric: The metric
+        Returns:
+            metric: The same metric, to be assigned by the caller
+        '''
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, prefix:str, description:str, collect)->None:
+        '''
+        Title: add_collector
+        Description: This function adds a function whose numeric statistics are exposed as gauges on every scrape.
+        Arguments:
+            prefix: The prefix of the gauge names
+            description: The help text of the gauges
+            collect: The function returning a dictionary of statistics, the values that are not numbers are skipped
+        Returns:
+            None
+        '''
+        self.collectors.append((prefix, description, collect))
+
+    def render(self)->str:
+        '''
+        Title: render
+        Description: This function returns every metric of the registry in the Prometheus text format.
+        Arguments:
+            None
+        Returns:
+            text: The metrics, one sample per line
+        '''
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for prefix, description, collect in self.collectors:
+            for key, value in collect().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.extend([f"# HELP {prefix}_{key} {description}", f"# TYPE {prefix}_{key} gauge", f"{prefix}_{key} {format_value(value)}"])
+        return "\n".join(lines) + "\n"
+
+
+
+# Request timing
+############################################################################################################
+
+
+def start_request_timing()->None:
+    '''
+    Title: start_request_timing
+    Description: This function starts adding the SQL and serialization time spent by the thread to the current request.
+    Arguments:
+        None
+    Returns:
+        None
+    '''
+    REQUEST_TIMING.sql = 0.0
+    REQUEST_TIMING.serialize = 0.0
+
+
+def add_request_time(phase:str, seconds:float)->None:
+    '''
+    Title: add_request_time
+    Description: This function adds time to a phase of the request of the thread, threads outside a request are ignored.
+    Arguments:
+        phase: sql or serialize
+        seconds: The time spent
+    Returns:
+        None
+    '''
+    if hasattr(REQUEST_TIMING, phase):
+        setattr(REQUEST_TIMING, phase, getattr(REQUEST_TIMING, phase) + seconds)
+
+
+def stop_request_timing()->tuple:
+    '''
+    Title: stop_request_timing
+    Description: This function stops the timing of the request of the thread.
+    Arguments:
+        None
+    Returns:
+        sql, serialize: The seconds spent in the database and serializing the response
+    '''
+    timing = (getattr(REQUEST_TIMING, "sql", 0.0), getattr(REQUEST_TIMING, "serialize", 0.0))
+    REQUEST_TIMING.__dict__.clear()
+    return timing
+
+
+
+# SQL timing
+############################################################################################################
+
+
+def get_statement_label(statement:str)->str:
+    '''
+    Title: get_statement_label
+    Description: This function names a statement by its kind and first table, so the label values stay few.
+    Arguments:
+        statement: The SQL statement
+    Returns:
+        label: The kind and the table i.e SELECT refinery
+    '''
+    words = statement.split(None, 1)
+    if not words:
+        return "other"
+    kind, rest = words[0].upper(), words[1] if len(words) > 1 else ""
+    
+    # The statement following the common table expressions
+    if kind == "WITH":
+        match = MAIN_STATEMENT_PATTERN.search(rest)
+        if match is None:
+            return kind
+        kind, rest = match.group(1).upper(), rest[match.end():]
+    
+    match = TABLE_PATTERNS[kind].search(rest) if kind in TABLE_PATTERNS else None
+    return f"{kind} {match.group(1)}" if match else kind
+
+
+def instrument_engine(engine, statement_seconds:Histogram, statement_rows:Histogram)->None:
+    '''
+    Title: instrument_engine
+    Description: This function times every statement of the engine with cursor events and counts the rows it returned or changed.
+        The time is also added to the request running on the thread.
+    Arguments:
+        engine: The engine object to connect to the database
+        statement_seconds: The histogram of the durations, labeled by statement
+        statement_rows: The histogram of the row counts, labeled by statement
+    Returns:
+        None
+    '''
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("statement_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info["statement_start"].pop()
+        label = (get_statement_label(statement),)
+        statement_seconds.observe(label, seconds)
+        add_request_time("sql", seconds)
+
+        # SQLite does not count the rows of a SELECT
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            statement_rows.observe(label, cursor.rowcount)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        if context.connection is not None and context.connection.info.get("statement_start"):
+            context.connection.info["statement_start"].pop()
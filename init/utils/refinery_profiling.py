@@ -0,0 +1,340 @@
+# Global imports
+from collections import deque
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+
+from sqlalchemy import event
+
+
+# Constants, overridden by the REFINERY_* environment variables, see get_profile_config
+# Token of the admins, profiling on demand is disabled without it
+PROFILE_TOKEN = ""
+
+# Share of the requests profiled without being asked, 0 to disable
+PROFILE_SAMPLE_RATE = 0.0
+
+PROFILE_DIR = "profiles"
+
+# Profiles kept in PROFILE_DIR, the oldest are deleted
+PROFILE_KEEP = 100
+
+# Lines of the profile summaries
+PROFILE_LIMIT = 40
+
+PROFILE_SORT_KEYS = ("cumulative", "tottime", "calls", "ncalls", "time")
+
+# Header or query parameter carrying the token
+PROFILE_HEADER = "X-Refinery-Profile"
+PROFILE_PARAMETER = "profile"
+
+# Milliseconds above which a statement is logged, 0 to disable
+SLOW_QUERY_MS = 500
+
+# Slow statements kept in memory for the slow query route
+SLOW_QUERY_KEEP = 100
+
+# Characters of the parameters logged with a slow statement
+SLOW_QUERY_PARAMETERS_LENGTH = 1000
+
+PROFILE_NAME_PATTERN = re.compile(r"^[\w.-]+\.prof$")
+
+# From Python 3.12 cProfile records the calls of every thread of the process, not only the one that enabled it
+THREAD_WIDE_PROFILER = sys.version_info >= (3, 12)
+
+
+# Import logging
+import logging
+
+# Set up logging, the slow statements go to their own file
+SLOW_QUERY_LOGGER = logging.getLogger("refinery.slow_query")
+SLOW_QUERY_LOGGER.setLevel(logging.WARNING)
+SLOW_QUERY_FORMAT = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+SLOW_QUERY_FILE_HANDLER = logging.FileHandler('slow_query.log')
+SLOW_QUERY_FILE_HANDLER.setFormatter(SLOW_QUERY_FORMAT)
+SLOW_QUERY_LOGGER.addHandler(SLOW_QUERY_FILE_HANDLER)
+
+
+
+# Configuration
+############################################################################################################
+
+
+def get_profile_config()->dict:
+    '''
+    Title: get_profile_config
+    Description: This function reads the profiling configuration from the environment, the constants of this module are the defaults.
+        REFINERY_PROFILE_TOKEN, REFINERY_PROFILE_SAMPLE_RATE, REFINERY_PROFILE_DIR and REFINERY_SLOW_QUERY_MS.
+    Arguments:
+        None
+    Returns:
+        config: The token, sample rate, profile directory and slow query threshold
+    '''
+    environ = os.environ
+
+    return {
+        "token": environ.get("REFINERY_PROFILE_TOKEN", PROFILE_TOKEN),
+        "sample_rate": float(environ.get("REFINERY_PROFILE_SAMPLE_RATE", PROFILE_SAMPLE_RATE)),
+        "directory": environ.get("REFINERY_PROFILE_DIR", PROFILE_DIR),
+        "slow_query_ms": float(environ.get("REFINERY_SLOW_QUERY_MS", SLOW_QUERY_MS))
+    }
+
+
+def is_admin(token:str, given:str)->bool:
+    '''
+    Title: is_admin
+    Description: This function checks the token given by a client in constant time.
+    Arguments:
+        token: The token of the admins, empty to refuse everyone
+        given: The token given by the client, None if absent
+    Returns:
+        admin: True if the tokens match
+    '''
+    return bool(token) and given is not None and hmac.compare_digest(token.encode(), given.encode())
+
+
+
+# Request profiling
+############################################################################################################
+
+
+class RequestProfiler:
+    '''
+    Title: RequestProfiler
+    Description: cProfile of the requests asked by an admin or drawn by the sample rate, one at a time.
+        Python 3.12 allows a single active profiler per process, a request arriving while another is profiled is served without profiling.
+        That profiler also records the other threads, so under the gthread worker the calls of the concurrent requests would end up in the profile.
+        With such a profiler a request is only profiled when no other one is in flight, and the requests arriving meanwhile wait for its end.
+        The profiles are stored as pstats files, loadable by pstats or snakeviz.
+    '''
+
+    def __init__(self, directory:str=PROFILE_DIR, sample_rate:float=PROFILE_SAMPLE_RATE, keep:int=PROFILE_KEEP, draw=random.random,
+                 thread_wide:bool=THREAD_WIDE_PROFILER):
+        '''
+        Title: __init__
+        Description: This function creates the profiler of the process.
+        Arguments:
+            directory: The folder of the stored profiles
+            sample_rate: The share of the requests profiled without being asked
+            keep: The number of stored profiles
+            draw: The function returning a number between 0 and 1
+            thread_wide: True if the profiler records every thread, see THREAD_WIDE_PROFILER
+        Returns:
+            None
+        '''
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.keep = keep
+        self.draw = draw
+        self.thread_wide = thread_wide
+        self.condition = threading.Condition()
+        self.active = False
+        self.in_flight = 0
+        self.profiled = 0
+        self.skipped = 0
+
+    def start(self, asked:bool):
+        '''
+        Title: start
+        Description: This function counts the request in flight and starts profiling it if it was asked or drawn and no other request is profiled.
+            Every call must be followed by finish once the request is served.
+        Arguments:
+            asked: True if an admin asked for the profile
+        Returns:
+            profile: The running profile and its name, None if the request is not profiled
+        '''
+        with self.condition:
+            # Keep the calls of this request out of the running profile
+            if self.thread_wide:
+                self.condition.wait_for(lambda: not self.active)
+            self.in_flight += 1
+
+            if not asked and (self.sample_rate <= 0 or self.draw() >= self.sample_rate):
+                return None
+
+            # One profile at a time, and alone when the other threads are recorded too
+            if self.active or (self.thread_wide and self.in_flight > 1):
+                self.skipped += 1
+                return None
+            self.active = True
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another tool holds the profiler of the interpreter
+            self.release()
+            self.skipped += 1
+            return None
+
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:8]}.prof"
+        return profiler, name
+
+    def stop(self, profile)->str:
+        '''
+        Title: stop
+        Description: This function stops the profile of the request and stores it, deleting the oldest profiles beyond keep.
+        Arguments:
+            profile: The running profile and its name returned by start
+        Returns:
+            path: The path of the stored profile
+        '''
+        profiler, name = profile
+        try:
+            profiler.disable()
+        finally:
+            self.release()
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        profiler.dump_stats(path)
+        self.profiled += 1
+
+        # Keep the newest profiles
+        stored = sorted(entry for entry in os.listdir(self.directory) if PROFILE_NAME_PATTERN.match(entry))
+        for entry in stored[:-self.keep] if self.keep else []:
+            os.remove(os.path.join(self.directory, entry))
+
+        return path
+
+    def release(self)->None:
+        '''
+        Title: release
+        Description: This function lets another request be profiled and wakes the requests waiting for the end of the profile.
+        Arguments:
+            None
+        Returns:
+            None
+        '''
+        with self.condition:
+            self.active = False
+            self.condition.notify_all()
+
+    def finish(self, profile)->str:
+        '''
+        Title: finish
+        Description: This function ends a request counted by start, storing its profile if it was profiled.
+        Arguments:
+            profile: The running profile and its name returned by start, None if the request was not profiled
+        Returns:
+            path: The path of the stored profile, None if the request was not profiled
+        '''
+        try:
+            return self.stop(profile) if profile is not None else None
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+
+    def list_profiles(self)->list:
+        '''
+        Title: list_profiles
+        Description: This function lists the stored profiles, newest first.
+        Arguments:
+            None
+        Returns:
+            names: The file names of the profiles
+        '''
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted((entry for entry in os.listdir(self.directory) if PROFILE_NAME_PATTERN.match(entry)), reverse=True)
+
+    def get_profile_path(self, name:str)->str:
+        '''
+        Title: get_profile_path
+        Description: This function returns the path of a stored profile, refusing names outside the profile folder.
+        Arguments:
+            name: The file name of the profile
+        Returns:
+            path: The path of the profile, None if there is no such profile
+        '''
+        if not PROFILE_NAME_PATTERN.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        return os.path.abspath(path) if os.path.isfile(path) else None
+
+
+def format_profile(path:str, sort:str="cumulative", limit:int=PROFILE_LIMIT)->str:
+    '''
+    Title: format_profile
+    Description: This function summarizes a stored profile, the functions taking the most time first.
+    Arguments:
+        path: The path of the profile
+        sort: The pstats sort key, one of PROFILE_SORT_KEYS
+        limit: The number of functions listed
+    Returns:
+        text: The pstats report
+    '''
+    stream = io.StringIO()
+    pstats.Stats(path, stream=stream).strip_dirs().sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
+
+
+
+# Slow query log
+############################################################################################################
+
+
+def format_parameters(parameters, executemany:bool)->str:
+    '''
+    Title: format_parameters
+    Description: This function formats the parameters of a statement for the log, truncated.
+    Arguments:
+        parameters: The parameters given to the cursor
+        executemany: True if the parameters are a list of parameter sets
+    Returns:
+        text: The parameters, the number of sets for an executemany
+    '''
+    text = repr(parameters)
+    if executemany:
+        text = f"{len(parameters)} sets, first {parameters[0]!r}" if parameters else "0 sets"
+    return text if len(text) <= SLOW_QUERY_PARAMETERS_LENGTH else text[:SLOW_QUERY_PARAMETERS_LENGTH] + "..."
+
+
+def log_slow_queries(engine, threshold_ms:float=SLOW_QUERY_MS, keep:int=SLOW_QUERY_KEEP)->deque:
+    '''
+    Title: log_slow_queries
+    Description: This function logs the statements of the engine slower than the threshold with their parameters, timed by cursor events.
+    Arguments:
+        engine: The engine object to connect to the database
+        threshold_ms: The milliseconds above which a statement is logged, 0 to disable
+        keep: The number of slow statements kept in memory
+    Returns:
+        slow_queries: The latest slow statements, newest last, as dictionaries with the time, duration, statement and parameters
+    '''
+    slow_queries = deque(maxlen=keep)
+    if threshold_ms <= 0:
+        return slow_queries
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("slow_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        milliseconds = (time.perf_counter() - conn.info["slow_query_start"].pop()) * 1000
+        if milliseconds < threshold_ms:
+            return
+
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "milliseconds": round(milliseconds, 3),
+            "statement": statement,
+            "parameters": format_parameters(parameters, executemany)
+        }
+        slow_queries.append(entry)
+        SLOW_QUERY_LOGGER.warning("Slow statement %.1f ms: %s | parameters: %s", milliseconds, " ".join(statement.split()), entry["parameters"])
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        if context.connection is not None and context.connection.info.get("slow_query_start"):
+            context.connection.info["slow_query_start"].pop()
+
+    return slow_queries
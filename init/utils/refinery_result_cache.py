@@ -0,0 +1,126 @@
+# Global imports
+from collections import OrderedDict
+import threading
+import time
+
+
+# Constants
+RESULT_CACHE_SIZE = 256
+
+RESULT_CACHE_TTL = 60
+
+
+
+# Result cache
+############################################################################################################
+
+
+class ResultCache:
+    '''
+    Title: ResultCache
+    Description: Thread safe LRU cache whose entries expire after a time to live.
+        Every entry is stored with the generation it was computed at. A write bumps the generation,
+        which drops every entry and refuses results computed before the write.
+    '''
+
+    def __init__(self, maxsize:int=RESULT_CACHE_SIZE, ttl:float=RESULT_CACHE_TTL, clock=time.monotonic):
+        '''
+        Title: __init__
+        Description: This function creates an empty cache.
+        Arguments:
+            maxsize: The maximum number of entries
+            ttl: The time to live of an entry in seconds
+            clock: The function returning the current time in seconds
+        Returns:
+            None
+        '''
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        '''
+        Title: get
+        Description: This function returns the cached value of the key and marks it as recently used.
+        Arguments:
+            key: The key of the entry
+        Returns:
+            value: The cached value, None if it is missing or expired
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+
+            # Missing or expired
+            if entry is None or entry[0] <= self.clock():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, generation:int)->None:
+        '''
+        Title: put
+        Description: This function caches the value of the key, unless a write happened since it was computed.
+        Arguments:
+            key: The key of the entry
+            value: The value to cache
+            generation: The generation read before computing the value
+        Returns:
+            None
+        '''
+        with self.lock:
+            if generation != self.generation:
+                return
+
+            self.entries[key] = (self.clock() + self.ttl, value)
+            self.entries.move_to_end(key)
+
+            # Drop the least recently used entries
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self)->None:
+        '''
+        Title: invalidate
+        Description: This function bumps the generation and drops every entry, to be called after a write commits.
+        Arguments:
+            None
+        Returns:
+            None
+        '''
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self)->dict:
+        '''
+        Title: stats
+        Description: This function returns the counters of the cache.
+        Arguments:
+            None
+        Returns:
+            stats: The size, limits, generation, hits, misses and evictions of the cache
+        '''
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "generation": self.generation,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
@@ -0,0 +1,176 @@
+# Global imports
+import re
+import threading
+
+from sqlalchemy import text, select, func
+
+from utils.refinery_db_io import Refinery, REFINERY_RESPONSE_COLUMNS
+
+
+# Constants
+SEARCH_LIMIT = 20
+
+MAX_SEARCH_LIMIT = 100
+
+# Default similarity threshold of pg_trgm
+SEARCH_THRESHOLD = 0.3
+
+# Words as pg_trgm splits them, runs of letters and digits
+WORD_PATTERN = re.compile(r"[^\W_]+")
+
+
+
+# Trigrams
+############################################################################################################
+
+
+def get_trigrams(name:str)->set:
+    '''
+    Title: get_trigrams
+    Description: This function returns the trigrams of a name the way pg_trgm computes them, so both indexes agree on the scores.
+        The name is lowercased and split into words, each word is padded with two spaces before and one after.
+    Arguments:
+        name: The text to split
+    Returns:
+        trigrams: The set of trigrams
+    '''
+    trigrams = set()
+    for word in WORD_PATTERN.findall(name.lower()):
+        padded = f"  {word} "
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+
+def get_similarity(shared:int, first:int, second:int)->float:
+    '''
+    Title: get_similarity
+    Description: This function returns the similarity of pg_trgm, the shared trigrams over the trigrams of both texts.
+    Arguments:
+        shared: The number of trigrams in both texts
+        first: The number of trigrams of the first text
+        second: The number of trigrams of the second text
+    Returns:
+        similarity: A number between 0 and 1
+    '''
+    union = first + second - shared
+    return shared / union if union else 0.0
+
+
+
+# In process index
+############################################################################################################
+
+
+class TrigramIndex:
+    '''
+    Title: TrigramIndex
+    Description: Inverted index from the trigrams of the refinery names to the refineries, for databases without pg_trgm.
+        It is built from the whole table and remembers the table version it was built at, the caller rebuilds it when the version moves.
+    '''
+
+    def __init__(self):
+        '''
+        Title: __init__
+        Description: This function creates an empty index.
+        Arguments:
+            None
+        Returns:
+            None
+        '''
+        self.lock = threading.Lock()
+        self.version = None
+        self.postings = {}
+        self.refineries = {}
+        self.sizes = {}
+
+    def build(self, refineries:list, version:int)->None:
+        '''
+        Title: build
+        Description: This function indexes the names of the refineries, replacing the previous content at once.
+        Arguments:
+            refineries: The refineries in the shape of Refinery.to_dict
+            version: The version of the table the refineries were read at
+        Returns:
+            None
+        '''
+        postings, by_id, sizes = {}, {}, {}
+        for refinery in refineries:
+            trigrams = get_trigrams(refinery["refinery"])
+            by_id[refinery["index"]] = refinery
+            sizes[refinery["index"]] = len(trigrams)
+            for trigram in trigrams:
+                postings.setdefault(trigram, []).append(refinery["index"])
+
+        with self.lock:
+            self.postings, self.refineries, self.sizes, self.version = postings, by_id, sizes, version
+
+    def search(self, query:str, limit:int=SEARCH_LIMIT, threshold:float=SEARCH_THRESHOLD)->list:
+        '''
+        Title: search
+        Description: This function ranks the refineries sharing trigrams with the query by similarity.
+            Only the refineries of the posting lists of the query are scored, not the whole table.
+        Arguments:
+            query: The searched text
+            limit: The maximum number of results
+            threshold: The minimum similarity of a result
+        Returns:
+            results: The refineries with their score, best first then by id
+        '''
+        trigrams = get_trigrams(query)
+
+        with self.lock:
+            postings, by_id, sizes = self.postings, self.refineries, self.sizes
+
+        # Count the shared trigrams of every candidate
+        shared = {}
+        for trigram in trigrams:
+            for refinery_id in postings.get(trigram, ()):
+                shared[refinery_id] = shared.get(refinery_id, 0) + 1
+
+        scores = [(get_similarity(count, len(trigrams), sizes[refinery_id]), refinery_id) for refinery_id, count in shared.items()]
+        scores = sorted([item for item in scores if item[0] >= threshold], key=lambda item: (-item[0], item[1]))
+
+        return [dict(by_id[refinery_id], score=score) for score, refinery_id in scores[:limit]]
+
+
+
+# Postgres search
+############################################################################################################
+
+
+def has_trigram_index(conn)->bool:
+    '''
+    Title: has_trigram_index
+    Description: This function tells if the database can search the refinery names with pg_trgm.
+    Arguments:
+        conn: The connection to the database
+    Returns:
+        available: True on Postgres with the pg_trgm extension
+    '''
+    if conn.dialect.name != "postgresql":
+        return False
+    return conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first() is not None
+
+
+def search_refineries(conn, query:str, limit:int=SEARCH_LIMIT, threshold:float=SEARCH_THRESHOLD)->list:
+    '''
+    Title: search_refineries
+    Description: This function ranks the refineries by the pg_trgm similarity of their name to the query.
+        The % operator uses the GIN index, its threshold is set for the current transaction only.
+    Arguments:
+        conn: The connection to the Postgres database
+        query: The searched text
+        limit: The maximum number of results
+        threshold: The minimum similarity of a result
+    Returns:
+        results: The refineries with their score, best first then by id
+    '''
+    conn.execute(select(func.set_config("pg_trgm.similarity_threshold", str(threshold), True)))
+
+    score = func.similarity(Refinery.refinery, query).label("score")
+    statement = select(*REFINERY_RESPONSE_COLUMNS, score) \
+        .where(Refinery.refinery.op("%")(query)) \
+        .order_by(score.desc(), Refinery.refinery_id) \
+        .limit(limit)
+
+    return [dict(row) for row in conn.execute(statement).mappings()]
@@ -0,0 +1,164 @@
+# Global imports
+from bisect import bisect_left, insort
+import threading
+
+
+# Constants
+SUGGEST_LIMIT = 10
+
+MAX_SUGGEST_LIMIT = 100
+
+# Seconds between two checks of the table version, to catch the writes of the other workers
+SUGGEST_REFRESH_INTERVAL = 5
+
+# Columns suggested, in the order of the results sharing a name
+SUGGEST_KINDS = ("region", "country", "refinery")
+
+
+
+# Prefix index
+############################################################################################################
+
+
+class SuggestIndex:
+    '''
+    Title: SuggestIndex
+    Description: Sorted arrays of the distinct regions, countries and refinery names, searched by prefix with bisect.
+        Every entry is counted by the refineries holding it and dropped when the count falls to 0.
+        The index remembers the table version it reflects, writes applied in place move it forward one version at a time.
+    '''
+
+    def __init__(self):
+        '''
+        Title: __init__
+        Description: This function creates an empty index.
+        Arguments:
+            None
+        Returns:
+            None
+        '''
+        self.lock = threading.Lock()
+        self.version = None
+        self.entries = {kind: [] for kind in SUGGEST_KINDS}
+        self.counts = {}
+        self.refineries = {}
+
+    def build(self, refineries:list, version:int)->None:
+        '''
+        Title: build
+        Description: This function indexes the refineries, replacing the previous content at once.
+        Arguments:
+            refineries: The refineries in the shape of Refinery.to_dict
+            version: The version of the table the refineries were read at
+        Returns:
+            None
+        '''
+        counts, by_id = {}, {}
+        for refinery in refineries:
+            values = tuple(refinery[kind] for kind in SUGGEST_KINDS)
+            by_id[refinery["index"]] = values
+            for kind, value in zip(SUGGEST_KINDS, values):
+                counts[(kind, value)] = counts.get((kind, value), 0) + 1
+
+        entries = {kind: [] for kind in SUGGEST_KINDS}
+        for kind, value in counts:
+            entries[kind].append((value.lower(), value))
+        for kind in SUGGEST_KINDS:
+            entries[kind].sort()
+
+        with self.lock:
+            self.entries, self.counts, self.refineries, self.version = entries, counts, by_id, version
+
+    def update(self, refineries:list, deleted:list, version:int)->bool:
+        '''
+        Title: update
+        Description: This function applies a committed write to the index, without reading the table.
+            A write the index already holds is skipped. If writes were missed in between, the changes are applied
+            but the version stays behind so the next check rebuilds the index.
+        Arguments:
+            refineries: The inserted or updated refineries in the shape of Refinery.to_dict
+            deleted: The ids of the deleted refineries
+            version: The version of the table after the write
+        Returns:
+            current: True if the index is at the version of the write
+        '''
+        with self.lock:
+            if self.version is None or version <= self.version:
+                return self.version == version
+
+            for refinery_id in deleted:
+                self._discard(refinery_id)
+
+            for refinery in refineries:
+                self._discard(refinery["index"])
+                values = tuple(refinery[kind] for kind in SUGGEST_KINDS)
+                self.refineries[refinery["index"]] = values
+                for kind, value in zip(SUGGEST_KINDS, values):
+                    self._count(kind, value, 1)
+
+            if version == self.version + 1:
+                self.version = version
+            return self.version == version
+
+    def _discard(self, refinery_id:int)->None:
+        '''
+        Title: _discard
+        Description: This function uncounts the values of a refinery, the caller holds the lock.
+        Arguments:
+            refinery_id: The id of the refinery
+        Returns:
+            None
+        '''
+        values = self.refineries.pop(refinery_id, None)
+        if values is not None:
+            for kind, value in zip(SUGGEST_KINDS, values):
+                self._count(kind, value, -1)
+
+    def _count(self, kind:str, value:str, change:int)->None:
+        '''
+        Title: _count
+        Description: This function changes the count of a value, inserting or removing its entry of the sorted array of its column, the caller holds the lock.
+        Arguments:
+            kind: The column of the value
+            value: The value
+            change: 1 or -1
+        Returns:
+            None
+        '''
+        count = self.counts.get((kind, value), 0) + change
+        entries, entry = self.entries[kind], (value.lower(), value)
+
+        if count > 0:
+            if (kind, value) not in self.counts:
+                insort(entries, entry)
+            self.counts[(kind, value)] = count
+        elif (kind, value) in self.counts:
+            del self.counts[(kind, value)]
+            del entries[bisect_left(entries, entry)]
+
+    def suggest(self, prefix:str, limit:int=SUGGEST_LIMIT, kind:str=None)->list:
+        '''
+        Title: suggest
+        Description: This function returns the values starting with the prefix, case insensitive, in alphabetical order.
+            The first match of every column is found by bisection and at most limit matches are read from each.
+        Arguments:
+            prefix: The typed text
+            limit: The maximum number of values
+            kind: The column to suggest, all of them if None
+        Returns:
+            suggestions: Dictionaries with the kind, the value and the number of refineries holding it
+        '''
+        prefix = prefix.lower()
+        matches = []
+
+        with self.lock:
+            for column in SUGGEST_KINDS if kind is None else (kind,):
+                entries = self.entries[column]
+                start = bisect_left(entries, (prefix,))
+                for key, value in entries[start:start + limit]:
+                    if not key.startswith(prefix):
+                        break
+                    matches.append((key, SUGGEST_KINDS.index(column), value, self.counts[(column, value)]))
+
+        # Merge the columns, the same name in several columns keeps the order of SUGGEST_KINDS
+        return [{"kind": SUGGEST_KINDS[order], "value": value, "count": count} for _, order, value, count in sorted(matches)[:limit]]